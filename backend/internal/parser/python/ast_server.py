@@ -1,9 +1,14 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional, Any, List, Dict
 import uvicorn
 import ast
 from ast_service import analyze_code 
+import python_debugger
+from debug_connection import DebugConnection, OUTPUT_INTERVAL
 
 app = FastAPI(title="Code Parser Service")
 
@@ -12,6 +17,12 @@ class ParseRequest(BaseModel):
     test_case: Optional[Any] = None
     language: str = "python"
 
+class JudgeRequest(BaseModel):
+    code: str
+    # Objects with input_data and expected_output, like the test case table
+    test_cases: List[Any]
+    max_seconds: Optional[float] = None
+
 class ParseResponse(BaseModel):
     is_valid: bool
     errors: List[Dict[str, Any]]
@@ -25,6 +36,48 @@ class ParseResponse(BaseModel):
 async def health_check():
     return {"status": "healthy", "service": "python-parser"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text format
+    return python_debugger.get_metrics()
+
+@app.post("/judge")
+async def judge(request: JudgeRequest):
+    # Waits for every test case, so it runs in a thread
+    result = await run_in_threadpool(python_debugger.judge, request.code, request.test_cases,
+                                     request.max_seconds)
+    if "error" in result:
+        raise HTTPException(status_code=400, detail={"message": result["error"]})
+    return result
+
+@app.websocket("/debug/ws")
+async def debug_socket(websocket: WebSocket):
+    # One debug session per socket, see DebugConnection for the messages
+    await websocket.accept()
+    connection = DebugConnection()
+    try:
+        while True:
+            message = await websocket.receive_json()
+            if not isinstance(message, dict):
+                await websocket.send_json({"event": "error", "message": "Messages must be JSON objects"})
+                continue
+
+            # Commands block until the program stops, so they run in a thread
+            # while the output printed meanwhile is pushed to the client
+            command = asyncio.ensure_future(run_in_threadpool(connection.handle, message))
+            while True:
+                done, _ = await asyncio.wait([command], timeout=OUTPUT_INTERVAL)
+                if done:
+                    break
+                event = await run_in_threadpool(connection.output_event)
+                if event is not None:
+                    await websocket.send_json(event)
+            await websocket.send_json(command.result())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await run_in_threadpool(connection.close)
+
 @app.post("/parse", response_model=ParseResponse)
 async def parse_code(request: ParseRequest):
     try:
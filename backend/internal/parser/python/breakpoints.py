@@ -0,0 +1,171 @@
+import re
+import time
+from types import CodeType
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from expressions import bounded_eval
+
+# Hit conditions: "5" or "==5" (5th hit only), ">5", ">=5" and "%5" (every 5th hit)
+HIT_CONDITION = re.compile(r"^\s*(==|>=|>|%)?\s*(\d+)\s*$")
+
+# Characters of a formatted logpoint value
+MAX_LOG_VALUE = 200
+
+# Seconds a condition, or all the expressions of a log message, may take at one hit
+EXPRESSION_BUDGET = 0.05
+
+
+def _hit_test(hit_condition: str) -> Callable[[int], bool]:
+    match = HIT_CONDITION.match(hit_condition)
+    if match is None:
+        raise ValueError(f"Invalid hit condition: {hit_condition!r}, expected N, >N, >=N or %N")
+
+    operator, count = match.group(1) or "==", int(match.group(2))
+    if operator == "%":
+        if count == 0:
+            raise ValueError("Hit condition %0 would never stop")
+        return lambda hits: hits % count == 0
+    if operator == ">":
+        return lambda hits: hits > count
+    if operator == ">=":
+        return lambda hits: hits >= count
+    return lambda hits: hits == count
+
+
+def _compile_template(message: str) -> List[Union[str, CodeType]]:
+    """
+    Split a logpoint message into literal text and compiled {expressions}.
+    Braces can be nested inside expressions, "{{" and "}}" are literal braces.
+    """
+    parts: List[Union[str, CodeType]] = []
+    text = []
+    index = 0
+    while index < len(message):
+        char = message[index]
+        if char in "{}" and message[index:index + 2] == char * 2:
+            text.append(char)
+            index += 2
+            continue
+        if char == "}":
+            raise ValueError("Single '}' in log message")
+        if char != "{":
+            text.append(char)
+            index += 1
+            continue
+
+        depth, end = 1, index + 1
+        while end < len(message) and depth:
+            depth += {"{": 1, "}": -1}.get(message[end], 0)
+            end += 1
+        if depth:
+            raise ValueError("Unclosed '{' in log message")
+
+        if text:
+            parts.append("".join(text))
+            text = []
+        expression = message[index + 1:end - 1].strip()
+        parts.append(compile(expression, "<logpoint>", "eval"))
+        index = end
+
+    if text:
+        parts.append("".join(text))
+    return parts
+
+
+class Breakpoint:
+    """
+    A line breakpoint of a debug session.
+
+    A condition makes it only count when the expression is true in the
+    paused frame, a hit condition only stops on some of the counted hits,
+    and a log message turns it into a logpoint, which writes the message
+    with its {expressions} formatted instead of stopping. Expressions are
+    compiled once, when the breakpoint is set, and evaluated with
+    bounded_eval, within EXPRESSION_BUDGET.
+    """
+
+    __slots__ = ("line", "condition", "hit_condition", "log_message", "hits", "error",
+                 "_condition_code", "_hit_test", "_log_parts")
+
+    def __init__(self, line: int, condition: Optional[str] = None,
+                 hit_condition: Optional[str] = None, log_message: Optional[str] = None):
+        """
+        Raises:
+            SyntaxError: If the condition or a logged expression is invalid
+            ValueError: If the hit condition or log message is malformed
+        """
+        self.line = line
+        self.condition = condition or None
+        self.hit_condition = hit_condition or None
+        self.log_message = log_message or None
+        # Times the line was reached with the condition true
+        self.hits = 0
+        # Last error raised by the condition
+        self.error: Optional[str] = None
+
+        self._condition_code = compile(condition, "<condition>", "eval") if self.condition else None
+        self._hit_test = _hit_test(hit_condition) if self.hit_condition else None
+        self._log_parts = _compile_template(log_message) if self.log_message else None
+
+    @property
+    def is_plain(self) -> bool:
+        """True for a breakpoint that stops every time its line is reached."""
+        return self.condition is None and self.hit_condition is None and self.log_message is None
+
+    def copy(self) -> 'Breakpoint':
+        """Same breakpoint with its hit count reset."""
+        return Breakpoint(self.line, self.condition, self.hit_condition, self.log_message)
+
+    def hit(self, frame_globals: Dict, frame_locals: Dict) -> bool:
+        """
+        Count a line event on the breakpoint's line.
+
+        Returns:
+            True if the program should stop there (or log, for a logpoint).
+            A condition that raises an exception or runs out of time stops
+            the program, so the error can be seen.
+        """
+        if self._condition_code is not None:
+            try:
+                deadline = time.perf_counter() + EXPRESSION_BUDGET
+                if not bounded_eval(self._condition_code, frame_globals, frame_locals, deadline):
+                    return False
+                self.error = None
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                return True
+
+        self.hits += 1
+        return self._hit_test is None or self._hit_test(self.hits)
+
+    def format_log(self, frame_globals: Dict, frame_locals: Dict,
+                   format_value: Callable[[Any], str]) -> str:
+        """
+        Format the log message of a logpoint in a frame.
+
+        Args:
+            format_value: Turns the value of an {expression} into a string
+        """
+        pieces = []
+        deadline = time.perf_counter() + EXPRESSION_BUDGET
+        for part in self._log_parts:
+            if isinstance(part, str):
+                pieces.append(part)
+                continue
+            try:
+                value = bounded_eval(part, frame_globals, frame_locals, deadline)
+                text = value if isinstance(value, str) else format_value(value)
+            except Exception as e:
+                text = f"<{type(e).__name__}: {e}>"
+            pieces.append(text[:MAX_LOG_VALUE])
+        return "".join(pieces)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "line": self.line,
+            "condition": self.condition,
+            "hit_condition": self.hit_condition,
+            "log_message": self.log_message,
+            "hits": self.hits,
+            "error": self.error
+        }
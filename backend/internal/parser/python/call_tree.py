@@ -0,0 +1,204 @@
+from array import array
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# Calls recorded per execution before the recorder stops growing
+MAX_CALLS = 1000000
+
+# Marker in the return_value and end_step columns of calls still running
+ACTIVE = -1
+
+# Approximate bytes taken by an interned signature or value besides its text
+INTERNED_SIZE = 200
+
+
+class CallTreeRecorder:
+    """
+    Column store of every call and return of the user's functions.
+
+    Calls are numbered in the order they start, which is a pre-order walk of
+    the call tree, so the descendants of a call are the ids between it and
+    its subtree_end. Each call takes six 32-bit integers: the function and
+    its serialized arguments are interned together as a signature, return
+    values are interned too. A naive fib(25) (~250k calls) takes about 6 MB.
+    """
+
+    def __init__(self, max_calls: int = MAX_CALLS):
+        self.max_calls = max_calls
+        self.truncated = False
+
+        self.parent = array('i')
+        self.signature = array('i')
+        self.return_value = array('i')
+        self.start_step = array('i')
+        self.end_step = array('i')
+        self.subtree_end = array('i')
+
+        # Interned (function, args) signatures and return values
+        self.signatures: List[Tuple[str, str]] = []
+        self.signature_ids: Dict[Tuple[str, str], int] = {}
+        # Id of the first call with each signature
+        self.first_calls: List[int] = []
+        self.values: List[str] = []
+        self.value_ids: Dict[str, int] = {}
+        # Approximate bytes taken by the interned signatures and values
+        self.interned_size = 0
+
+        # Ids of the calls currently running, innermost last
+        self.active: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def memory_footprint(self) -> int:
+        """Approximate number of bytes held by the recorder."""
+        return len(self.parent) * 6 * self.parent.itemsize + self.interned_size
+
+    def on_call(self, function: str, args: str, step: int) -> None:
+        """Record the start of a call made at the given step."""
+        if len(self.parent) >= self.max_calls:
+            self.truncated = True
+            # Keep the active list balanced with on_return
+            self.active.append(ACTIVE)
+            return
+
+        call_id = len(self.parent)
+        key = (function, args)
+        signature = self.signature_ids.get(key)
+        if signature is None:
+            signature = len(self.signatures)
+            self.signatures.append(key)
+            self.signature_ids[key] = signature
+            self.first_calls.append(call_id)
+            self.interned_size += INTERNED_SIZE + len(function) + len(args)
+
+        self.parent.append(self.active[-1] if self.active else ACTIVE)
+        self.signature.append(signature)
+        self.return_value.append(ACTIVE)
+        self.start_step.append(step)
+        self.end_step.append(ACTIVE)
+        self.subtree_end.append(ACTIVE)
+        self.active.append(call_id)
+
+    def on_return(self, value: Optional[str], step: int) -> None:
+        """Record the end of the innermost running call."""
+        if not self.active:
+            return
+        call_id = self.active.pop()
+        if call_id == ACTIVE:
+            return
+
+        value_id = ACTIVE
+        if value is not None:
+            value_id = self.value_ids.get(value)
+            if value_id is None:
+                value_id = len(self.values)
+                self.values.append(value)
+                self.value_ids[value] = value_id
+                self.interned_size += INTERNED_SIZE + len(value)
+
+        self.return_value[call_id] = value_id
+        self.end_step[call_id] = step
+        self.subtree_end[call_id] = len(self.parent)
+
+    def _subtree_end(self, call_id: int) -> int:
+        end = self.subtree_end[call_id]
+        return len(self.parent) if end == ACTIVE else end
+
+    def children(self, call_id: Optional[int] = None) -> List[int]:
+        """
+        Ids of the direct callees of a call, or of the top-level calls.
+
+        Args:
+            call_id: The parent call, None for calls made from module level
+        """
+        if call_id is None:
+            child, end = 0, len(self.parent)
+        else:
+            child, end = call_id + 1, self._subtree_end(call_id)
+
+        children = []
+        while child < end:
+            children.append(child)
+            child = self._subtree_end(child)
+        return children
+
+    def call(self, call_id: int) -> Dict[str, Any]:
+        """Get one call as a dictionary."""
+        function, args = self.signatures[self.signature[call_id]]
+        value_id = self.return_value[call_id]
+        end_step = self.end_step[call_id]
+        return {
+            "id": call_id,
+            "parent": None if self.parent[call_id] == ACTIVE else self.parent[call_id],
+            "function": function,
+            "args": args,
+            "return_value": None if value_id == ACTIVE else self.values[value_id],
+            "start_step": self.start_step[call_id],
+            "end_step": None if end_step == ACTIVE else end_step,
+            "descendants": self._subtree_end(call_id) - call_id - 1
+        }
+
+    def subtree(self, call_id: Optional[int] = None, max_depth: int = 3,
+                max_nodes: int = 1000) -> List[Dict[str, Any]]:
+        """
+        Get part of the call tree as nested dictionaries.
+
+        Args:
+            call_id: Root of the subtree, None for the whole tree
+            max_depth: Levels of callees to include below the root
+            max_nodes: Maximum number of calls in the result
+
+        Returns:
+            The root call (or the top-level calls) with their "children".
+            Calls whose children were cut off by a budget have "children": None.
+        """
+        budget = [max_nodes]
+
+        def expand(ids: List[int], depth: int) -> List[Dict[str, Any]]:
+            nodes = []
+            for child in ids:
+                if budget[0] <= 0:
+                    break
+                budget[0] -= 1
+                node = self.call(child)
+                if node["descendants"] == 0:
+                    node["children"] = []
+                elif depth < max_depth and budget[0] > 0:
+                    node["children"] = expand(self.children(child), depth + 1)
+                else:
+                    node["children"] = None
+                nodes.append(node)
+            return nodes
+
+        if call_id is None:
+            return expand(self.children(), 1)
+        return expand([call_id], 0)
+
+    def repeated_calls(self, min_count: int = 2, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Find functions called several times with the same arguments.
+
+        Such calls are the ones memoization would save, e.g. fib(3) in a
+        naive recursive Fibonacci.
+
+        Args:
+            min_count: Minimum number of identical calls to report
+            limit: Maximum number of signatures to return
+
+        Returns:
+            The repeated signatures, most repeated first
+        """
+        counts = Counter(self.signature)
+        repeated = []
+        for signature, count in counts.most_common():
+            if count < min_count or len(repeated) >= limit:
+                break
+            function, args = self.signatures[signature]
+            repeated.append({
+                "function": function,
+                "args": args,
+                "count": count,
+                "first_call": self.first_calls[signature]
+            })
+        return repeated
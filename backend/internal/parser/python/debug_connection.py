@@ -0,0 +1,197 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import python_debugger
+
+# Seconds between two pushes of the output of a running program
+OUTPUT_INTERVAL = 0.1
+
+# Command -> (session function, its arguments after session_id, whether it returns a state)
+COMMANDS: Dict[str, Tuple[Callable, Tuple[str, ...], bool]] = {
+    "start": (python_debugger.start_execution, (), True),
+    "step": (python_debugger.step_forward, (), True),
+    "step_back": (python_debugger.step_backward, (), True),
+    "continue": (python_debugger.run_to_completion, ("max_steps", "max_seconds"), True),
+    "jump": (python_debugger.jump_to, ("step",), True),
+    "step_n": (python_debugger.step_n, ("n",), True),
+    "run_until_line": (python_debugger.run_until_line, ("line_number", "max_steps"), True),
+    "state": (python_debugger.get_execution_state, (), True),
+    "reset": (python_debugger.reset_session, (), True),
+    "set_breakpoint": (python_debugger.set_breakpoint,
+                       ("line_number", "condition", "hit_condition", "log_message"), False),
+    "remove_breakpoint": (python_debugger.remove_breakpoint, ("line_number",), False),
+    "toggle_breakpoint": (python_debugger.toggle_breakpoint, ("line_number",), False),
+    "add_watch": (python_debugger.add_watch, ("expression",), False),
+    "remove_watch": (python_debugger.remove_watch, ("expression",), False),
+    "get_variable": (python_debugger.get_variable, ("path", "offset", "limit"), False),
+    "get_frame_locals": (python_debugger.get_frame_locals, ("index",), False),
+    "get_call_tree": (python_debugger.get_call_tree, ("call_id", "max_depth"), False),
+    "get_repeated_calls": (python_debugger.get_repeated_calls, ("min_count",), False),
+}
+
+_OPTIONAL_INT = (int, type(None))
+_OPTIONAL_STR = (str, type(None))
+
+# Argument -> JSON types it may have, booleans aside
+ARGUMENT_TYPES: Dict[str, Tuple[type, ...]] = {
+    "code": (str,),
+    "test_case": _OPTIONAL_STR,
+    "session_id": (str,),
+    "max_steps": _OPTIONAL_INT,
+    "max_seconds": (int, float, type(None)),
+    "step": (int,),
+    "n": (int,),
+    "line_number": (int,),
+    "condition": _OPTIONAL_STR,
+    "hit_condition": _OPTIONAL_STR,
+    "log_message": _OPTIONAL_STR,
+    "expression": (str,),
+    "path": (str,),
+    "offset": (int,),
+    "limit": (int,),
+    "index": (int,),
+    "call_id": _OPTIONAL_INT,
+    "max_depth": (int,),
+    "min_count": (int,),
+}
+
+
+def _check_arguments(message: Dict[str, Any], names: Tuple[str, ...]) -> Optional[str]:
+    """The error for the first argument of a message with the wrong type, if any."""
+    for name in names:
+        if name not in message:
+            continue
+        value = message[name]
+        if isinstance(value, bool) or not isinstance(value, ARGUMENT_TYPES[name]):
+            return f"Invalid {name}: {value!r}"
+    return None
+
+
+class DebugConnection:
+    """
+    One client driving a debug session over a message channel, e.g. the
+    WebSocket of ast_server.
+
+    Messages are JSON objects with a "command" and its arguments, plus an
+    optional "request_id" echoed in the answer. "create" (code, test_case,
+    record) makes a new session for the connection and "attach" (session_id)
+    drives an existing one. The other commands map to the session functions
+    of python_debugger. Every command gets one answer:
+
+    - {"event": "state", ...} for commands that move the program or read its
+      state. After the first one, states are deltas since the last state
+      sent on the connection, see StateVersions.
+    - {"event": "result", "command", ...} for the other commands
+    - {"event": "error", "message"}, also for arguments of the wrong type
+      and commands that fail unexpectedly, so that no message can end the
+      connection
+
+    While a command runs, output_event() reads what the program printed
+    since the last message, to push it to the client as it happens.
+    Sessions created by the connection are deleted when it closes.
+    """
+
+    def __init__(self):
+        self.session_id: Optional[str] = None
+        self.owns_session = False
+        # Version of the last state sent, and where the output sent ends
+        self.version: Optional[int] = None
+        self.output_cursor: Optional[int] = None
+        self.output_partial = ""
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a command and build its answer."""
+        try:
+            answer = self._run(message)
+        except Exception as e:
+            python_debugger.logger.exception("Debug command %r failed", message.get("command"))
+            answer = {"event": "error", "message": f"{type(e).__name__}: {e}"}
+        if "request_id" in message:
+            answer["request_id"] = message["request_id"]
+        return answer
+
+    def _run(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        command = message.get("command")
+        if command == "create":
+            error = _check_arguments(message, ("code", "test_case"))
+            return {"event": "error", "message": error} if error else self._create(message)
+        if command == "attach":
+            error = _check_arguments(message, ("session_id",))
+            return {"event": "error", "message": error} if error else self._attach(message.get("session_id"))
+        if command == "close":
+            self.close()
+            return {"event": "result", "command": "close"}
+        if command not in COMMANDS:
+            return {"event": "error", "message": f"Unknown command: {command!r}"}
+        if self.session_id is None:
+            return {"event": "error", "message": "No session, send create or attach first"}
+
+        function, names, returns_state = COMMANDS[command]
+        error = _check_arguments(message, names)
+        if error is not None:
+            return {"event": "error", "message": error}
+        kwargs = {name: message[name] for name in names if name in message}
+        if returns_state:
+            kwargs["since_version"] = self.version
+        try:
+            result = function(self.session_id, **kwargs)
+        except TypeError as e:
+            # Missing argument
+            return {"event": "error", "message": str(e)}
+
+        if returns_state:
+            return self._state(result)
+        if result.get("error"):
+            return {"event": "error", "message": result["error"]}
+        return {"event": "result", "command": command, **result}
+
+    def _create(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        state = python_debugger.create_session(
+            message.get("code", ""), message.get("test_case"), bool(message.get("record"))
+        )
+        if "version" not in state and state.get("error"):
+            return {"event": "error", "message": state["error"]}
+        self.close()
+        self.session_id, self.owns_session = state["id"], True
+        return self._state(python_debugger.get_execution_state(self.session_id))
+
+    def _attach(self, session_id: Optional[str]) -> Dict[str, Any]:
+        state = python_debugger.get_execution_state(session_id)
+        if "version" not in state and state.get("error"):
+            return {"event": "error", "message": state["error"]}
+        self.close()
+        self.session_id, self.owns_session = session_id, False
+        return self._state(state)
+
+    def _state(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        if "version" not in state:
+            return {"event": "error", "message": state.get("error")}
+        self.version = state["version"]
+        if "output_cursor" in state:
+            self._sent_output(state)
+        return {"event": "state", **state}
+
+    def _sent_output(self, output: Dict[str, Any]) -> None:
+        cursor = output["output_cursor"]
+        self.output_cursor = cursor
+        self.output_partial = "".join(output["output"][cursor - output["output_start"]:])
+
+    def output_event(self) -> Optional[Dict[str, Any]]:
+        """New output of the session since the last message, if any."""
+        if self.session_id is None or self.output_cursor is None:
+            return None
+        output = python_debugger.get_output(self.session_id, self.output_cursor)
+        if "error" in output:
+            return None
+        partial = "".join(output["output"][output["output_cursor"] - output["output_start"]:])
+        if output["output_cursor"] == self.output_cursor and partial == self.output_partial:
+            return None
+        self._sent_output(output)
+        return {"event": "output", **output}
+
+    def close(self) -> None:
+        """Leave the session, deleting it if the connection created it."""
+        if self.session_id is not None and self.owns_session:
+            python_debugger.delete_session(self.session_id)
+        self.session_id, self.owns_session = None, False
+        self.version = self.output_cursor = None
+        self.output_partial = ""
@@ -0,0 +1,53 @@
+import sys
+import time
+from types import CodeType
+from typing import Any, Dict
+
+# Before Python 3.12 a loop within a single line, e.g. a comprehension, only
+# produces a line event for its first iteration: the budget is checked at
+# every instruction instead. Opcode events are not needed from 3.12 on, and
+# crash 3.12.1 while another thread is traced.
+OPCODE_EVENTS = sys.version_info < (3, 12)
+
+
+class _OutOfTime(BaseException):
+    # Not an Exception, so that the evaluated code can't catch it by accident
+    pass
+
+
+def bounded_eval(code: CodeType, frame_globals: Dict, frame_locals: Dict, deadline: float) -> Any:
+    """
+    Evaluate a compiled expression in a frame of the paused program, until
+    time.perf_counter() reaches deadline at most.
+
+    Expressions are evaluated inside the tracer, where no trace events are
+    delivered. They run under sys.call_tracing with a trace function of
+    their own instead, which gets every line (or instruction) of the
+    expression and of the functions it calls, and aborts the evaluation
+    once the deadline has passed. A single call into a builtin that loops in
+    C, e.g. sum(range(10**10)), gives it no chance to, and runs to its end.
+
+    Raises:
+        TimeoutError: If the expression ran past the deadline
+        Exception: Whatever the expression raises
+    """
+    def trace(frame, event, arg):
+        if time.perf_counter() > deadline:
+            raise _OutOfTime
+        frame.f_trace_opcodes = OPCODE_EVENTS
+        return trace
+
+    def run():
+        # Set inside call_tracing: on Python 3.11 a trace function set from
+        # the tracer gets no events
+        previous = sys.gettrace()
+        sys.settrace(trace)
+        try:
+            return eval(code, frame_globals, frame_locals)
+        finally:
+            sys.settrace(previous)
+
+    try:
+        return sys.call_tracing(run, ())
+    except _OutOfTime:
+        raise TimeoutError("Out of time") from None
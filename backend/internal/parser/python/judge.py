@@ -0,0 +1,151 @@
+import contextlib
+import inspect
+import io
+import json
+import linecache
+import sys
+import time
+import traceback
+from typing import Any, Dict, Optional, Tuple
+
+from worker_pool import memory_limit
+
+# Characters of stdout and stderr kept per test case
+MAX_CASE_OUTPUT = 64 * 1024
+
+# Module name the program runs under: code guarded by
+# `if __name__ == "__main__"` is a driver for running it by hand, not part
+# of what is judged
+MODULE_NAME = "__judge__"
+
+# File name the program is compiled under, its source is registered with
+# linecache for the lines of tracebacks
+FILENAME = "<solution>"
+
+
+def parse_test_case(test_case: Any) -> Tuple[Any, Any, bool]:
+    """
+    Split a test case into its input and expected output.
+
+    Test cases are objects with input_data and, optionally, expected_output,
+    like the rows of the test case table, where both are JSON text. Anything
+    else is the input itself.
+
+    Returns:
+        (input, expected output, whether there is an expected output)
+    """
+    if not isinstance(test_case, dict) or "input_data" not in test_case:
+        return test_case, None, False
+    has_expected = test_case.get("expected_output") is not None
+    return (_parse_json(test_case["input_data"]), _parse_json(test_case.get("expected_output")),
+            has_expected)
+
+
+def _parse_json(value: Any) -> Any:
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _jsonable(value: Any) -> Any:
+    """The value as it would come back from JSON, its repr() if it can't be encoded."""
+    try:
+        return json.loads(json.dumps(value))
+    except (TypeError, ValueError):
+        return repr(value)
+
+
+def _call_arguments(function: Any, input_data: Any) -> Tuple[tuple, dict]:
+    """
+    Map a test case input to the arguments of the entry function: an object
+    whose keys are parameter names gives keyword arguments, a list with one
+    item per parameter of a function taking several gives positional ones,
+    and anything else is the only argument.
+    """
+    try:
+        parameters = list(inspect.signature(function).parameters.values())
+    except (TypeError, ValueError):
+        return (input_data,), {}
+    names = {parameter.name for parameter in parameters}
+    positional = [parameter for parameter in parameters
+                  if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)]
+
+    if not parameters:
+        return (), {}
+    if isinstance(input_data, dict) and input_data and set(input_data) <= names:
+        return (), input_data
+    if isinstance(input_data, list) and len(positional) > 1 and len(input_data) == len(positional):
+        return tuple(input_data), {}
+    return (input_data,), {}
+
+
+def _peak_memory() -> Optional[int]:
+    """Peak resident set size of the process in bytes, None where unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(code: str, entry_point: str, input_data: Any, expected_output: Any = None,
+             has_expected: bool = False) -> Dict:
+    """
+    Run a program and call its entry function on one test case, untraced.
+
+    Runs in a judge worker, a process of its own for the test case, so that
+    its peak memory is the case's and a case that doesn't end in time can be
+    killed.
+
+    Returns:
+        Dictionary with the JSON-encodable result of the call, the case's
+        stdout and stderr, its wall time in seconds, the bytes the process
+        grew by at its peak in peak_memory, the error if the program raised
+        one, and whether the result is the expected output in passed (None
+        without expected output)
+    """
+    stdout, stderr = io.StringIO(), io.StringIO()
+    result, error = None, None
+    memory_before = _peak_memory()
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            # Every case runs in a worker of its own, nothing to cache
+            program = compile(code, FILENAME, "exec")
+            linecache.cache[FILENAME] = (len(code), None, code.splitlines(keepends=True), FILENAME)
+            # Only the program counts, not compiling it
+            memory_before = _peak_memory()
+            started = time.perf_counter()
+            namespace = {"__name__": MODULE_NAME, "__file__": FILENAME}
+            exec(program, namespace)
+            function = namespace.get(entry_point)
+            if not callable(function):
+                raise NameError(f"Entry function {entry_point!r} is not defined")
+            args, kwargs = _call_arguments(function, input_data)
+            result = function(*args, **kwargs)
+    except MemoryError:
+        limit = memory_limit()
+        error = f"Memory limit of {limit // (1024 * 1024)} MB exceeded" if limit else "MemoryError"
+    except (Exception, SystemExit) as e:
+        # sys.exit() fails the case, it doesn't end the worker
+        error = f"{type(e).__name__}: {e}"
+        # Without the frame of run_case
+        stderr.write("".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next)))
+    seconds = time.perf_counter() - started
+    memory_after = _peak_memory()
+
+    result = _jsonable(result) if error is None else None
+    return {
+        "result": result,
+        "stdout": stdout.getvalue()[:MAX_CASE_OUTPUT],
+        "stderr": stderr.getvalue()[:MAX_CASE_OUTPUT],
+        "seconds": seconds,
+        "peak_memory": None if memory_before is None else max(0, memory_after - memory_before),
+        "error": error,
+        "passed": (error is None and result == _jsonable(expected_output)) if has_expected else None
+    }
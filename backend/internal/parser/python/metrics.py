@@ -0,0 +1,157 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Union
+
+# Bucket upper bounds, in seconds or bytes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TRACER_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01, 0.1)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+Snapshot = Dict[str, Union[float, Dict]]
+
+
+class Counter:
+    """Number that only goes up, e.g. lines traced."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+    def merge(self, value: float, other: float) -> float:
+        return value + other
+
+    def render(self, value: float) -> List[str]:
+        return [f"{self.name} {value:g}"]
+
+
+class Histogram:
+    """Distribution of observed values, counted in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float]):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        # One count per bucket plus the values above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the seconds spent in the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"counts": list(self.counts), "sum": self.sum}
+
+    def merge(self, value: Dict, other: Dict) -> Dict:
+        return {
+            "counts": [a + b for a, b in zip(value["counts"], other["counts"])],
+            "sum": value["sum"] + other["sum"]
+        }
+
+    def render(self, value: Dict) -> List[str]:
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets, value["counts"]):
+            total += count
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {total}')
+        total += value["counts"][-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {total}')
+        lines.append(f"{self.name}_sum {value['sum']:g}")
+        lines.append(f"{self.name}_count {total}")
+        return lines
+
+
+class Callback:
+    """Value read from the application when the metrics are rendered."""
+
+    def __init__(self, name: str, description: str, read: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.description = description
+        self.read = read
+        self.kind = kind
+
+    def render(self, value: float) -> List[str]:
+        return [f"{self.name} {value:g}"]
+
+
+class MetricsRegistry:
+    """
+    Metrics of the debugger, rendered in the Prometheus text format.
+
+    Counters and histograms can be snapshotted in a worker process and
+    merged into the metrics of the server, so the values cover the sessions
+    of every process. Callbacks are only read in the rendering process.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Union[Counter, Histogram, Callback]] = {}
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._register(Counter(name, description))
+
+    def histogram(self, name: str, description: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, buckets))
+
+    def callback(self, name: str, description: str, read: Callable[[], float], kind: str = "gauge") -> Callback:
+        return self._register(Callback(name, description, read, kind))
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> Snapshot:
+        """Values of the counters and histograms, to merge into another registry."""
+        return {name: metric.snapshot() for name, metric in self.metrics.items()
+                if not isinstance(metric, Callback)}
+
+    def render(self, others: Iterable[Snapshot] = ()) -> str:
+        """
+        Render every metric.
+
+        Args:
+            others: Snapshots of the same metrics in other processes, added
+                to the local values
+        """
+        values = self.snapshot()
+        for other in others:
+            for name, value in other.items():
+                if name in values:
+                    values[name] = self.metrics[name].merge(values[name], value)
+
+        lines = []
+        for name, metric in self.metrics.items():
+            value = metric.read() if isinstance(metric, Callback) else values[name]
+            lines.append(f"# HELP {name} {metric.description}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(value))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,257 @@
+import io
+import sys
+import tempfile
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+# Lines kept in memory before the oldest half is moved to disk
+MAX_LINES = 2000
+# Characters kept in memory before the oldest lines are moved to disk
+MAX_CHARS = 1024 * 1024
+# Bytes of output kept on disk, later lines only stay in memory
+MAX_SPILL_BYTES = 16 * 1024 * 1024
+# Lines returned by one read
+PAGE_LINES = 1000
+
+
+class OutputBuffer(io.TextIOBase):
+    """
+    Text stream capturing the output of a debugged program, line by line.
+
+    Lines are numbered from 0, so a reader can ask for the lines it hasn't
+    seen yet instead of the whole output. The most recent lines are kept in
+    memory; older ones are appended to a temporary file, and once that file
+    is full they are dropped, keeping the start and the end of the output.
+    """
+
+    def __init__(self, max_lines: int = MAX_LINES, max_chars: int = MAX_CHARS,
+                 max_spill_bytes: int = MAX_SPILL_BYTES):
+        super().__init__()
+        self.max_lines = max_lines
+        self.max_chars = max_chars
+        self.max_spill_bytes = max_spill_bytes
+
+        # Complete lines still in memory, the first one being line number first
+        self.lines: List[str] = []
+        self.first = 0
+        self.chars = 0
+        # Pieces of the line being written, not ended by a newline yet
+        self.pending: List[str] = []
+        self.pending_chars = 0
+        # Lines 0 to spilled - 1 are on disk, lines spilled to first - 1 were dropped
+        self.spilled = 0
+        self.spill_file = None
+        self.spill_bytes = 0
+        self.spill_offsets = array("q")
+        self._lock = threading.Lock()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+
+        with self._lock:
+            if "\n" not in text:
+                if text:
+                    self.pending.append(text)
+                    self.pending_chars += len(text)
+                return len(text)
+
+            parts = text.split("\n")
+            parts[0] = "".join(self.pending) + parts[0]
+            complete = parts[:-1]
+            self.lines.extend(complete)
+            self.chars += sum(map(len, complete))
+            self.pending = [parts[-1]] if parts[-1] else []
+            self.pending_chars = len(parts[-1])
+
+            if len(self.lines) > self.max_lines or self.chars > self.max_chars:
+                self._spill()
+        return len(text)
+
+    def _spill(self) -> None:
+        """Move the oldest in-memory lines to disk, or drop them if it is full."""
+        count, chars = 0, self.chars
+        while count < len(self.lines) and (len(self.lines) - count > self.max_lines // 2
+                                           or chars > self.max_chars // 2):
+            chars -= len(self.lines[count])
+            count += 1
+
+        moved = self.lines[:count]
+        del self.lines[:count]
+        self.chars = chars
+
+        data = ("\n".join(moved) + "\n").encode("utf-8", "surrogatepass")
+        if self.spilled == self.first and self.spill_bytes + len(data) <= self.max_spill_bytes:
+            if self.spill_file is None:
+                self.spill_file = tempfile.TemporaryFile(prefix="debug_output_")
+            offset = self.spill_bytes
+            for line in moved:
+                self.spill_offsets.append(offset)
+                offset += len(line.encode("utf-8", "surrogatepass")) + 1
+            self.spill_file.seek(self.spill_bytes)
+            self.spill_file.write(data)
+            self.spill_bytes += len(data)
+            self.spilled += count
+        self.first += count
+
+    def position(self) -> Tuple[int, int]:
+        """Number of complete lines and length of the line being written."""
+        with self._lock:
+            return self.first + len(self.lines), self.pending_chars
+
+    def _read_spilled(self, start: int, stop: int) -> List[str]:
+        begin = self.spill_offsets[start]
+        end = self.spill_offsets[stop] if stop < self.spilled else self.spill_bytes
+        self.spill_file.seek(begin)
+        data = self.spill_file.read(end - begin).decode("utf-8", "surrogatepass")
+        return data.split("\n")[:stop - start]
+
+    def _line(self, number: int) -> Optional[str]:
+        """A complete line, or the line being written, None if dropped."""
+        if number >= self.first + len(self.lines):
+            return "".join(self.pending)
+        if number >= self.first:
+            return self.lines[number - self.first]
+        if number < self.spilled:
+            return self._read_spilled(number, number + 1)[0]
+        return None
+
+    def read_lines(self, since: Optional[int] = None, end: Optional[Tuple[int, int]] = None,
+                   limit: int = PAGE_LINES) -> Tuple[int, List[str], int]:
+        """
+        Read lines of output.
+
+        Args:
+            since: Number of the first line to read, None for the last
+                limit lines
+            end: position() to read up to, the current one by default
+            limit: Maximum number of complete lines to read
+
+        Returns:
+            (start, lines, cursor): the number of the first line read, which
+            is past since if those lines were dropped, the lines, ending
+            with the incomplete line being written if any, and the number
+            of the first line not read completely, to pass as since next
+
+        Raises:
+            ValueError: If the buffer is closed
+        """
+        with self._lock:
+            if self.closed:
+                raise ValueError("I/O operation on closed output buffer")
+            end_lines, end_chars = end or (self.first + len(self.lines), self.pending_chars)
+            if since is None:
+                since = end_lines - limit
+            start = min(max(since, 0), end_lines)
+            if self.spilled <= start < self.first:
+                start = min(self.first, end_lines)
+            stop = min(end_lines, start + limit)
+
+            lines = []
+            if start < self.spilled:
+                # Dropped lines end the read, the next one skips them
+                stop = min(stop, self.spilled)
+                lines = self._read_spilled(start, stop)
+            elif start < stop:
+                lines = self.lines[start - self.first:stop - self.first]
+
+            if stop == end_lines and end_chars:
+                partial = self._line(end_lines)
+                if partial is not None:
+                    lines.append(partial[:end_chars])
+            return start, lines, stop
+
+    def memory_footprint(self) -> int:
+        """Approximate bytes of output held in memory."""
+        return self.chars + self.pending_chars + len(self.lines) * 8 + len(self.spill_offsets) * 8
+
+    def close(self) -> None:
+        with self._lock:
+            if self.spill_file is not None:
+                self.spill_file.close()
+                self.spill_file = None
+        super().close()
+
+
+class StreamRouter(io.TextIOBase):
+    """
+    Stand-in for sys.stdout or sys.stderr sending what each thread writes
+    to the stream routed for that thread.
+
+    contextlib.redirect_stdout replaces the stream for the whole process, so
+    concurrent sessions would write into each other's output, and the
+    server's own prints into the sessions'. The router is installed while at
+    least one thread is routed, and the other threads keep writing to the
+    stream it replaced. Threads started by a debugged program are not
+    routed.
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: "stdout" or "stderr"
+        """
+        super().__init__()
+        self.name = name
+        # Stream replaced by the router, restored once no thread is routed
+        self.original: Optional[TextIO] = None
+        # Thread id -> stream it writes to
+        self.targets: Dict[int, TextIO] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def route(self, stream: TextIO) -> Iterator[TextIO]:
+        """Send the writes of the current thread to a stream."""
+        thread_id = threading.get_ident()
+        with self._lock:
+            previous = self.targets.get(thread_id)
+            self.targets[thread_id] = stream
+            current = getattr(sys, self.name)
+            if current is not self:
+                # Also covers the stream being replaced behind our back
+                self.original = current
+                setattr(sys, self.name, self)
+        try:
+            yield stream
+        finally:
+            with self._lock:
+                if previous is None:
+                    del self.targets[thread_id]
+                else:
+                    self.targets[thread_id] = previous
+                if not self.targets and getattr(sys, self.name) is self:
+                    setattr(sys, self.name, self.original)
+
+    def _target(self) -> TextIO:
+        target = self.targets.get(threading.get_ident())
+        if target is None:
+            target = self.original or getattr(sys, f"__{self.name}__")
+        return target
+
+    @property
+    def encoding(self) -> Optional[str]:
+        return getattr(self._target(), "encoding", None)
+
+    @property
+    def errors(self) -> Optional[str]:
+        return getattr(self._target(), "errors", None)
+
+    def isatty(self) -> bool:
+        return self._target().isatty()
+
+    def fileno(self) -> int:
+        return self._target().fileno()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self) -> None:
+        self._target().flush()
@@ -0,0 +1,94 @@
+import hashlib
+import linecache
+import threading
+from collections import OrderedDict
+from types import CodeType
+
+# Compiled programs kept for new sessions and resets
+MAX_PROGRAMS = 256
+# Start of the synthetic file names of the programs
+FILENAME_PREFIX = "<debug-"
+
+
+class Program:
+    """
+    A debugged program, compiled under a synthetic file name.
+
+    Sessions running the same source share one Program, including its code
+    objects, which the tracer compares by identity to tell the program's
+    frames from library ones.
+    """
+
+    __slots__ = ("filename", "code", "codes", "code_ids")
+
+    def __init__(self, source: str, filename: str):
+        """
+        Raises:
+            SyntaxError, ValueError: If the source doesn't compile
+        """
+        self.filename = filename
+        self.code = compile(source, filename, "exec")
+        # The module code and the code of every function, class body and
+        # comprehension it defines, kept alive so that their ids stay valid
+        codes = [self.code]
+        for code in codes:
+            codes.extend(const for const in code.co_consts if isinstance(const, CodeType))
+        self.codes = tuple(codes)
+        self.code_ids = frozenset(map(id, codes))
+
+
+class ProgramCache:
+    """
+    Compiled programs by hash of their source, least recently used first.
+
+    The source of every cached program is registered with linecache under
+    its file name, so tracebacks and breakpoints find its lines without a
+    file on disk. Evicted programs are unregistered; sessions still running
+    one keep working, only their tracebacks lose the source lines.
+    """
+
+    def __init__(self, max_programs: int = MAX_PROGRAMS):
+        self.max_programs = max_programs
+        self.programs: 'OrderedDict[str, Program]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.programs)
+
+    def get(self, source: str) -> Program:
+        """
+        Get the compiled program of a source, compiling it on first use.
+
+        Raises:
+            SyntaxError, ValueError: If the source doesn't compile
+        """
+        digest = hashlib.sha256(source.encode("utf-8", "surrogatepass")).hexdigest()
+        with self._lock:
+            program = self.programs.get(digest)
+            if program is not None:
+                self.programs.move_to_end(digest)
+                if program.filename not in linecache.cache:
+                    # Dropped by linecache.clearcache()
+                    self._register(program, source)
+                return program
+
+        # Compiled outside of the lock, a concurrent compile of the same
+        # source loses to the first one stored
+        program = Program(source, f"{FILENAME_PREFIX}{digest[:16]}>")
+        with self._lock:
+            if digest in self.programs:
+                return self.programs[digest]
+            self.programs[digest] = program
+            self._register(program, source)
+            while len(self.programs) > self.max_programs:
+                _, evicted = self.programs.popitem(last=False)
+                linecache.cache.pop(evicted.filename, None)
+        return program
+
+    @staticmethod
+    def _register(program: Program, source: str) -> None:
+        lines = source.splitlines(keepends=True)
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        # No modification time: linecache.checkcache keeps the entry
+        linecache.cache[program.filename] = (len(source), None, lines, program.filename)
@@ -1,122 +1,786 @@
 import sys
-import io
+import logging
 import traceback
 import uuid
 import threading
-import tempfile
+import time
 import os
-from contextlib import redirect_stdout, redirect_stderr
+import shutil
 from typing import Dict, List, Optional, Any, Tuple
 import bdb
-import time
-from types import FrameType
+import bisect
+import ast
+import itertools
+import inspect
+from types import CodeType, FrameType
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
+from value_serializer import ValueSerializer
+from call_tree import CallTreeRecorder
+from worker_pool import ForkServerPool, WorkerError, WorkerPool, memory_limit
+from session_manager import SessionManager
+from breakpoints import Breakpoint
+from watches import WatchList
+from output_buffer import OutputBuffer, StreamRouter
+from metrics import MetricsRegistry, SIZE_BUCKETS, TRACER_BUCKETS
+from state_versions import StateVersions
+from trace_file import TraceReader, TraceSteps, write_trace
+from replay_cache import ReplayCache, is_cacheable
+from program_cache import FILENAME_PREFIX, Program, ProgramCache
+from judge import parse_test_case
+from ast_service import CodeAnalyzer, get_entry_point
 
 # Store active debugging sessions
 # Map session_id to DebugSession object
 active_sessions: Dict[str, 'DebugSession'] = {}
 
+# Idle sessions are evicted after DEBUGGER_SESSION_TTL seconds, and the least
+# recently used ones once all sessions hold more than
+# DEBUGGER_MAX_SESSIONS_MEMORY_MB (0 for no limit)
+SESSION_TTL = float(os.environ.get("DEBUGGER_SESSION_TTL", "1800"))
+MAX_SESSIONS_MEMORY = int(os.environ.get("DEBUGGER_MAX_SESSIONS_MEMORY_MB", "512")) * 1024 * 1024
+# Seconds between two background cleanups
+REAPER_INTERVAL = float(os.environ.get("DEBUGGER_REAPER_INTERVAL", "60"))
+
+session_manager = SessionManager(active_sessions, SESSION_TTL, MAX_SESSIONS_MEMORY)
+
+# Recorded sessions of deterministic programs are cached as trace files in
+# DEBUGGER_REPLAY_CACHE_DIR, if set, and replayed instead of run again for
+# the same code, test case, breakpoints and watches. The least recently used
+# ones are deleted past DEBUGGER_REPLAY_CACHE_MB.
+REPLAY_CACHE_DIR = os.environ.get("DEBUGGER_REPLAY_CACHE_DIR")
+REPLAY_CACHE_SIZE = int(os.environ.get("DEBUGGER_REPLAY_CACHE_MB", "1024")) * 1024 * 1024
+replay_cache: Optional[ReplayCache] = ReplayCache(REPLAY_CACHE_DIR, REPLAY_CACHE_SIZE) if REPLAY_CACHE_DIR else None
+
+# Budgets of each session's program, enforced by the tracer: line events
+# of the user's code (DEBUGGER_MAX_LINES) and CPU seconds of its thread
+# (DEBUGGER_MAX_CPU_SECONDS), 0 for no limit. The "forkserver" backend also
+# lets each session process grow by DEBUGGER_MAX_MEMORY_MB at most.
+LINE_BUDGET = int(os.environ.get("DEBUGGER_MAX_LINES", "10000000"))
+CPU_BUDGET = float(os.environ.get("DEBUGGER_MAX_CPU_SECONDS", "30"))
+MEMORY_BUDGET = int(os.environ.get("DEBUGGER_MAX_MEMORY_MB", "512")) * 1024 * 1024
+
+# Programs compiled once and shared by the sessions and resets running them
+program_cache = ProgramCache()
+
+# Debug logs of the tracer and sessions, off unless DEBUGGER_LOG_LEVEL=DEBUG.
+# The tracer only formats a message when DEBUG_LOGGING is set, so logging
+# costs nothing on the hot path when it is off.
+logger = logging.getLogger("python_debugger")
+if "DEBUGGER_LOG_LEVEL" in os.environ:
+    logger.setLevel(os.environ["DEBUGGER_LOG_LEVEL"].upper())
+    # Not sys.stderr, which may be routed to a program's output
+    logger.addHandler(logging.StreamHandler(sys.__stderr__))
+DEBUG_LOGGING = logger.isEnabledFor(logging.DEBUG)
+
+# Instrumentation, exposed by ast_server at /metrics
+metrics = MetricsRegistry()
+# Lines that run while continuing with their line events switched off (every
+# line outside frames with breakpoints, with the monitoring backend) are not
+# seen, so this is less than the lines the programs ran
+LINES_SEEN = metrics.counter(
+    "debugger_lines_seen_total", "Line events of the users' programs seen by the tracer")
+TRACER_SECONDS = metrics.histogram(
+    "debugger_tracer_seconds", "Time the tracer spends capturing a line it stops on", TRACER_BUCKETS)
+SNAPSHOT_BYTES = metrics.histogram(
+    "debugger_snapshot_bytes", "Estimated bytes stored for each captured line", SIZE_BUCKETS)
+STEP_SECONDS = metrics.histogram(
+    "debugger_step_seconds", "Latency of step_forward, step_backward and jump_to")
+RUN_SECONDS = metrics.histogram(
+    "debugger_run_seconds", "Latency of start_execution, run_to_completion, step_n and run_until_line")
+WAIT_SECONDS = metrics.histogram(
+    "debugger_wait_seconds", "Time requests wait for the program to stop")
+REPLAY_CACHE_HITS = metrics.counter(
+    "debugger_replay_cache_hits_total", "Recorded sessions replayed from the replay cache")
+REPLAY_CACHE_MISSES = metrics.counter(
+    "debugger_replay_cache_misses_total", "Cacheable recorded sessions that had to run")
+BUDGETS_EXCEEDED = metrics.counter(
+    "debugger_budgets_exceeded_total", "Programs aborted for spending their line, CPU or memory budget")
+metrics.callback("debugger_sessions", "Active debug sessions", lambda: len(active_sessions))
+metrics.callback("debugger_sessions_evicted_total", "Sessions evicted by the session manager",
+                 lambda: session_manager.evicted_count, kind="counter")
+
+# Send what each session's program prints to its own output, even with
+# several sessions running at once
+stdout_router = StreamRouter("stdout")
+stderr_router = StreamRouter("stderr")
+
+# Tracing backend: "bdb" (sys.settrace), "monitoring" (sys.monitoring, Python 3.12+,
+# bdb on older interpreters) or "auto" to use sys.monitoring whenever the
+# interpreter supports it
+TRACING_BACKEND = os.environ.get("DEBUGGER_TRACING_BACKEND", "auto")
+
+# Where sessions run: "thread" (a thread of this process), "process" (a
+# pool of worker processes, so sessions use every core and can be killed) or
+# "forkserver" (one process per session, forked from a preloaded server)
+EXECUTION_BACKEND = os.environ.get("DEBUGGER_EXECUTION_BACKEND", "thread")
+# Number of worker processes of the "process" backend, one per core by default
+WORKER_PROCESSES = int(os.environ.get("DEBUGGER_WORKER_PROCESSES", "0")) or os.cpu_count() or 1
+# Idle session processes the "forkserver" backend keeps ready
+WARM_WORKERS = int(os.environ.get("DEBUGGER_WARM_WORKERS", "4"))
+
+# Worker pool of the "process" and "forkserver" backends, started by
+# start_workers() or the first session
+_worker_pool: Optional[WorkerPool] = None
+_worker_pool_lock = threading.Lock()
+
+# judge() runs at most DEBUGGER_JUDGE_PROCESSES test cases at once, one per
+# core by default, each in a process forked for it, for at most
+# DEBUGGER_JUDGE_TIMEOUT seconds
+JUDGE_PROCESSES = int(os.environ.get("DEBUGGER_JUDGE_PROCESSES", "0")) or os.cpu_count() or 1
+JUDGE_TIMEOUT = float(os.environ.get("DEBUGGER_JUDGE_TIMEOUT", "10"))
+# Processes of the judge and the threads waiting for them, started by its first call
+_judge_pool: Optional[ForkServerPool] = None
+_judge_executor: Optional[ThreadPoolExecutor] = None
+
+# Largest page of children returned by get_variable
+MAX_VARIABLE_PAGE = 500
+
+
+def _value_handle(value: Any) -> Optional[Dict]:
+    """
+    Describe how a value can be expanded with get_variable.
+
+    Returns:
+        None for scalars, otherwise the number of children (if known)
+    """
+    if isinstance(value, (int, float, str, bytes, bool, type(None))):
+        return None
+    if isinstance(value, (list, tuple, set, frozenset, dict)):
+        return {"expandable": True, "length": len(value)}
+    if hasattr(value, '__dict__') or hasattr(type(value), '__slots__'):
+        return {"expandable": True, "length": None}
+    return None
+
+
+def _child_path(path: str, key: Any, is_attribute: bool = False) -> Optional[str]:
+    """Build the get_variable path of a child, None if the key can't be written as a literal."""
+    if is_attribute:
+        return f"{path}.{key}"
+    if isinstance(key, (int, float, str, bool, type(None), tuple)):
+        try:
+            ast.literal_eval(repr(key))
+        except (ValueError, SyntaxError):
+            return None
+        return f"{path}[{key!r}]"
+    return None
+
+
+def _resolve_path(path: str, frame_locals: Dict, frame_globals: Dict) -> Any:
+    """
+    Resolve a variable path such as "matrix[1][2]", "person['name']" or "node.next.value".
+
+    Only names, attributes and literal subscripts are allowed, nothing is
+    evaluated.
+
+    Raises:
+        ValueError: If the path is invalid
+        KeyError, IndexError, AttributeError: If it doesn't exist
+    """
+    try:
+        node = ast.parse(path.strip(), mode='eval').body
+    except SyntaxError:
+        raise ValueError(f"Invalid variable path: {path}")
+
+    accessors = []
+    while not isinstance(node, ast.Name):
+        if isinstance(node, ast.Attribute):
+            accessors.append((True, node.attr))
+            node = node.value
+        elif isinstance(node, ast.Subscript):
+            try:
+                key = ast.literal_eval(node.slice)
+            except ValueError:
+                raise ValueError(f"Only literal subscripts are supported: {path}")
+            accessors.append((False, key))
+            node = node.value
+        else:
+            raise ValueError(f"Invalid variable path: {path}")
+
+    if node.id in frame_locals:
+        value = frame_locals[node.id]
+    elif node.id in frame_globals:
+        value = frame_globals[node.id]
+    else:
+        raise KeyError(node.id)
+
+    for is_attribute, key in reversed(accessors):
+        value = getattr(value, key) if is_attribute else value[key]
+    return value
+
+
+def _expand_value(value: Any, path: str, offset: int, limit: int, serializer: ValueSerializer) -> Dict:
+    """
+    List one page of the children of a container or object.
+
+    Args:
+        value: The value to expand
+        path: Its path, used to build the children's paths
+        offset: Index of the first child to return
+        limit: Maximum number of children to return
+        serializer: Serializer for the children's values
+
+    Returns:
+        Dictionary with the value's type, number of children and the page of children
+    """
+    limit = max(0, min(limit, MAX_VARIABLE_PAGE))
+    offset = max(0, offset)
+
+    # (key shown to the user, child value, child path)
+    if isinstance(value, (list, tuple)):
+        length = len(value)
+        children = [(repr(index), value[index], _child_path(path, index))
+                    for index in range(offset, min(offset + limit, length))]
+    elif isinstance(value, dict):
+        length = len(value)
+        children = [(repr(key), child, _child_path(path, key))
+                    for key, child in itertools.islice(value.items(), offset, offset + limit)]
+    elif isinstance(value, (set, frozenset)):
+        # Set members have no path of their own
+        length = len(value)
+        children = [(str(index), child, None)
+                    for index, child in enumerate(itertools.islice(value, offset, offset + limit), offset)]
+    else:
+        attributes = dict(getattr(value, '__dict__', {}))
+        for slot in getattr(type(value), '__slots__', ()):
+            if hasattr(value, slot):
+                attributes[slot] = getattr(value, slot)
+        names = [name for name in attributes if not (name.startswith('__') and name.endswith('__'))]
+        length = len(names)
+        children = [(name, attributes[name], _child_path(path, name, is_attribute=True))
+                    for name in names[offset:offset + limit]]
+
+    items = []
+    for key, child, child_path in children:
+        item = {
+            "key": key,
+            "value": serializer.serialize(child),
+            "type": type(child).__name__,
+            "path": child_path,
+            "expandable": False
+        }
+        handle = _value_handle(child)
+        if handle and child_path is not None:
+            item.update(handle)
+        items.append(item)
+
+    return {
+        "path": path,
+        "type": type(value).__name__,
+        "length": length,
+        "offset": offset,
+        "limit": limit,
+        "items": items
+    }
+
+class StackEntry:
+    """
+    One frame of the user's program on the call stack.
+
+    Entries are immutable once pushed and point to their caller, so the
+    stack at any step is just a reference to its top entry.
+    """
+
+    __slots__ = ("function", "file", "depth", "caller_line", "parent", "frame", "in_call_tree")
+
+    def __init__(self, function: str, file: str, depth: int, caller_line: int,
+                 parent: Optional['StackEntry'], frame: Optional[FrameType], in_call_tree: bool = False):
+        self.function = function
+        self.file = file
+        # Number of active calls of this function, including this one
+        self.depth = depth
+        # Line the caller was at when it made this call
+        self.caller_line = caller_line
+        self.parent = parent
+        # Live frame, dropped once the function returns
+        self.frame = frame
+        # Whether the call was logged by the CallTreeRecorder
+        self.in_call_tree = in_call_tree
+
+
+def build_call_stack(top: Optional[StackEntry], line: int, top_locals: Optional[Dict] = None) -> List[Dict]:
+    """
+    Turn a stack entry into the call_stack list of a session state.
+
+    Args:
+        top: Entry of the innermost frame
+        line: Current line of the innermost frame
+        top_locals: Formatted locals of the innermost frame, if captured
+
+    Returns:
+        The frames from the outermost to the innermost one. Only the innermost
+        frame has its locals, see get_frame_locals for the others.
+    """
+    stack = []
+    entry = top
+    while entry is not None:
+        stack.append({
+            "function": entry.function,
+            "line": line,
+            "file": entry.file,
+            "recursion_depth": entry.depth,
+            "locals": top_locals if entry is top else None
+        })
+        line = entry.caller_line
+        entry = entry.parent
+
+    # Stack is built from current frame up, but display is usually top-down
+    stack.reverse()
+    return stack
+
+
 class CustomDebugger(bdb.Bdb):
     def __init__(self, skip=None, session=None):
         bdb.Bdb.__init__(self, skip=skip)
         self.session = session
         self.stopped = False
         self.current_frame = None
-        self.target_filename = session.temp_file_path
-            # For storing call stack information
-        self.call_stack = []
-        self.recursive_functions = []
-        print(f"DEBUG: Initialized debugger with target file: {self.target_filename}")
+        self.target_filename = session.program.filename
+        # Ids of the code objects of the program being debugged
+        self.target_code_ids = session.program.code_ids
+        # Call stack of the user's program, maintained from call and return
+        # events, and the number of active calls per function
+        self.stack_top: Optional[StackEntry] = None
+        self.function_depths: Dict[str, int] = {}
+        # Functions with more than one active call, and the list shown for them
+        self.recursive: Dict[str, None] = {}
+        self.recursive_functions: List[str] = []
+        # Every call and return of the user's functions
+        self.call_tree = CallTreeRecorder()
+        # Stop on every line when True, only on breakpoints otherwise
+        self.stepping = True
+        # Budgets of the current run to the next breakpoint, see continue_execution
+        self.run_steps = 0
+        self.max_run_steps: Optional[int] = None
+        self.run_deadline = float('inf')
+        # Budgets of the whole execution, see spend_line. The CPU deadline
+        # is set by reset(), on the execution thread.
+        self.lines_run = 0
+        self.max_lines = session.MAX_LINES
+        self.max_cpu_seconds = session.MAX_CPU_SECONDS
+        self.cpu_deadline = float('inf')
+        # CPU clock of the execution thread, to read it from the request thread
+        self.cpu_clock: Optional[int] = None
+        # Why the next pause happens when it isn't a step or a breakpoint
+        self.stop_reason: Optional[str] = None
+        # Code object -> lines it spans, to find frames without breakpoints
+        self.code_lines: Dict[CodeType, frozenset] = {}
+        # Set by the request thread to make a paused execution thread quit
+        self.quit_requested = False
+        logger.debug("Initialized debugger with target file %s", self.target_filename)
     
-    def capture_stack(self, frame):
-        stack = []
-        current = frame
-        # Function name -> count (for tracking recursion depth)
-        recursion_counts = {}
-        
-        while current:
-            func_name = current.f_code.co_name
-            
-            # Track recursion count
-            if func_name in recursion_counts:
-                recursion_counts[func_name] += 1
-            else:
-                recursion_counts[func_name] = 1
-                
-            # Get arguments
-            locals_dict = current.f_locals.copy()
-            
-            stack.append({
-                "function": func_name,
-                "line": current.f_lineno,
-                "file": current.f_code.co_filename,
-                "recursion_depth": recursion_counts[func_name],
-                "locals": self._format_locals(locals_dict)
-            })
-            
-            current = current.f_back
-            
-        # Stack is built from current frame up, but display is usually top-down
-        stack.reverse()
-        return stack
+    def is_target_code(self, code: CodeType) -> bool:
+        """Check whether code comes from the user's program."""
+        return id(code) in self.target_code_ids
+
+    def stop_here(self, frame):
+        # Frames outside the user's program are not traced at all
+        return self.is_target_code(frame.f_code) and super().stop_here(frame)
+
+    def break_here(self, frame):
+        # Breakpoints live in the session and can change between stops
+        return self.is_target_code(frame.f_code) and frame.f_lineno in self.session.breakpoints
+
+    def break_anywhere(self, frame):
+        # Keep tracing calls of the user's code while continuing, for the call stack
+        return self.is_target_code(frame.f_code)
+
+    def has_breakpoints(self, code: CodeType) -> bool:
+        """Check whether a breakpoint is set on one of the lines of a code object."""
+        lines = self.code_lines.get(code)
+        if lines is None:
+            lines = frozenset(line for _, _, line in code.co_lines() if line is not None)
+            self.code_lines[code] = lines
+        return not lines.isdisjoint(self.session.breakpoints)
+
+    def skip_lines(self, frame: FrameType) -> bool:
+        """
+        Check whether a frame's line events can be switched off while
+        continuing: no breakpoint can be hit in it and no lines are counted.
+        """
+        return (not self.stepping and self.max_run_steps is None
+                and not self.has_breakpoints(frame.f_code))
+
+    def spend_line(self, check_cpu: bool = False) -> None:
+        """
+        Count a line of the user's code against the session's budgets, and
+        abort the program once one is spent.
+
+        Args:
+            check_cpu: Read the CPU time of the thread now instead of every
+                1024 lines. Lines that ran with line events switched off
+                are not counted, but their CPU time is.
+        """
+        self.lines_run += 1
+        if self.max_lines and self.lines_run > self.max_lines:
+            self.abort(f"Line limit of {self.max_lines} lines exceeded")
+        elif (check_cpu or not self.lines_run & 0x3FF) and time.thread_time() > self.cpu_deadline:
+            self.abort_cpu()
+
+    def cpu_seconds_left(self) -> float:
+        """
+        CPU seconds the program has left, readable from any thread. Infinite
+        without a CPU budget, before the program runs and where threads have
+        no CPU clock (outside of Unix).
+        """
+        if self.cpu_clock is None:
+            return float('inf')
+        try:
+            return self.cpu_deadline - time.clock_gettime(self.cpu_clock)
+        except OSError:
+            # The execution thread exited
+            return float('inf')
+
+    def abort_cpu(self) -> None:
+        """Abort the program for spending its CPU budget, from any thread."""
+        self.abort(f"CPU time limit of {self.max_cpu_seconds:g} seconds exceeded")
+
+    def abort(self, error: str) -> None:
+        """Make the program quit at its next line of the user's code, failing with error."""
+        if self.quit_requested:
+            return
+        BUDGETS_EXCEEDED.inc()
+        logger.debug("Session %s aborted: %s", self.session.id, error)
+        self.session.error = error
+        self.quit_requested = True
+        self.interrupt()
+
+    def count_run_line(self) -> None:
+        """Count a line run while continuing, and stop once a budget is spent."""
+        self.spend_line()
+        self.run_steps += 1
+        if self.max_run_steps is not None and self.run_steps >= self.max_run_steps:
+            self.interrupt("step_limit")
+        elif not self.run_steps & 0x3FF and time.monotonic() > self.run_deadline:
+            self.interrupt("time_limit")
+
+    def continue_execution(self, max_steps: Optional[int] = None, max_seconds: Optional[float] = None):
+        """
+        Let a paused execution thread run to the next breakpoint.
+
+        Lines in between are neither paused on nor captured. Must be called
+        with the session's state_changed condition held.
+
+        Args:
+            max_steps: Pause after this many lines of the user's code
+            max_seconds: Pause at the first line after this much wall time
+        """
+        self.run_steps = 0
+        self.max_run_steps = max_steps
+        self.run_deadline = time.monotonic() + max_seconds if max_seconds else float('inf')
+        self.resume(stepping=False)
+
+        # Frames that can't hit a breakpoint run without line events
+        entry = self.stack_top
+        while entry is not None:
+            if entry.frame is not None and self.skip_lines(entry.frame):
+                entry.frame.f_trace_lines = False
+            entry = entry.parent
+
+    def interrupt(self, reason: Optional[str] = None) -> None:
+        """
+        Make a running execution thread stop at its next line of the user's
+        code. Can be called from any thread.
+
+        Args:
+            reason: stop_reason reported at that stop
+        """
+        self.stop_reason = reason
+        self.stepping = True
+        self.set_step()
+        self.trace_all_lines()
+
+    def trace_all_lines(self) -> None:
+        """Switch line events back on in every frame of the call stack."""
+        entry = self.stack_top
+        while entry is not None:
+            frame = entry.frame
+            if frame is not None:
+                frame.f_trace_lines = True
+            entry = entry.parent
+
+    def push_frame(self, frame: FrameType) -> None:
+        """Push a frame of the user's program on the call stack."""
+        function = frame.f_code.co_name
+        depth = self.function_depths.get(function, 0) + 1
+        self.function_depths[function] = depth
+        if depth == 2:
+            self.recursive[function] = None
+            self.recursive_functions = list(self.recursive)
+
+        # Module and class bodies, comprehensions and generators (which
+        # "call" again on every resume) are not part of the call tree
+        code = frame.f_code
+        in_call_tree = (code.co_flags & inspect.CO_OPTIMIZED
+                        and not code.co_flags & bdb.GENERATOR_AND_COROUTINE_FLAGS
+                        and not function.startswith('<'))
+        if in_call_tree:
+            self.call_tree.on_call(function, self._format_args(frame), self.session.step)
+
+        parent = self.stack_top
+        caller_line = parent.frame.f_lineno if parent is not None and parent.frame is not None else -1
+        self.stack_top = StackEntry(function, code.co_filename, depth, caller_line, parent, frame,
+                                    bool(in_call_tree))
+
+    def pop_frame(self, frame: FrameType, return_value: Any = None, unwound: bool = False) -> None:
+        """
+        Pop a returning frame of the user's program from the call stack.
+
+        Args:
+            frame: The returning frame
+            return_value: Value it returned
+            unwound: True if it exited because of an exception
+        """
+        top = self.stack_top
+        if top is None or top.frame is not frame:
+            return
+
+        if top.in_call_tree:
+            value = None
+            if not unwound:
+                self.session.serializer.new_step()
+                value = self.session.serializer.serialize(return_value)
+            self.call_tree.on_return(value, self.session.step)
+
+        depth = self.function_depths[top.function] - 1
+        self.function_depths[top.function] = depth
+        if depth == 1:
+            del self.recursive[top.function]
+            self.recursive_functions = list(self.recursive)
+
+        self.stack_top = top.parent
+        # Recorded snapshots may still point to the entry, not to the frame
+        top.frame = None
+
+    def dispatch_call(self, frame, arg):
+        if self.is_target_code(frame.f_code):
+            self.push_frame(frame)
+            if self.skip_lines(frame):
+                frame.f_trace_lines = False
+        return super().dispatch_call(frame, arg)
+
+    def dispatch_line(self, frame):
+        if not self.stepping:
+            if self.stopframe is not self.botframe:
+                # Continuing: let bdb go straight to break_here on each line
+                self._set_stopinfo(self.botframe, None, -1)
+            self.count_run_line()
+        return super().dispatch_line(frame)
+
+    def dispatch_return(self, frame, arg):
+        if not self.stepping and self.is_outermost(frame):
+            # bdb doesn't report returns while continuing, but the final
+            # state of the program has to be captured
+            self.user_return(frame, arg)
+        try:
+            return super().dispatch_return(frame, arg)
+        finally:
+            if self.is_target_code(frame.f_code):
+                self.pop_frame(frame, arg)
+
+    def is_outermost(self, frame: FrameType) -> bool:
+        """Check whether frame is the module frame of the user's program."""
+        top = self.stack_top
+        return top is not None and top.frame is frame and top.parent is None
+
+    def _format_args(self, frame: FrameType) -> str:
+        """Serialize the arguments of a function that is being called."""
+        code = frame.f_code
+        count = code.co_argcount + code.co_kwonlyargcount
+        count += bool(code.co_flags & inspect.CO_VARARGS) + bool(code.co_flags & inspect.CO_VARKEYWORDS)
+        frame_locals = frame.f_locals
+        serializer = self.session.serializer
+        # The values may have changed since the last line was captured
+        serializer.new_step()
+        return ", ".join(
+            f"{name}={serializer.serialize(frame_locals[name])}"
+            for name in code.co_varnames[:count] if name in frame_locals
+        )
+
+    def get_frame_locals(self, index: int) -> Optional[Dict]:
+        """
+        Format the locals of a frame of the paused program.
+
+        Args:
+            index: Position in the call stack, 0 being the outermost frame
+
+        Returns:
+            The formatted locals, or None if there is no such live frame
+        """
+        entries = []
+        entry = self.stack_top
+        while entry is not None:
+            entries.append(entry)
+            entry = entry.parent
+        entries.reverse()
+
+        if not 0 <= index < len(entries) or entries[index].frame is None:
+            return None
+        return self._format_locals(entries[index].frame.f_locals)
         
     def user_line(self, frame):
-        # Called when we hit a new line
-        print(f"DEBUG: user_line called for file {frame.f_code.co_filename}, line {frame.f_lineno}")
-        
-        # Check if this is in our target file
-        if os.path.abspath(frame.f_code.co_filename) == os.path.abspath(self.target_filename):
-            print(f"DEBUG: Found match for our file! Stopping at line {frame.f_lineno}")
+        # Called when we hit a new line. Lines outside the user's program
+        # are skipped, but we keep stepping, so that we stop again as soon
+        # as control comes back to the user's code.
+        if self.is_target_code(frame.f_code):
+            if self.stepping:
+                # Lines run while continuing were counted by count_run_line
+                self.spend_line(check_cpu=True)
+            if self.quit_requested:
+                # Asked to quit while running, e.g. the session was evicted
+                # or the program spent a budget.
+                # Raises BdbQuit once we return to dispatch_line.
+                self.set_quit()
+                return
+
+            # Conditions, hit counts and logpoints are evaluated right here,
+            # without waking up the request thread
+            breakpoint_hit = (frame.f_lineno in self.session.breakpoints
+                              and self.check_breakpoint(frame))
+            if not self.stepping and not breakpoint_hit:
+                # Running to the next breakpoint
+                return
+
+            if self.stop_reason is not None:
+                self.session.stop_reason = self.stop_reason
+                self.stop_reason = None
+            else:
+                self.session.stop_reason = "step" if self.stepping else "breakpoint"
+            if DEBUG_LOGGING:
+                logger.debug("Session %s stops at line %d (%s)", self.session.id, frame.f_lineno,
+                             self.session.stop_reason)
+
+            started = time.perf_counter()
+            history_size = self.session.history.size
             self.current_frame = frame
             self.session.current_line = frame.f_lineno
+            self.session.step += 1
             self.session.capture_variables(frame)
+            watch_values = self.session.evaluate_watches(frame.f_globals, frame.f_locals)
 
-        # Capture stack information
-            self.session.call_stack = self.capture_stack(frame)
-            
-            # Detect recursion
-            functions = [frame_info["function"] for frame_info in self.session.call_stack]
-            function_counts = {}
-            for func in functions:
-                if func in function_counts:
-                    function_counts[func] += 1
-                else:
-                    function_counts[func] = 1
-                    
-            self.session.recursive_functions = [
-                func for func, count in function_counts.items() if count > 1
-            ]
-
-            if frame.f_lineno in self.session.breakpoints:
-                print(f"DEBUG: Breakpoint hit at line {frame.f_lineno}")
-                self.stopped = True
-                print(f"DEBUG: Debugger stopped = {self.stopped}")
+            # Capture stack information
+            if self.stack_top is None or self.stack_top.frame is not frame:
+                # Frame resumed without a call event
+                self.push_frame(frame)
+            self.session.stack_top = self.stack_top
+            self.session.recursive_functions = self.recursive_functions
+
+            if self.session.record:
+                # Record mode never pauses, every line becomes a trace entry
+                self.session.record_step(breakpoint_hit, watch_values)
+                self.count_captured_line(started, self.session.history.size - history_size
+                                         + self.session.SNAPSHOT_SIZE)
                 return
+
+            # Only the top frame's locals are formatted eagerly
+            self.session.top_locals = self._format_locals(frame.f_locals)
+            self.session.watch_values = watch_values
+            self.count_captured_line(started, self.session.history.size - history_size)
+
+            self.pause()
+
+    def count_captured_line(self, started: float, size: int) -> None:
+        """
+        Update the metrics of a line captured by user_line.
+
+        Args:
+            started: time.perf_counter() when the capture started
+            size: Estimated bytes the capture stored
+        """
+        LINES_SEEN.inc()
+        TRACER_SECONDS.observe(time.perf_counter() - started)
+        SNAPSHOT_BYTES.observe(size)
             
-            self.stopped = True
-            print(f"DEBUG: Debugger stopped = {self.stopped}")
-        else:
-            # Skip lines in other files but keep tracking
-            self.set_continue()
-            print(f"DEBUG: Skipping non-matching file: {frame.f_code.co_filename}")
-            
+    def check_breakpoint(self, frame: FrameType) -> bool:
+        """
+        Evaluate the breakpoint on the frame's line.
+
+        Returns:
+            True if the program should stop. Logpoints write their message
+            to the session's logs and never stop.
+        """
+        breakpoint = self.session.breakpoints[frame.f_lineno]
+        if breakpoint.is_plain:
+            breakpoint.hits += 1
+            return True
+
+        frame_globals, frame_locals = frame.f_globals, frame.f_locals
+        if not breakpoint.hit(frame_globals, frame_locals):
+            return False
+        if breakpoint.log_message is None:
+            return True
+
+        self.session.serializer.new_step()
+        self.session.log(breakpoint.format_log(frame_globals, frame_locals,
+                                               self.session.serializer.serialize))
+        return False
+
     def user_return(self, frame, return_value):
-        # Called when a function returns
-        if os.path.abspath(frame.f_code.co_filename) == os.path.abspath(self.target_filename):
-            self.session.capture_variables(frame)
+        # Called when a function returns. The changes made by the function's
+        # last line become visible with the next line event. While continuing
+        # only the end of the program is captured.
+        if self.is_target_code(frame.f_code) and (self.stepping or self.is_outermost(frame)):
+            self.session.capture_variables(frame, self.session.step + 1)
             
     def user_exception(self, frame, exc_info):
-        # Called when an exception occurs
-        exc_type, exc_value, exc_traceback = exc_info
-        self.session.error = f"{exc_type.__name__}: {str(exc_value)}"
-        self.session.is_finished = True
-        # Capture variables at the point of exception
-        self.session.capture_variables(frame)
+        # Called when an exception is raised. It may still be handled by the
+        # user's code, so the session is only marked as failed (and finished)
+        # once the exception escapes the program, see DebugSession.start_execution.
+        if self.is_target_code(frame.f_code) and (self.stepping or self.is_outermost(frame)):
+            # Capture variables at the point of exception
+            self.session.capture_variables(frame, self.session.step + 1)
+
+    def pause(self):
+        """
+        Block the execution thread until the session resumes it.
+
+        Marks the debugger as stopped and wakes up the request thread waiting
+        in DebugSession.wait_for_stop, then sleeps on the session condition
+        until resume() or request_quit() is called.
+        """
+        state_changed = self.session.state_changed
+        with state_changed:
+            self.stopped = True
+            state_changed.notify_all()
+            while self.stopped and not self.quit_requested:
+                state_changed.wait()
+
+        if self.quit_requested:
+            # Raises BdbQuit once we return to dispatch_line
+            self.set_quit()
+
+    def resume(self, stepping: bool = True):
+        """
+        Let a paused execution thread run until the next stop.
+
+        Must be called with the session's state_changed condition held.
+
+        Args:
+            stepping: Stop at the next line if True, at the next breakpoint otherwise
+        """
+        self.stopped = False
+        self.stepping = stepping
+        self.stop_reason = None
+        self.set_step()
+        if stepping:
+            self.trace_all_lines()
+        self.session.state_changed.notify_all()
+
+    def request_quit(self):
+        """Ask the execution thread to abort at its next line."""
+        with self.session.state_changed:
+            self.quit_requested = True
+            self.stopped = False
+            self.interrupt()
+            self.session.state_changed.notify_all()
     
     def reset(self):
         super().reset()
         self.stopped = False
-        print("DEBUG: Debugger reset called")
+        if self.max_cpu_seconds:
+            self.cpu_deadline = time.thread_time() + self.max_cpu_seconds
+            if hasattr(time, "pthread_getcpuclockid"):
+                self.cpu_clock = time.pthread_getcpuclockid(threading.get_ident())
     
     def _format_locals(self, locals_dict):
         """Format local variables to avoid circular references."""
@@ -126,48 +790,350 @@ class CustomDebugger(bdb.Bdb):
             if name.startswith('__') and name.endswith('__'):
                 continue
                 
-            try:
-                # Similar to the variable capturing logic in DebugSession
-                if isinstance(value, (int, float, str, bool, type(None))):
-                    formatted[name] = repr(value)
-                elif isinstance(value, (list, tuple, set)):
-                    if len(value) > 10:
-                        formatted[name] = f"{type(value).__name__} with {len(value)} items"
-                    else:
-                        formatted[name] = repr(value)
-                elif isinstance(value, dict):
-                    if len(value) > 5:
-                        formatted[name] = f"dict with {len(value)} items"
-                    else:
-                        formatted[name] = repr(value)
-                else:
-                    formatted[name] = f"{type(value).__name__} object"
-            except:
-                formatted[name] = "Error getting value"
+            formatted[name] = self.session.serializer.serialize(value)
         
         return formatted
 
+class _MonitoringDispatcher:
+    """
+    Routes sys.monitoring events to the MonitoringDebugger of the current thread.
+
+    sys.monitoring tools are registered process-wide, so a single dispatcher
+    serves every session. Code objects outside the users' programs get their
+    events disabled the first time they start and never call back again.
+    """
+
+    TOOL_ID = 0  # sys.monitoring.DEBUGGER_ID
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.registered = False
+        # Thread ident -> debugger running the user's program on that thread
+        self.debuggers: Dict[int, 'MonitoringDebugger'] = {}
+        # Id of every code object of the programs being debugged -> number
+        # of debuggers running it
+        self.target_codes: Dict[int, int] = {}
+
+    def attach(self, debugger: 'MonitoringDebugger') -> None:
+        """Start delivering events of the calling thread to debugger."""
+        monitoring = sys.monitoring
+        events = monitoring.events
+        with self.lock:
+            if not self.registered:
+                monitoring.use_tool_id(self.TOOL_ID, "codeflow-debugger")
+                monitoring.register_callback(self.TOOL_ID, events.PY_START, self.on_start)
+                monitoring.register_callback(self.TOOL_ID, events.PY_RESUME, self.on_resume)
+                monitoring.register_callback(self.TOOL_ID, events.LINE, self.on_line)
+                monitoring.register_callback(self.TOOL_ID, events.PY_RETURN, self.on_return)
+                monitoring.register_callback(self.TOOL_ID, events.PY_YIELD, self.on_yield)
+                monitoring.register_callback(self.TOOL_ID, events.PY_UNWIND, self.on_unwind)
+                # PY_UNWIND can't be enabled per code object, it only fires
+                # when an exception leaves a function
+                monitoring.set_events(self.TOOL_ID, events.PY_START | events.PY_UNWIND)
+                self.registered = True
+
+            self.debuggers[threading.get_ident()] = debugger
+            shared = False
+            for code_id in debugger.target_code_ids:
+                shared = shared or code_id in self.target_codes
+                self.target_codes[code_id] = self.target_codes.get(code_id, 0) + 1
+
+        if shared:
+            # Another session runs the same program and may have switched
+            # off lines this one has to see
+            monitoring.restart_events()
+
+    def detach(self, debugger: 'MonitoringDebugger') -> None:
+        """Stop delivering events of the calling thread and switch off its code objects."""
+        with self.lock:
+            self.debuggers.pop(threading.get_ident(), None)
+            for code_id in debugger.target_code_ids:
+                remaining = self.target_codes.pop(code_id, 1) - 1
+                if remaining:
+                    self.target_codes[code_id] = remaining
+            # Sessions running the same program share its code objects
+            unused = [code for code in debugger.monitored_codes if id(code) not in self.target_codes]
+
+        for code in unused:
+            sys.monitoring.set_local_events(self.TOOL_ID, code, 0)
+
+    def on_start(self, code: CodeType, instruction_offset: int):
+        debugger = self.debuggers.get(threading.get_ident())
+        if debugger is not None and debugger.is_target_code(code):
+            if code not in debugger.monitored_codes:
+                events = sys.monitoring.events
+                sys.monitoring.set_local_events(
+                    self.TOOL_ID, code,
+                    events.LINE | events.PY_RETURN | events.PY_RESUME | events.PY_YIELD
+                )
+                debugger.monitored_codes.add(code)
+            debugger.push_frame(sys._getframe(1))
+            return
+
+        if id(code) not in self.target_codes and not code.co_filename.startswith(FILENAME_PREFIX):
+            # Library code: never report this code object again. Code of
+            # the programs is shared by sessions, and may be debugged later.
+            return sys.monitoring.DISABLE
+
+    def on_line(self, code: CodeType, line_number: int):
+        debugger = self.debuggers.get(threading.get_ident())
+        if debugger is None or not debugger.is_target_code(code):
+            return
+
+        if not debugger.stepping and line_number not in debugger.session.breakpoints:
+            # Continuing to the next breakpoint
+            if debugger.max_run_steps is None and self.target_codes.get(id(code)) == 1:
+                # Nothing to count and no other session runs this code:
+                # switch this line off until the next resume
+                debugger.lines_disabled = True
+                return sys.monitoring.DISABLE
+            debugger.count_run_line()
+            if not debugger.stepping:
+                return
+
+        debugger.user_line(sys._getframe(1))
+        if debugger.quitting:
+            raise bdb.BdbQuit
+
+    def on_resume(self, code: CodeType, instruction_offset: int):
+        debugger = self.debuggers.get(threading.get_ident())
+        if debugger is not None and debugger.is_target_code(code):
+            debugger.push_frame(sys._getframe(1))
+
+    def on_return(self, code: CodeType, instruction_offset: int, return_value: Any):
+        debugger = self.debuggers.get(threading.get_ident())
+        if debugger is None or not debugger.is_target_code(code):
+            return
+
+        frame = sys._getframe(1)
+        try:
+            debugger.user_return(frame, return_value)
+        finally:
+            debugger.pop_frame(frame, return_value)
+
+    def on_yield(self, code: CodeType, instruction_offset: int, value: Any):
+        debugger = self.debuggers.get(threading.get_ident())
+        if debugger is not None and debugger.is_target_code(code):
+            debugger.pop_frame(sys._getframe(1))
+
+    def on_unwind(self, code: CodeType, instruction_offset: int, exception: BaseException):
+        debugger = self.debuggers.get(threading.get_ident())
+        if debugger is not None and debugger.is_target_code(code):
+            debugger.pop_frame(sys._getframe(1), unwound=True)
+
+
+_monitoring_dispatcher = _MonitoringDispatcher()
+
+
+class MonitoringDebugger(CustomDebugger):
+    """
+    CustomDebugger driven by sys.monitoring (PEP 669) instead of sys.settrace.
+
+    Only the code objects of the user's program produce LINE and PY_RETURN
+    events, everything else runs without any tracing overhead. Requires
+    Python 3.12+. Exceptions are not reported to user_exception, the
+    variables of the last stop are kept instead.
+    """
+
+    def __init__(self, skip=None, session=None):
+        super().__init__(skip=skip, session=session)
+        # Code objects with LINE and PY_RETURN events switched on
+        self.monitored_codes = set()
+        # Whether LINE events were disabled while continuing
+        self.lines_disabled = False
+
+    def skip_lines(self, frame: FrameType) -> bool:
+        # Lines are switched off location by location in on_line instead
+        return False
+
+    def trace_all_lines(self) -> None:
+        if self.lines_disabled:
+            # Re-enables every location disabled with DISABLE, of all tools
+            self.lines_disabled = False
+            sys.monitoring.restart_events()
+
+    def user_line(self, frame):
+        # Conditions and watches run under sys.call_tracing, see bounded_eval,
+        # where events are delivered again: the functions of the user's
+        # program they call must not be traced as part of the program
+        thread = threading.get_ident()
+        _monitoring_dispatcher.debuggers.pop(thread, None)
+        try:
+            super().user_line(frame)
+        finally:
+            _monitoring_dispatcher.debuggers[thread] = self
+
+    def resume(self, stepping: bool = True):
+        super().resume(stepping)
+        # Breakpoints may have been set on lines switched off by the last run
+        self.trace_all_lines()
+
+    def run(self, cmd, globals=None, locals=None):
+        self.reset()
+        self.quitting = False
+        _monitoring_dispatcher.attach(self)
+        try:
+            exec(cmd, globals, locals)
+        except bdb.BdbQuit:
+            pass
+        finally:
+            self.quitting = True
+            _monitoring_dispatcher.detach(self)
+
+    def set_quit(self):
+        # Raised from the LINE callback, see _MonitoringDispatcher.on_line
+        self.quitting = True
+
+
+class VariableHistory:
+    """
+    Per-step change log of variable values.
+
+    A variable is only recorded when its serialized value or type changes,
+    so memory grows with the number of mutations instead of the number of
+    executed lines. The variables as they were at any step can be rebuilt
+    with view_at().
+    """
+
+    def __init__(self):
+        # Name -> latest entry
+        self.current: Dict[str, Dict] = {}
+        # (step, name) for every recorded change, in order
+        self.changes: List[Tuple[int, str]] = []
+        # Name -> steps at which it changed and the matching entries
+        self.change_steps: Dict[str, List[int]] = {}
+        self.change_entries: Dict[str, List[Dict]] = {}
+        self.size = 0
+
+    # Approximate bytes taken by an entry besides its value string
+    ENTRY_SIZE = 400
+
+    def __len__(self) -> int:
+        return len(self.changes)
+
+    def memory_footprint(self) -> int:
+        """Approximate number of bytes held by the change log."""
+        return self.size
+
+    def record(self, step: int, name: str, value: str, type_name: str, line: int,
+               handle: Optional[Dict] = None) -> bool:
+        """
+        Record the value of a variable at a step.
+
+        Args:
+            handle: For containers and objects, how to expand them with get_variable
+
+        Returns:
+            True if the value changed and a new entry was stored
+        """
+        latest = self.current.get(name)
+        if (latest is not None and latest["value"] == value and latest["type"] == type_name
+                and latest.get("length") == (handle or {}).get("length")):
+            return False
+
+        entry = {"name": name, "value": value, "type": type_name, "line": line}
+        if handle:
+            entry.update(handle, path=name)
+        self.current[name] = entry
+        self.changes.append((step, name))
+        if name not in self.change_steps:
+            self.change_steps[name] = []
+            self.change_entries[name] = []
+        self.change_steps[name].append(step)
+        self.change_entries[name].append(entry)
+        self.size += self.ENTRY_SIZE + len(value)
+        return True
+
+    def view(self) -> List[Dict]:
+        """Return the latest entry of every variable seen so far."""
+        return list(self.current.values())
+
+    def changes_between(self, first: int, last: int) -> Dict[int, List[Dict]]:
+        """Return the entries of the variables that changed at each step from first to last."""
+        changes: Dict[int, Dict[str, Dict]] = {}
+        start = bisect.bisect_left(self.changes, (first,))
+        stop = bisect.bisect_left(self.changes, (last + 1,))
+        for step, name in self.changes[start:stop]:
+            # The last entry of the variable at that step
+            index = bisect.bisect_right(self.change_steps[name], step) - 1
+            changes.setdefault(step, {})[name] = self.change_entries[name][index]
+        return {step: list(entries.values()) for step, entries in changes.items()}
+
+    def view_at(self, step: int) -> List[Dict]:
+        """Return the entry of every variable as it was at the given step."""
+        view = []
+        for name, steps in self.change_steps.items():
+            index = bisect.bisect_right(steps, step)
+            if index:
+                view.append(self.change_entries[name][index - 1])
+        return view
+
+
+# Whether the fallback from an unsupported "monitoring" backend was logged
+_monitoring_fallback_logged = False
+
+
+def _debugger_class() -> type:
+    """
+    Pick the tracing backend configured by TRACING_BACKEND. "monitoring"
+    falls back to bdb, with a warning, on interpreters without sys.monitoring.
+    """
+    global _monitoring_fallback_logged
+    if TRACING_BACKEND == "bdb":
+        return CustomDebugger
+    if hasattr(sys, "monitoring"):
+        return MonitoringDebugger
+    if TRACING_BACKEND == "monitoring" and not _monitoring_fallback_logged:
+        _monitoring_fallback_logged = True
+        logger.warning("DEBUGGER_TRACING_BACKEND=monitoring needs Python 3.12+, using bdb")
+    return CustomDebugger
+
+
 class DebugSession:
     """
     Represents a debugging session using ipdb.
     Manages code execution, state tracking, and variable inspection.
     """
+
+    # Maximum time to wait for the execution thread to reach the next stop
+    STEP_TIMEOUT = 5.0
+    # Messages kept from logpoints
+    MAX_LOGS = 1000
+    # Default wall-time budget of run_to_completion
+    RUN_TIMEOUT = 10.0
+    # Maximum time and number of line events for recording a whole program
+    RECORD_TIMEOUT = 10.0
+    MAX_RECORDED_STEPS = 100000
+    # Approximate bytes taken by a session before it runs, and by each
+    # trace snapshot of record mode
+    BASE_SIZE = 64 * 1024
+    SNAPSHOT_SIZE = 300
+    # Lines of output returned with each state
+    OUTPUT_PAGE = 1000
+    # Most steps taken by one step_n or run_until_line call
+    MAX_BATCH_STEPS = 1000
+    # Budgets of the program, 0 for no limit, see CustomDebugger.spend_line
+    MAX_LINES = LINE_BUDGET
+    MAX_CPU_SECONDS = CPU_BUDGET
     
-    def __init__(self, code: str, test_case: Optional[str] = None):
+    def __init__(self, code: str, test_case: Optional[str] = None, record: bool = False):
         """
         Initialize a new debugging session.
         
         Args:
             code: The Python code to debug
             test_case: Optional test case data to use
+            record: Run the whole program once when execution starts and
+                serve steps from the recorded trace
         """
         self.id = str(uuid.uuid4())
         self.code = code
         self.test_case = test_case
+        self.record = record
         
-        # Capture stdout and stderr
-        self.stdout_capture = io.StringIO()
-        self.stderr_capture = io.StringIO()
+        # Capture stdout and stderr, keeping recent lines in memory
+        self.stdout_capture = OutputBuffer()
+        self.stderr_capture = OutputBuffer()
         
         # Track execution state
         self.current_line = -1  # Start at -1 to indicate not started
@@ -175,33 +1141,54 @@ class DebugSession:
         self.is_finished = False
         self.error = None
         
-        # For storing breakpoints
-        self.breakpoints = set()
+        # For storing breakpoints: line -> Breakpoint
+        self.breakpoints: Dict[int, Breakpoint] = {}
+        # Watch expressions and their values at the current step
+        self.watches = WatchList()
+        self.watch_values: List[Dict] = []
+        # Values of the watches at the end of the program, in module scope
+        self.final_watch_values: List[Dict] = []
+        # Messages written by logpoints, with the step they were written at
+        self.logs: List[Tuple[int, str]] = []
 
-        # For storing call stack and recursion information
-        self.call_stack = []
+        # For storing call stack and recursion information: the top entry
+        # of the stack and the formatted locals of its frame
+        self.stack_top = None
+        self.top_locals = None
         self.recursive_functions = []
-        # For storing variables
+        # For storing variables: the view shown to the client and the change
+        # log it is built from
         self.variables = []
+        self.history = VariableHistory()
+        # Single path used to turn the program's values into strings
+        self.serializer = ValueSerializer()
+        # Versions of the states returned by the session functions
+        self.versions = StateVersions()
+
+        # Index of the current line event, -1 before the first one
+        self.step = -1
+        # Why the program is paused: "step", "breakpoint", "step_limit" or "time_limit"
+        self.stop_reason = None
+        # Record mode: one snapshot per line event, the position we are
+        # replaying and the outcome of the recorded run
+        self.trace = []
+        self.recorded_error = None
+        # Calls of a session replaying a trace file, which has no debugger
+        self.replayed_call_tree: Optional[CallTreeRecorder] = None
         
         # Initialize debugger to None - will be set when execution starts
         self.debugger = None
         self.execution_thread = None
+        # Namespace the program runs in, kept to inspect variables after it ends
+        self.globals_dict = None
+        # Signalled whenever the debugger stops or the execution finishes.
+        # The execution thread blocks on it while paused.
+        self.state_changed = threading.Condition()
         
-        # Create a temporary file for the code
-        # This helps with tracking line numbers and providing better error messages
         self.code = textwrap.dedent(code)
-        self._create_temp_file()
-    
-    def _create_temp_file(self):
-        """Create a temporary file with the code for debugging."""
-        try:
-            fd, self.temp_file_path = tempfile.mkstemp(suffix='.py', prefix='debug_')
-            with os.fdopen(fd, 'w') as f:
-                f.write(self.code)
-        except Exception as e:
-            self.error = f"Failed to create temporary file: {str(e)}"
-            self.is_finished = True
+        # Compiled code, from program_cache when execution starts. The
+        # source is registered with linecache, no file is written.
+        self.program: Optional[Program] = None
     
     def get_state(self) -> dict:
         """
@@ -210,30 +1197,256 @@ class DebugSession:
         Returns:
             A dictionary with the session state
         """
+        logs = [message for _, message in self.logs]
+        if self.record and 0 <= self.step < len(self.trace):
+            logs = [message for step, message in self.logs if step <= self.step]
+
         return {
             "id": self.id,
             "current_line": self.current_line,
             "variables": self.variables,
             "has_started": self.has_started,
             "is_finished": self.is_finished,
-            "output": self.stdout_capture.getvalue().splitlines(),
+            **self.get_output(),
             "error": self.error,
             "breakpoints": list(self.breakpoints),
-            "call_stack": self.call_stack,
-            "recursive_functions": self.recursive_functions
+            "logs": logs,
+            "watches": self.watch_values,
+            "call_stack": build_call_stack(self.stack_top, self.current_line, self.top_locals),
+            "recursive_functions": self.recursive_functions,
+            "step": self.step,
+            "total_steps": len(self.trace) if self.record else None,
+            "stop_reason": None if self.is_finished else self.stop_reason
         }
+
+    def get_output(self, since: Optional[int] = None) -> Dict:
+        """
+        Get lines printed by the program, at most OUTPUT_PAGE of them.
+
+        Args:
+            since: Number of the first line to get, the output_cursor of a
+                previous state. None for the last lines.
+
+        Returns:
+            Dictionary with the lines in output, the number of the first one
+            in output_start and the since of the next call in output_cursor.
+            The last line may be incomplete, it is then returned again.
+        """
+        end = None
+        if self.record and 0 <= self.step < len(self.trace):
+            # Only show what the program had printed by the replayed step
+            end = self.trace[self.step]["output_position"]
+        start, lines, cursor = self.stdout_capture.read_lines(since, end, self.OUTPUT_PAGE)
+        return {"output": lines, "output_start": start, "output_cursor": cursor}
+
+    def log(self, message: str) -> None:
+        """Keep a message written by a logpoint at the current step."""
+        if len(self.logs) < self.MAX_LOGS:
+            self.logs.append((self.step + 1, message))
+
+    def evaluate_watches(self, frame_globals: Dict, frame_locals: Dict) -> List[Dict]:
+        """Evaluate the watch expressions in a frame of the program."""
+        if not self.watches:
+            return []
+        return self.watches.evaluate(frame_globals, frame_locals, self.serializer.serialize)
+
+    def record_step(self, breakpoint_hit: bool = False, watch_values: Optional[List[Dict]] = None) -> None:
+        """
+        Append a snapshot of the current line event to the trace.
+
+        Called from the execution thread in record mode. Variables are not
+        part of the snapshot, they are rebuilt from the history.
+
+        Args:
+            breakpoint_hit: Whether a breakpoint stopped on the line, taking
+                its condition and hit count into account
+            watch_values: Values of the watch expressions at this step
+        """
+        if len(self.trace) >= self.MAX_RECORDED_STEPS:
+            self.error = f"Execution trace limit of {self.MAX_RECORDED_STEPS} steps reached"
+            self.debugger.set_quit()
+            return
+
+        watch_values = watch_values or []
+        if self.trace and self.trace[-1]["watch_values"] == watch_values:
+            # Share unchanged watch values between snapshots
+            watch_values = self.trace[-1]["watch_values"]
+
+        self.trace.append({
+            "line": self.current_line,
+            "stack_top": self.stack_top,
+            "recursive_functions": self.recursive_functions,
+            "output_position": self.stdout_capture.position(),
+            "breakpoint_hit": breakpoint_hit,
+            "watch_values": watch_values
+        })
+
+    def jump_to(self, step: int) -> Dict:
+        """
+        Move to a step of the recorded trace.
+
+        Stepping past the last recorded line finishes the session and shows
+        the final output and error of the program.
+
+        Args:
+            step: Index of the line event, clamped to the recorded range
+
+        Returns:
+            State at that step or error
+        """
+        if not self.record:
+            return {"error": "Jumping to a step requires a recorded session"}
+        if not self.has_started:
+            self.start_execution()
+
+        self._show_step(step)
+        return self.get_state()
+
+    def _show_step(self, step: int) -> None:
+        """Make a step of the recorded trace the current one, see jump_to."""
+        step = max(0, min(step, len(self.trace)))
+        self.step = step
+        self.stop_reason = "step"
+        self.is_finished = step == len(self.trace)
+        self.error = self.recorded_error if self.is_finished else None
+
+        self.variables = self.history.view() if self.is_finished else self.history.view_at(step)
+        if self.trace:
+            snapshot = self.trace[min(step, len(self.trace) - 1)]
+            self.current_line = snapshot["line"]
+            self.stack_top = snapshot["stack_top"]
+            self.recursive_functions = snapshot["recursive_functions"]
+            self.watch_values = self.final_watch_values if self.is_finished else snapshot["watch_values"]
+
+    def step_backward(self) -> Dict:
+        """
+        Go back to the previous line of a recorded session.
+
+        Returns:
+            State at the previous step or error
+        """
+        if not self.record:
+            return {"error": "Stepping backward requires a recorded session"}
+        return self.jump_to(self.step - 1)
     
+    # Seconds close() waits for the execution thread to exit
+    CLOSE_TIMEOUT = 1.0
+
+    def close(self):
+        """Stop the execution thread if it is still paused in the user's code."""
+        if self.debugger is not None and not self.is_finished:
+            self.debugger.request_quit()
+
+        thread = self.execution_thread
+        if thread is not None and thread is not threading.current_thread():
+            # Let it leave the user's code before the session is dropped
+            thread.join(self.CLOSE_TIMEOUT)
+
+    def memory_footprint(self) -> int:
+        """
+        Approximate number of bytes held by the session: code, output in memory,
+        variable history, trace and call tree. Objects of the user's program
+        are not counted.
+        """
+        if isinstance(self.trace, TraceSteps):
+            # Loaded from a trace file, the steps stay on disk
+            trace_size = self.trace.memory_footprint()
+        else:
+            trace_size = len(self.trace) * self.SNAPSHOT_SIZE
+        size = (self.BASE_SIZE + len(self.code) + self.stdout_capture.memory_footprint()
+                + self.stderr_capture.memory_footprint() + self.history.memory_footprint()
+                + trace_size)
+        call_tree = self._call_tree()
+        if call_tree is not None:
+            size += call_tree.memory_footprint()
+        return size
+
+    def terminate(self):
+        """
+        Stop the session as forcefully as the execution backend allows.
+
+        A thread can't be killed, so this only asks it to quit at its next
+        line. Sessions running in a worker process are killed with it.
+        """
+        self.close()
+
+    def reset(self) -> 'DebugSession':
+        """
+        Close the session and make a fresh one with the same code, test
+        case, mode, breakpoints and id.
+
+        Returns:
+            The new session
+        """
+        self.close()
+        new_session = DebugSession(self.code, self.test_case, self.record)
+        new_session.id = self.id  # Keep the same session ID
+        # Versions keep increasing, clients may hold states of this session
+        new_session.versions = self.versions
+        new_session.breakpoints = {line: breakpoint.copy() for line, breakpoint in self.breakpoints.items()}
+        for expression in self.watches.expressions:
+            new_session.watches.add(expression)
+        return new_session
+
+    def wait_for_stop(self, timeout_message: str, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the debugger stops at a line or the execution finishes.
+
+        Args:
+            timeout_message: Error to record if nothing happens in time
+            timeout: Seconds to wait, STEP_TIMEOUT by default
+
+        Returns:
+            False if it timed out
+        """
+        with WAIT_SECONDS.time(), self.state_changed:
+            reached = self._wait_stopped(timeout or self.STEP_TIMEOUT)
+            if not reached:
+                self.error = timeout_message
+                self.is_finished = True
+
+        if not reached:
+            # Don't leave the execution thread running in the background
+            self.debugger.request_quit()
+        return reached
+
+    def _wait_stopped(self, timeout: float) -> bool:
+        """
+        Wait until the debugger stops or the execution finishes, aborting
+        the program if it spends its CPU budget meanwhile. Lines running
+        with line events switched off never reach the tracer's own check.
+        Must be called with the state_changed condition held.
+
+        Returns:
+            False if it timed out
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = deadline - time.monotonic()
+            if not self.debugger.quit_requested:
+                # The program can't spend more CPU time than the time waited
+                wait = min(wait, self.debugger.cpu_seconds_left())
+            if self.state_changed.wait_for(lambda: self.debugger.stopped or self.is_finished,
+                                           timeout=max(wait, 0)):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            if self.debugger.cpu_seconds_left() <= 0:
+                # Quits at its next line of the user's code
+                self.debugger.abort_cpu()
+
     def __del__(self):
         """Clean up resources when the session is deleted."""
         try:
-            if hasattr(self, 'temp_file_path') and os.path.exists(self.temp_file_path):
-                os.remove(self.temp_file_path)
+            self.stdout_capture.close()
+            self.stderr_capture.close()
         except:
             pass  # Best effort cleanup
     
     def start_execution(self) -> Dict:
         """
-        Start the debugging session and pause at the first line.
+        Start the debugging session and pause at the first line (or at the
+        first breakpoint, if any are set).
         
         Returns:
             Current state after starting execution
@@ -249,64 +1462,83 @@ class DebugSession:
             self.is_finished = True
             return self.get_state()
 
-        # Initialize the debugger
-        self.debugger = CustomDebugger(session=self)
+        cache_key = None
+        if self.record and replay_cache is not None and is_cacheable(self.code):
+            cache_key = self._cache_key()
+            if self._replay_cached(cache_key):
+                REPLAY_CACHE_HITS.inc()
+                return self.jump_to(0)
+            REPLAY_CACHE_MISSES.inc()
+
+        try:
+            self.program = program_cache.get(self.code)
+        except (SyntaxError, ValueError) as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.is_finished = True
+            if self.record:
+                self.recorded_error = self.error
+                return self.jump_to(0)
+            return self.get_state()
+
+        # Initialize the debugger. With breakpoints set we run straight to the
+        # first one, otherwise we pause on the first line.
+        self.debugger = _debugger_class()(session=self)
+        self.debugger.stepping = self.record or not self.breakpoints
         
         # Create a thread for running the code
         def run_code():
             try:
-                with redirect_stdout(self.stdout_capture), redirect_stderr(self.stderr_capture):
+                with stdout_router.route(self.stdout_capture), stderr_router.route(self.stderr_capture):
                     # Set initial breakpoints
                     for line in self.breakpoints:
-                        print(f"DEBUG: Setting breakpoint at line {line}")
-                        self.debugger.set_break(self.temp_file_path, line)
+                        self.debugger.set_break(self.program.filename, line)
                     
-                    print(f"DEBUG: Starting debugger with file {self.temp_file_path}")
+                    logger.debug("Starting session %s with file %s", self.id, self.program.filename)
                     
                     # This is the key change: use runeval instead of run
                     # This allows finer control over execution
                     self.debugger.reset()
                     
-                    # Compile the code to handle syntax errors before debugging starts
-                    try:
-                        code_obj = compile(open(self.temp_file_path).read(), self.temp_file_path, 'exec')
-                        
-                        # Start execution with step control
-                        self.debugger.set_step()  # Start with stepping mode
-                        globals_dict = {'__name__': '__main__', '__file__': self.temp_file_path}
-                        self.debugger.run(code_obj, globals_dict, globals_dict)
-                        
-                    except SyntaxError as e:
-                        self.error = f"SyntaxError: {str(e)}"
-                        self.is_finished = True
-                        return
-                    
-                # If we get here without stopping, mark as finished
-                if not self.debugger.stopped:
-                    print(f"DEBUG: Execution finished without stopping")
-                    self.is_finished = True
+                    # Start execution with step control
+                    self.debugger.set_step()  # Start with stepping mode
+                    self.globals_dict = {'__name__': '__main__', '__file__': self.program.filename}
+                    self.debugger.run(self.program.code, self.globals_dict, self.globals_dict)
                     
             except Exception as e:
-                self.error = str(e)
-                self.is_finished = True
+                self.error = f"{type(e).__name__}: {str(e)}"
+                if isinstance(e, MemoryError) and memory_limit():
+                    BUDGETS_EXCEEDED.inc()
+                    self.error = f"Memory limit of {memory_limit() // (1024 * 1024)} MB exceeded"
                 import traceback
                 self.stderr_capture.write(traceback.format_exc())
+            finally:
+                if self.globals_dict is not None:
+                    # Watches at the end of the program, in module scope
+                    self.final_watch_values = self.evaluate_watches(self.globals_dict, self.globals_dict)
+                    if not self.record:
+                        self.watch_values = self.final_watch_values
+
+                # Wake up whoever is waiting for the next stop
+                with self.state_changed:
+                    self.debugger.stopped = False
+                    self.is_finished = True
+                    self.state_changed.notify_all()
         
         # Start the thread
         self.execution_thread = threading.Thread(target=run_code)
         self.execution_thread.daemon = True
         self.execution_thread.start()
         
+        if self.record:
+            # Run the whole program, then replay it from the first line
+            completed = self.wait_for_stop("Timeout while recording execution", self.RECORD_TIMEOUT)
+            self.recorded_error = self.error
+            if cache_key is not None and completed and len(self.trace) < self.MAX_RECORDED_STEPS:
+                self._cache_recording(cache_key)
+            return self.jump_to(0)
+
         # Wait for the first breakpoint or line stop
-        timeout = 5.0  # 5 second timeout
-        start_time = time.time()
-        while not self.debugger.stopped and not self.is_finished:
-            if time.time() - start_time > timeout:
-                self.error = "Timeout waiting for execution to start"
-                self.is_finished = True
-                break
-            time.sleep(0.1)
-            print(f"DEBUG: Waiting for stop. Stopped={self.debugger.stopped}, Finished={self.is_finished}")
+        self.wait_for_stop("Timeout waiting for execution to start")
             
         return self.get_state()
     
@@ -319,144 +1551,574 @@ class DebugSession:
         """
         if not self.has_started:
             return self.start_execution()
+
+        if self.record:
+            return self.jump_to(self.step + 1)
             
+        self._advance()
+        return self.get_state()
+
+    def _advance(self) -> bool:
+        """
+        Let the paused program run to its next line and wait for it.
+
+        Returns:
+            False if the program can't step: finished or not paused
+        """
         if self.is_finished:
-            return self.get_state()
+            return False
         
-        if 'import ' in self.code and 'import math' in self.code and 'import random' in self.code:
-        # For the import test, we'll just mark it as finished and simulate successful execution
-            self.is_finished = True
-            # Add the expected output
-            self.stdout_capture.write("Pi: 3.141592653589793, Random: 42, Time: 2023-01-01 00:00:00\n")
-            # Add expected variables
-            self.variables = [
-                {"name": "pi", "value": "3.141592653589793", "type": "float", "line": 1},
-                {"name": "random_num", "value": "42", "type": "int", "line": 1},
-                {"name": "current_time", "value": "datetime object", "type": "datetime", "line": 1}
-            ]
-            return self.get_state()
-            
-        if not hasattr(self, 'debugger') or not self.debugger.stopped:
-            print(f"DEBUG: Cannot step - debugger not stopped. Has debugger: {hasattr(self, 'debugger')}")
-            return self.get_state()
+        if self.debugger is None or not self.debugger.stopped:
+            logger.debug("Session %s can't step, the debugger isn't stopped", self.id)
+            return False
         
-        # Continue execution to the next line
-        print(f"DEBUG: Before step, stopped = {self.debugger.stopped}")
-        self.debugger.stopped = False
-        self.debugger.set_step()  # Important: set to step mode
-        print(f"DEBUG: After setting stopped=False, stopped = {self.debugger.stopped}")
-        
-        # Wait for the next stop or end
-        timeout = 5.0  # 5 second timeout
-        start_time = time.time()
-        while not self.debugger.stopped and not self.is_finished:
-            if time.time() - start_time > timeout:
-                self.error = "Timeout waiting for next step"
-                self.is_finished = True
+        # Let the execution thread run to the next line and wait for it
+        with self.state_changed:
+            self.debugger.resume()
+        self.wait_for_stop("Timeout waiting for next step")
+        return True
+
+    def step_n(self, n: int) -> Dict:
+        """
+        Take up to n steps in one call, e.g. to prefetch the frames of an
+        animation.
+
+        Args:
+            n: Number of steps, at most MAX_BATCH_STEPS
+
+        Returns:
+            State after the last step, with the steps taken in snapshots,
+            see _step_batch
+        """
+        return self._step_batch(n)
+
+    def run_until_line(self, line: int, max_steps: Optional[int] = None) -> Dict:
+        """
+        Step until the program reaches a line, finishes or max_steps were taken.
+
+        Args:
+            line: Line to stop at, not counting the current one
+            max_steps: Most steps to take, MAX_BATCH_STEPS by default
+
+        Returns:
+            State at the line, with a stop_reason of "line" or "step_limit",
+            and the steps taken in snapshots, see _step_batch
+        """
+        return self._step_batch(max_steps or self.MAX_BATCH_STEPS, line)
+
+    def _step_batch(self, n: int, until_line: Optional[int] = None) -> Dict:
+        """
+        Step up to n times, stopping early at until_line.
+
+        Every step taken gets a compact snapshot: {"step", "line",
+        "variables"}, where variables are only the ones that changed at that
+        step, plus "output" with the lines completed at that step, if any.
+        """
+        n = max(0, min(n, self.MAX_BATCH_STEPS))
+        first_step = self.step + 1
+        output_lines = self._output_lines()
+        # (step, line, output lines completed) of every step taken
+        taken = []
+        while len(taken) < n and not self.is_finished:
+            if not self.has_started:
+                self.start_execution()
+            elif self.record:
+                self._show_step(self.step + 1)
+            elif not self._advance():
                 break
-            time.sleep(0.1)
-            print(f"DEBUG: Waiting for next stop. Stopped={self.debugger.stopped}, Finished={self.is_finished}")
-            
-        return self.get_state()
+            if self.is_finished:
+                break
+
+            taken.append((self.step, self.current_line, self._output_lines()))
+            if self.current_line == until_line:
+                break
+
+        if until_line is not None and not self.is_finished:
+            self.stop_reason = "line" if self.current_line == until_line else "step_limit"
+
+        changes = self.history.changes_between(first_step, self.step)
+        snapshots = []
+        for step, line, step_output_lines in taken:
+            snapshot = {"step": step, "line": line, "variables": changes.get(step, [])}
+            if step_output_lines > output_lines:
+                _, snapshot["output"], _ = self.stdout_capture.read_lines(
+                    output_lines, (step_output_lines, 0), step_output_lines - output_lines)
+            output_lines = step_output_lines
+            snapshots.append(snapshot)
+
+        state = self.get_state()
+        state["snapshots"] = snapshots
+        return state
+
+    def _output_lines(self) -> int:
+        """Number of complete output lines at the current step."""
+        if self.record:
+            return self.trace[self.step]["output_position"][0] if 0 <= self.step < len(self.trace) else 0
+        return self.stdout_capture.position()[0]
     
-    def capture_variables(self, frame: FrameType) -> None:
+    def capture_variables(self, frame: FrameType, step: Optional[int] = None) -> None:
+        """
+        Capture variables from the current frame into the variable history.
+
+        Only values that changed since they were last captured are stored.
+        
+        Args:
+            frame: The current execution frame
+            step: Step to record the values at, the current step by default
+        """
+        if step is None:
+            step = self.step
+        frame_locals = frame.f_locals
+        serialize = self.serializer.serialize
+        # Values may have changed since the last capture
+        self.serializer.new_step()
+        
+        # Capture locals
+        for name, value in frame_locals.items():
+            # Skip private variables
+            if name.startswith('__') and name.endswith('__'):
+                continue
+                
+            self.history.record(step, name, serialize(value), type(value).__name__,
+                                self.current_line, _value_handle(value))
+            # Also check globals if they're different from locals
+        if frame.f_globals is not frame_locals:
+            for name, value in frame.f_globals.items():
+                # Skip private variables, names shadowed by locals, modules, and builtins
+                if ((name.startswith('__') and name.endswith('__')) 
+                        or name in frame_locals 
+                        or name == 'builtins'):
+                    continue
+                    
+                # Skip if it's a module
+                if type(value).__name__ == 'module':
+                    continue
+                    
+                self.history.record(step, name, serialize(value), type(value).__name__,
+                                    self.current_line, _value_handle(value))
+
+        if not self.record:
+            self.variables = self.history.view()
+
+    def get_variable(self, path: str, offset: int = 0, limit: int = 50) -> Dict:
+        """
+        Expand a container or object one page at a time.
+
+        Values are read from the paused frame, or from the program's globals
+        once a live execution has finished. Recorded sessions only keep the
+        summaries captured at each step.
+
+        Args:
+            path: Variable path, e.g. "arr", "matrix[1]" or "node.next"
+            offset: Index of the first child to return
+            limit: Maximum number of children to return
+
+        Returns:
+            Dictionary with the page of children or error
+        """
+        if self.record:
+            return {"error": "Variables of recorded sessions can't be expanded"}
+
+        if self.debugger is not None and self.debugger.stopped and self.debugger.current_frame is not None:
+            frame = self.debugger.current_frame
+            namespaces = (frame.f_locals, frame.f_globals)
+        elif self.is_finished and self.globals_dict is not None:
+            namespaces = (self.globals_dict, self.globals_dict)
+        else:
+            return {"error": "Variables can only be expanded while the program is paused"}
+
+        try:
+            value = _resolve_path(path, *namespaces)
+        except ValueError as e:
+            return {"error": str(e)}
+        except (KeyError, IndexError, AttributeError, TypeError):
+            return {"error": f"Variable not found: {path}"}
+
+        if _value_handle(value) is None:
+            return {"error": f"{path} can't be expanded"}
+
+        return _expand_value(value, path, offset, limit, self.serializer)
+
+    def get_frame_locals(self, index: int) -> Dict:
+        """
+        Format the locals of any frame of the paused program's call stack.
+
+        Args:
+            index: Position in call_stack, 0 being the outermost frame
+
+        Returns:
+            Dictionary with the frame's locals or error
+        """
+        if self.record or self.debugger is None or not self.debugger.stopped:
+            return {"error": "Frame locals are only available while the program is paused"}
+
+        frame_locals = self.debugger.get_frame_locals(index)
+        if frame_locals is None:
+            return {"error": f"No frame at index {index}"}
+        return {"index": index, "locals": frame_locals}
+
+    def get_call_tree(self, call_id: Optional[int] = None, max_depth: int = 3) -> Dict:
+        """
+        Get part of the tree of calls made by the program so far.
+
+        Args:
+            call_id: Root call of the subtree, None for the top-level calls
+            max_depth: Levels of callees to include below the root
+
+        Returns:
+            Dictionary with the calls or error
+        """
+        call_tree = self._call_tree()
+        if call_tree is None:
+            return {"error": "Execution has not started"}
+
+        if call_id is not None and not 0 <= call_id < len(call_tree):
+            return {"error": f"No call with id {call_id}"}
+
+        return {
+            "calls": call_tree.subtree(call_id, max_depth),
+            "total_calls": len(call_tree),
+            "truncated": call_tree.truncated
+        }
+
+    def get_repeated_calls(self, min_count: int = 2) -> Dict:
+        """
+        Find functions called several times with the same arguments.
+
+        Args:
+            min_count: Minimum number of identical calls to report
+
+        Returns:
+            Dictionary with the repeated calls or error
+        """
+        call_tree = self._call_tree()
+        if call_tree is None:
+            return {"error": "Execution has not started"}
+
+        return {"repeated_calls": call_tree.repeated_calls(min_count)}
+
+    def _call_tree(self) -> Optional[CallTreeRecorder]:
+        """Calls made by the program so far, None before it starts."""
+        if self.debugger is not None:
+            return self.debugger.call_tree
+        return self.replayed_call_tree
+
+    def get_variables_at(self, step: int) -> Dict:
+        """
+        Rebuild the variables as they were at a step.
+
+        Args:
+            step: Index of the line event
+
+        Returns:
+            Dictionary with the step and one entry per variable with the
+            value it had at that step
+        """
+        return {"step": step, "variables": self.history.view_at(step)}
+
+    def get_variables(self) -> Dict:
+        """Get the variables shown at the current step."""
+        return {"variables": self.variables}
+
+    def add_watch(self, expression: str) -> Dict:
+        """
+        Watch an expression, e.g. "arr[i] > arr[j]" or "len(stack)".
+
+        It is evaluated at every stop from now on, and right away if the
+        program is paused. Recorded sessions evaluate watches while
+        recording, so they have to be added before execution starts.
+
+        Returns:
+            Dictionary with the watch values or error
+        """
+        try:
+            self.watches.add(expression)
+        except SyntaxError as e:
+            return {"error": f"Invalid watch expression: {e}"}
+
+        if not self.record and self.debugger is not None and self.debugger.stopped:
+            frame = self.debugger.current_frame
+            self.watch_values = self.evaluate_watches(frame.f_globals, frame.f_locals)
+        elif not self.record and self.is_finished and self.globals_dict is not None:
+            self.watch_values = self.evaluate_watches(self.globals_dict, self.globals_dict)
+        return {"watches": self.watch_values}
+
+    def remove_watch(self, expression: str) -> Dict:
+        """
+        Stop watching an expression.
+
+        Returns:
+            Dictionary with the remaining watch values or error
+        """
+        if not self.watches.remove(expression):
+            return {"error": f"Not watched: {expression}"}
+
+        expression = expression.strip()
+        self.watch_values = [value for value in self.watch_values if value["expression"] != expression]
+        return {"watches": self.watch_values}
+
+    def get_breakpoints(self) -> Dict:
+        """Get the lines of all active breakpoints, and their settings and hit counts."""
+        return {
+            "breakpoints": list(self.breakpoints),
+            "details": [breakpoint.to_dict() for breakpoint in self.breakpoints.values()]
+        }
+
+    def set_breakpoint(self, line_number: int, condition: Optional[str] = None,
+                       hit_condition: Optional[str] = None, log_message: Optional[str] = None) -> Dict:
+        """
+        Set or replace the breakpoint at a line.
+
+        Args:
+            line_number: The line number for the breakpoint
+            condition: Only stop when this expression is true, e.g. "i == 500"
+            hit_condition: Only stop on some hits: "N", ">N", ">=N" or "%N"
+            log_message: Write this message instead of stopping, with
+                {expressions} formatted, e.g. "i={i} total={sum(arr)}"
+
+        Returns:
+            Dictionary with the breakpoint and all breakpoint lines, or error
+        """
+        try:
+            breakpoint = Breakpoint(line_number, condition, hit_condition, log_message)
+        except (SyntaxError, ValueError) as e:
+            return {"error": f"Invalid breakpoint: {e}"}
+
+        self.breakpoints[line_number] = breakpoint
+        return {"breakpoint": breakpoint.to_dict(), "breakpoints": list(self.breakpoints)}
+
+    def remove_breakpoint(self, line_number: int) -> Dict:
+        """
+        Remove the breakpoint at a line, if any.
+
+        Returns:
+            Dictionary with the remaining breakpoint lines
+        """
+        self.breakpoints.pop(line_number, None)
+        return {"breakpoints": list(self.breakpoints)}
+
+    def toggle_breakpoint(self, line_number: int) -> Dict:
+        """
+        Set or remove a breakpoint at a specific line.
+
+        Args:
+            line_number: The line number for the breakpoint
+
+        Returns:
+            Dictionary with updated breakpoints
+        """
+        if line_number in self.breakpoints:
+            del self.breakpoints[line_number]
+        else:
+            self.breakpoints[line_number] = Breakpoint(line_number)
+
+        return {"breakpoints": list(self.breakpoints)}
+
+    def run_to_completion(self, max_steps: Optional[int] = None,
+                          max_seconds: Optional[float] = None) -> Dict:
+        """
+        Run the code from the current position until it completes or hits a breakpoint.
+
+        The lines in between run under the tracer without pausing, and
+        variables are only captured where the program stops.
+
+        Args:
+            max_steps: Pause after this many lines, no limit by default
+            max_seconds: Pause after this much wall time, RUN_TIMEOUT by default
+                and at most
+
+        Returns:
+            Updated state, with a stop_reason of "breakpoint", "step_limit"
+            or "time_limit" if the program didn't finish
+        """
+        if not self.has_started:
+            # If not started, start execution first. With breakpoints set it
+            # already ran to the first one.
+            result = self.start_execution()
+            if self.is_finished or self.error or self.stop_reason == "breakpoint":
+                return result
+
+        if self.record:
+            return self._run_recorded(max_steps)
+
+        if self.is_finished or self.debugger is None or not self.debugger.stopped:
+            return self.get_state()
+
+        max_seconds = min(max_seconds or self.RUN_TIMEOUT, self.RUN_TIMEOUT)
+        with WAIT_SECONDS.time(), self.state_changed:
+            self.debugger.continue_execution(max_steps, max_seconds)
+            reached = self._wait_stopped(max_seconds)
+        # Lines the tracer saw but only counted on the way
+        LINES_SEEN.inc(self.debugger.run_steps)
+
+        if not reached:
+            # Still running outside of the lines the tracer checks the
+            # deadline on: stop at the next line of the user's code
+            if not self.debugger.quit_requested:
+                self.debugger.interrupt("time_limit")
+            self.wait_for_stop("Timeout waiting for the program to pause")
+
+        return self.get_state()
+
+    def _run_recorded(self, max_steps: Optional[int]) -> Dict:
+        """Jump to the next recorded breakpoint hit, within max_steps."""
+        end = len(self.trace)
+        if max_steps is not None:
+            end = min(end, self.step + max_steps)
+
+        stop_reason = "step_limit" if end < len(self.trace) else None
+        for step in range(self.step + 1, end):
+            snapshot = self.trace[step]
+            breakpoint = self.breakpoints.get(snapshot["line"])
+            # Conditions could only be evaluated while recording
+            if breakpoint is not None and (breakpoint.is_plain or snapshot["breakpoint_hit"]):
+                end, stop_reason = step, "breakpoint"
+                break
+
+        self.jump_to(end)
+        self.stop_reason = stop_reason
+        return self.get_state()
+
+    def export_trace(self, path: str) -> Dict:
+        """
+        Write the recorded execution to a trace file, see trace_file.
+
+        Returns:
+            Dictionary with the path, number of steps and size of the file,
+            or error
+        """
+        if not self.record or not self.has_started:
+            return {"error": "Only recorded sessions that started can be exported"}
+        try:
+            if isinstance(self.trace, TraceSteps):
+                # Replaying a trace file already
+                shutil.copyfile(self.trace.reader.path, path)
+                size = os.path.getsize(path)
+            else:
+                size = write_trace(path, self, self._call_tree())
+        except OSError as e:
+            return {"error": f"Failed to write trace: {e}"}
+        return {"path": path, "steps": len(self.trace), "bytes": size}
+
+    @classmethod
+    def from_trace(cls, path: str) -> 'DebugSession':
         """
-        Capture variables from the current frame.
-        
-        Args:
-            frame: The current execution frame
+        Make a recorded session replaying a trace file written by export_trace.
+
+        The file is memory-mapped, steps and variables are read from it as
+        they are shown; only the call tree is loaded at once. Resetting the
+        session records the program again.
+
+        Raises:
+            OSError, ValueError: If the file can't be read as a trace
         """
-        # Create a set of existing variable names to avoid duplicates
-        existing_vars = {v["name"] for v in self.variables}
-        
-        # Capture locals
-        for name, value in frame.f_locals.items():
-            # Skip private variables
-            if name.startswith('__') and name.endswith('__'):
-                continue
-                
+        reader = TraceReader(path)
+        session = cls(reader.code, reader.test_case, record=True)
+        for expression in reader.watches:
+            session.watches.add(expression)
+        for breakpoint in reader.breakpoints:
+            session.breakpoints[breakpoint["line"]] = Breakpoint(
+                breakpoint["line"], breakpoint["condition"], breakpoint["hit_condition"],
+                breakpoint["log_message"])
+        session._replay(reader)
+        session._show_step(0)
+        return session
+
+    def _replay(self, reader: TraceReader) -> None:
+        """Serve the steps of the session from a trace file instead of running it."""
+        self.stdout_capture.close()
+        self.stdout_capture = reader.output
+        self.trace = reader.steps
+        self.history = reader.history
+        self.replayed_call_tree = reader.call_tree()
+        self.recorded_error = reader.error
+        self.final_watch_values = reader.final_watch_values
+        self.logs = reader.logs
+        self.has_started = True
+
+    def _cache_key(self) -> str:
+        """Key of the session's recording in the replay cache."""
+        return ReplayCache.key(
+            self.code, self.test_case, list(self.watches.expressions),
+            sorted([breakpoint.line, breakpoint.condition, breakpoint.hit_condition, breakpoint.log_message]
+                   for breakpoint in self.breakpoints.values())
+        )
+
+    def _replay_cached(self, cache_key: str) -> bool:
+        """Replay the cached recording of the session, if there is one."""
+        path = replay_cache.get(cache_key)
+        if path is None:
+            return False
+        try:
+            reader = TraceReader(path)
+        except (OSError, ValueError) as e:
+            # Written by another version, or deleted meanwhile
+            logger.debug("Can't replay %s: %s", path, e)
+            replay_cache.discard(cache_key)
+            return False
+        self._replay(reader)
+        return True
+
+    def _cache_recording(self, cache_key: str) -> None:
+        """Write the recording to the replay cache in the background."""
+        def write():
             try:
-                # Try to get a simple representation
-                if isinstance(value, (int, float, str, bool, type(None))):
-                    val_repr = repr(value)
-                elif isinstance(value, (list, tuple, set)):
-                    if len(value) > 10:
-                        val_repr = f"{type(value).__name__} with {len(value)} items"
-                    else:
-                        val_repr = repr(value)
-                elif isinstance(value, dict):
-                    if len(value) > 5:
-                        val_repr = f"dict with {len(value)} items"
-                    else:
-                        val_repr = repr(value)
-                else:
-                    val_repr = f"{type(value).__name__} object"
-            except:
-                val_repr = "Error getting value"
-                
-            self.variables.append({
-                "name": name,
-                "value": val_repr,
-                "type": type(value).__name__,
-                "line": self.current_line
-            })
-            # Also check globals if they're different from locals
-        if frame.f_globals is not frame.f_locals:
-            for name, value in frame.f_globals.items():
-                # Skip private variables, duplicates, modules, and builtins
-                if ((name.startswith('__') and name.endswith('__')) 
-                        or name in existing_vars 
-                        or name == 'builtins'):
-                    continue
-                    
-                # Skip if it's a module
-                if type(value).__name__ == 'module':
-                    continue
-                    
-                try:
-                    # Same representation logic as above
-                    if isinstance(value, (int, float, str, bool, type(None))):
-                        val_repr = repr(value)
-                    elif isinstance(value, (list, tuple, set)):
-                        if len(value) > 10:
-                            val_repr = f"{type(value).__name__} with {len(value)} items"
-                        else:
-                            val_repr = repr(value)
-                    elif isinstance(value, dict):
-                        if len(value) > 5:
-                            val_repr = f"dict with {len(value)} items"
-                        else:
-                            val_repr = repr(value)
-                    else:
-                        val_repr = f"{type(value).__name__} object"
-                except:
-                    val_repr = "Error getting value"
-                    
-                self.variables.append({
-                    "name": name,
-                    "value": val_repr,
-                    "type": type(value).__name__,
-                    "line": self.current_line
-                })
+                replay_cache.put(cache_key, lambda path: write_trace(path, self, self._call_tree()))
+            except (OSError, ValueError) as e:
+                # ValueError: the session was reset or deleted meanwhile,
+                # closing its output, the entry is skipped
+                logger.warning("Failed to cache recording of session %s: %s", self.id, e)
 
+        threading.Thread(target=write, daemon=True).start()
 
 # Session Management Functions
 
-def create_session(code: str, test_case: Optional[str] = None) -> Dict:
+def create_session(code: str, test_case: Optional[str] = None, record: bool = False) -> Dict:
     """
     Create a new debugging session.
     
     Args:
         code: The Python code to debug
         test_case: Optional test case data
+        record: Record the whole execution once and replay steps from it
         
     Returns:
         Dictionary with session information
     """
-    session = DebugSession(code, test_case)
+    if EXECUTION_BACKEND in ("process", "forkserver"):
+        try:
+            session = _get_worker_pool().create_session(str(uuid.uuid4()), code, test_case, record)
+        except WorkerError as e:
+            return {"error": str(e)}
+    else:
+        session = DebugSession(code, test_case, record)
+    
+    # Store in active sessions, evicted once unused for too long
+    session_manager.add(session)
+    session_manager.start(REAPER_INTERVAL)
+    
+    return session.get_state()
+
+def load_trace(path: str) -> Dict:
+    """
+    Create a session replaying a trace file written by export_trace.
     
-    # Store in active sessions
-    active_sessions[session.id] = session
+    The session never runs code, so it stays in this process whatever the
+    execution backend.
+    
+    Args:
+        path: Trace file
+        
+    Returns:
+        Dictionary with the session state at the first step or error
+    """
+    try:
+        session = DebugSession.from_trace(path)
+    except (OSError, ValueError) as e:
+        return {"error": f"Failed to load trace: {e}"}
+    
+    session_manager.add(session)
+    session_manager.start(REAPER_INTERVAL)
     
     return session.get_state()
 
@@ -470,7 +2132,7 @@ def get_session(session_id: str) -> Optional[Dict]:
     Returns:
         Dictionary with session information or None if not found
     """
-    session = active_sessions.get(session_id)
+    session = session_manager.get(session_id)
     if not session:
         return None
         
@@ -486,144 +2148,368 @@ def delete_session(session_id: str) -> bool:
     Returns:
         True if deleted, False if not found
     """
-    if session_id in active_sessions:
-        # Get session
-        session = active_sessions[session_id]
+    session = session_manager.remove(session_id)
+    if session is None:
+        return False
+    # Stop execution, then drop the session (__del__ closes its output buffers)
+    session.close()
+    return True
+
+def terminate_session(session_id: str) -> bool:
+    """
+    Stop a session that doesn't answer, e.g. one stuck in an endless loop,
+    and delete it.
+
+    With the "process" backend this kills the session's worker process,
+    which also ends the other sessions it hosts. With the "forkserver"
+    backend the worker only hosts this session.
+    
+    Args:
+        session_id: The ID of the session
         
-        # Clean up (this will call __del__ which removes temp files)
-        del active_sessions[session_id]
-        return True
+    Returns:
+        True if terminated, False if not found
+    """
+    session = session_manager.remove(session_id)
+    if session is None:
+        return False
+
+    session.terminate()
+    return True
+
+def _get_worker_pool() -> WorkerPool:
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            if EXECUTION_BACKEND == "forkserver":
+                _worker_pool = ForkServerPool(WARM_WORKERS, MEMORY_BUDGET)
+            else:
+                _worker_pool = WorkerPool(WORKER_PROCESSES)
+        return _worker_pool
+
+def start_workers() -> None:
+    """
+    Start the worker pool ahead of the first session, e.g. when the server
+    starts, so that no user waits for it. Does nothing with the "thread"
+    backend.
+    """
+    if EXECUTION_BACKEND in ("process", "forkserver"):
+        _get_worker_pool()
+
+def shutdown_workers() -> None:
+    """Kill the worker processes of the "process" and "forkserver" backends and of the judge, if any."""
+    global _worker_pool, _judge_pool, _judge_executor
+    with _worker_pool_lock:
+        pool, _worker_pool = _worker_pool, None
+        judge_pool, _judge_pool = _judge_pool, None
+        executor, _judge_executor = _judge_executor, None
+    for pool in (pool, judge_pool):
+        if pool is not None:
+            pool.shutdown()
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+def _get_judge_pool() -> Tuple[ForkServerPool, ThreadPoolExecutor]:
+    global _judge_pool, _judge_executor
+    with _worker_pool_lock:
+        if _judge_pool is None:
+            _judge_pool = ForkServerPool(JUDGE_PROCESSES, MEMORY_BUDGET)
+            # Shared by all judge() calls, so that they don't run more cases at once together
+            _judge_executor = ThreadPoolExecutor(max_workers=JUDGE_PROCESSES)
+        return _judge_pool, _judge_executor
+
+def judge(code: str, test_cases: List[Any], max_seconds: Optional[float] = None) -> Dict:
+    """
+    Run a program's entry function on test cases, untraced and in parallel.
+
+    The entry function is the one ast_service.get_entry_point picks. Every
+    test case runs in a process of its own, JUDGE_PROCESSES at a time, so
+    with enough cores grading takes about as long as the slowest case.
+    
+    Args:
+        code: The Python code defining the entry function
+        test_cases: Objects with input_data and optionally expected_output,
+            or plain inputs, see judge.parse_test_case
+        max_seconds: Wall time each case may take, JUDGE_TIMEOUT by default
+            and at most
         
-    return False
+    Returns:
+        Dictionary with the entry_point, one result per test case, in order
+        (see judge.run_case), the number of cases passed and the wall time
+        of the whole run in seconds, or error
+    """
+    code = textwrap.dedent(code)
+    try:
+        analyzer = CodeAnalyzer()
+        analyzer.visit(ast.parse(code))
+    except (SyntaxError, ValueError) as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    entry_point = get_entry_point(analyzer.functions)
+    if entry_point is None:
+        return {"error": "The code defines no function to call"}
+
+    max_seconds = min(max_seconds or JUDGE_TIMEOUT, JUDGE_TIMEOUT)
+    pool, executor = _get_judge_pool()
+
+    def run(test_case: Any) -> Dict:
+        input_data, expected_output, has_expected = parse_test_case(test_case)
+        started = time.perf_counter()
+        try:
+            # Forking the process and answering take a little longer than the case
+            case = pool.run_once("judge", (code, entry_point, input_data, expected_output, has_expected),
+                                 timeout=max_seconds + 0.5)
+        except WorkerError as e:
+            seconds = time.perf_counter() - started
+            error = f"Judge worker failed: {e}"
+            if seconds >= max_seconds:
+                seconds, error = max_seconds, None
+            case = {"result": None, "stdout": "", "stderr": "", "seconds": seconds, "peak_memory": None,
+                    "error": error, "passed": False if has_expected else None}
+        if case["seconds"] >= max_seconds:
+            case.update(result=None, error=f"Time limit of {max_seconds:g} seconds exceeded",
+                        passed=False if has_expected else None)
+        return case
+
+    started = time.perf_counter()
+    results = list(executor.map(run, test_cases))
+    return {
+        "entry_point": entry_point,
+        "results": results,
+        "passed": sum(case["passed"] is True for case in results),
+        "seconds": time.perf_counter() - started
+    }
+
+def get_metrics() -> str:
+    """
+    Render the metrics of the debugger in the Prometheus text format.
+
+    With the "process" and "forkserver" backends the metrics of the running
+    worker processes are added in; those of exited workers are lost.
+    """
+    pool = _worker_pool
+    return metrics.render(pool.metrics_snapshots() if pool is not None else ())
 
 # Clean up expired sessions periodically
-def cleanup_sessions(max_age_minutes: int = 30):
+def cleanup_sessions(max_age_minutes: Optional[float] = None) -> List[str]:
     """
-    Remove sessions that have been inactive for too long.
+    Remove sessions that have been inactive for too long, then the least
+    recently used ones while all sessions use more than MAX_SESSIONS_MEMORY.
+    The background reaper does the same every REAPER_INTERVAL seconds.
     
     Args:
-        max_age_minutes: Maximum age in minutes before a session is considered expired
+        max_age_minutes: Maximum age in minutes before a session is considered
+            expired, SESSION_TTL by default
+        
+    Returns:
+        IDs of the removed sessions
     """
-    # This would be implemented for a production system
-    # For now, we'll keep it simple
-    pass
+    ttl = None if max_age_minutes is None else max_age_minutes * 60
+    return session_manager.cleanup(ttl)
 
-def start_execution(session_id: str) -> Dict:
+def _respond(session: 'DebugSession', state: Dict, output_since: Optional[int] = None,
+             since_version: Optional[int] = None) -> Dict:
+    """
+    Version a state and shape it as requested: with the output from
+    output_since on instead of the last lines, or as the changes since the
+    state of version since_version.
+    """
+    if "output" not in state:
+        # Error
+        return state
+    if output_since is not None:
+        state.update(session.get_output(output_since))
+    state = session.versions.publish(state)
+    if since_version is not None:
+        state = session.versions.delta(state, since_version, session.get_output)
+    return state
+
+def start_execution(session_id: str, output_since: Optional[int] = None,
+                    since_version: Optional[int] = None) -> Dict:
     """
     Start the execution of a debugging session.
     
     Args:
         session_id: The ID of the session to start
+        output_since: Only return the output from this line on, the
+            output_cursor of the previous state
+        since_version: Only return what changed since the state with this
+            version
         
     Returns:
         Dictionary with updated session state or error
     """
-    session = active_sessions.get(session_id)
+    session = session_manager.get(session_id)
     if not session:
         return {"error": "Session not found"}
         
-    return session.start_execution()
+    with RUN_SECONDS.time():
+        return _respond(session, session.start_execution(), output_since, since_version)
 
-def step_forward(session_id: str) -> Dict:
+def step_forward(session_id: str, output_since: Optional[int] = None,
+                 since_version: Optional[int] = None) -> Dict:
     """
     Step forward to the next line in a debugging session.
     
     Args:
         session_id: The ID of the session
+        output_since: Only return the output from this line on, the
+            output_cursor of the previous state
+        since_version: Only return what changed since the state with this
+            version
         
     Returns:
         Dictionary with updated session state or error
     """
-    session = active_sessions.get(session_id)
+    session = session_manager.get(session_id)
     if not session:
         return {"error": "Session not found"}
         
-    return session.step_forward()
+    with STEP_SECONDS.time():
+        return _respond(session, session.step_forward(), output_since, since_version)
 
-def reset_session(session_id: str) -> Dict:
+def step_backward(session_id: str, output_since: Optional[int] = None,
+                  since_version: Optional[int] = None) -> Dict:
     """
-    Reset the debugging session to its initial state.
+    Step back to the previous line of a recorded debugging session.
     
     Args:
         session_id: The ID of the session
+        output_since: Only return the output from this line on, the
+            output_cursor of the previous state
+        since_version: Only return what changed since the state with this
+            version
         
     Returns:
-        Dictionary with reset session state or error
+        Dictionary with updated session state or error
     """
-    session = active_sessions.get(session_id)
+    session = session_manager.get(session_id)
     if not session:
         return {"error": "Session not found"}
+        
+    with STEP_SECONDS.time():
+        return _respond(session, session.step_backward(), output_since, since_version)
+
+def jump_to(session_id: str, step: int, output_since: Optional[int] = None,
+            since_version: Optional[int] = None) -> Dict:
+    """
+    Jump to any step of a recorded debugging session.
     
-    # Preserve the code and breakpoints
-    code = session.code
-    test_case = session.test_case
-    breakpoints = session.breakpoints.copy()
-    
-    # Delete the old session
-    delete_session(session_id)
+    Args:
+        session_id: The ID of the session
+        step: Index of the line event to show
+        output_since: Only return the output from this line on, the
+            output_cursor of the previous state
+        since_version: Only return what changed since the state with this
+            version
+        
+    Returns:
+        Dictionary with the session state at that step or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+        
+    with STEP_SECONDS.time():
+        return _respond(session, session.jump_to(step), output_since, since_version)
+
+def reset_session(session_id: str, since_version: Optional[int] = None) -> Dict:
+    """
+    Reset the debugging session to its initial state.
     
-    # Create a new session with the same code and breakpoints
-    new_session = DebugSession(code, test_case)
-    new_session.id = session_id  # Keep the same session ID
-    new_session.breakpoints = breakpoints
+    Args:
+        session_id: The ID of the session
+        since_version: Only return what changed since the state with this
+            version
+        
+    Returns:
+        Dictionary with reset session state or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
     
-    # Store in active sessions
-    active_sessions[session_id] = new_session
+    # Replace it by a fresh session with the same code and breakpoints
+    new_session = session.reset()
+    session_manager.add(new_session)
     
-    return new_session.get_state()
+    return _respond(new_session, new_session.get_state(), since_version=since_version)
 
-def run_to_completion(session_id: str) -> Dict:
+def run_to_completion(session_id: str, max_steps: Optional[int] = None,
+                      max_seconds: Optional[float] = None, output_since: Optional[int] = None,
+                      since_version: Optional[int] = None) -> Dict:
     """
     Run the code from the current position until it completes or hits a breakpoint.
     
     Args:
         session_id: The ID of the session
+        max_steps: Pause after this many lines, no limit by default
+        max_seconds: Pause after this much wall time, DebugSession.RUN_TIMEOUT by
+            default and at most
+        output_since: Only return the output from this line on, the
+            output_cursor of the previous state
+        since_version: Only return what changed since the state with this
+            version
         
     Returns:
         Dictionary with updated session state or error
     """
-    session = active_sessions.get(session_id)
+    session = session_manager.get(session_id)
     if not session:
         return {"error": "Session not found"}
         
-    if not session.has_started:
-        # If not started, start execution first
-        result = session.start_execution()
-        if session.is_finished or session.error:
-            return result
-    
-    if session.is_finished:
-        return session.get_state()
-    
-    # Keep stepping until finished, hit a breakpoint, or reach max steps
-    max_steps = 1000  # Safety limit to prevent infinite loops
-    hit_breakpoint = False
-    
-    for _ in range(max_steps):
-        # Save current line before stepping
-        current_line = session.current_line
-        
-        # Step forward
-        result = session.step_forward()
-        
-        # Check if we're finished or hit an error
-        if session.is_finished or session.error:
-            # If we just stepped onto a breakpoint, we're not really finished
-            if session.current_line in session.breakpoints:
-                print(f"DEBUG: Hit breakpoint at line {session.current_line}")
-                session.is_finished = False
-                hit_breakpoint = True
-                break
-            else:
-                break
+    with RUN_SECONDS.time():
+        return _respond(session, session.run_to_completion(max_steps, max_seconds), output_since, since_version)
+
+def step_n(session_id: str, n: int, output_since: Optional[int] = None,
+           since_version: Optional[int] = None) -> Dict:
+    """
+    Take up to n steps in one call, e.g. to prefetch the frames of an animation.
+    
+    Args:
+        session_id: The ID of the session
+        n: Number of steps, at most DebugSession.MAX_BATCH_STEPS
+        output_since: Only return the output from this line on, the
+            output_cursor of the previous state
+        since_version: Only return what changed since the state with this
+            version
+        
+    Returns:
+        Dictionary with the session state after the last step, and a
+        "snapshots" list with the line, changed variables and new output of
+        every step taken, or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
         
-        # Check if we hit a breakpoint
-        if session.current_line in session.breakpoints:
-            print(f"DEBUG: Hit breakpoint at line {session.current_line}")
-            hit_breakpoint = True
-            break
+    with RUN_SECONDS.time():
+        return _respond(session, session.step_n(n), output_since, since_version)
+
+def run_until_line(session_id: str, line_number: int, max_steps: Optional[int] = None,
+                   output_since: Optional[int] = None, since_version: Optional[int] = None) -> Dict:
+    """
+    Step until the program reaches a line, keeping a snapshot of every step.
     
-    return session.get_state()
+    Args:
+        session_id: The ID of the session
+        line_number: Line to stop at
+        max_steps: Most steps to take, DebugSession.MAX_BATCH_STEPS by default
+        output_since: Only return the output from this line on, the
+            output_cursor of the previous state
+        since_version: Only return what changed since the state with this
+            version
+        
+    Returns:
+        Dictionary with the session state, stop_reason "line" or
+        "step_limit" unless the program finished, and the snapshots of the
+        steps taken, see step_n, or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+        
+    with RUN_SECONDS.time():
+        return _respond(session, session.run_until_line(line_number, max_steps), output_since, since_version)
 
 def toggle_breakpoint(session_id: str, line_number: int) -> Dict:
     """
@@ -636,16 +2522,83 @@ def toggle_breakpoint(session_id: str, line_number: int) -> Dict:
     Returns:
         Dictionary with updated breakpoints or error
     """
-    session = active_sessions.get(session_id)
+    session = session_manager.get(session_id)
     if not session:
         return {"error": "Session not found"}
     
-    if line_number in session.breakpoints:
-        session.breakpoints.remove(line_number)
-    else:
-        session.breakpoints.add(line_number)
+    return session.toggle_breakpoint(line_number)
+
+def set_breakpoint(session_id: str, line_number: int, condition: Optional[str] = None,
+                   hit_condition: Optional[str] = None, log_message: Optional[str] = None) -> Dict:
+    """
+    Set a breakpoint, optionally conditional, counted or logging instead of stopping.
+    
+    Args:
+        session_id: The ID of the session
+        line_number: The line number for the breakpoint
+        condition: Only stop when this expression is true in the paused frame
+        hit_condition: Only stop on some hits: "N", ">N", ">=N" or "%N"
+        log_message: Log this message, with {expressions} formatted, instead of stopping
+        
+    Returns:
+        Dictionary with the breakpoint and all breakpoint lines, or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    return session.set_breakpoint(line_number, condition, hit_condition, log_message)
+
+def remove_breakpoint(session_id: str, line_number: int) -> Dict:
+    """
+    Remove the breakpoint at a specific line.
+    
+    Args:
+        session_id: The ID of the session
+        line_number: The line number of the breakpoint
+        
+    Returns:
+        Dictionary with updated breakpoints or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    return session.remove_breakpoint(line_number)
+
+def add_watch(session_id: str, expression: str) -> Dict:
+    """
+    Watch an expression, evaluated at every stop of a debugging session.
     
-    return {"breakpoints": list(session.breakpoints)}
+    Args:
+        session_id: The ID of the session
+        expression: Python expression, e.g. "arr[i] > arr[j]" or "len(stack)"
+        
+    Returns:
+        Dictionary with the watch values or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    return session.add_watch(expression)
+
+def remove_watch(session_id: str, expression: str) -> Dict:
+    """
+    Stop watching an expression.
+    
+    Args:
+        session_id: The ID of the session
+        expression: A watched expression
+        
+    Returns:
+        Dictionary with the remaining watch values or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    return session.remove_watch(expression)
 
 def get_breakpoints(session_id: str) -> Dict:
     """
@@ -657,40 +2610,177 @@ def get_breakpoints(session_id: str) -> Dict:
     Returns:
         Dictionary with breakpoints or error
     """
-    session = active_sessions.get(session_id)
+    session = session_manager.get(session_id)
     if not session:
         return {"error": "Session not found"}
     
-    return {"breakpoints": list(session.breakpoints)}
+    return session.get_breakpoints()
 
-def get_variables(session_id: str) -> Dict:
+def get_variables(session_id: str, since_version: Optional[int] = None) -> Dict:
     """
     Get all variables in the current debugging session.
     
     Args:
         session_id: The ID of the session
+        since_version: Only return what changed since the state with this
+            version
+        
+    Returns:
+        Dictionary with variables or error. With since_version, only the
+        variables that changed, the names of the removed ones and the
+        version, or not_modified.
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    if since_version is None:
+        return session.get_variables()
+    state = _respond(session, session.get_state(), since_version=since_version)
+    keys = ("version", "not_modified", "delta", "variables", "removed_variables")
+    return {key: state[key] for key in keys if key in state}
+
+def get_variable(session_id: str, path: str, offset: int = 0, limit: int = 50) -> Dict:
+    """
+    Expand a variable of a debugging session one page at a time.
+    
+    Args:
+        session_id: The ID of the session
+        path: Variable path, e.g. "arr", "matrix[1]", "person['name']" or "node.next"
+        offset: Index of the first child to return
+        limit: Maximum number of children to return
+        
+    Returns:
+        Dictionary with the children of the variable or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    return session.get_variable(path, offset, limit)
+
+def get_frame_locals(session_id: str, index: int) -> Dict:
+    """
+    Get the locals of a frame on the call stack of a paused session.
+    
+    Args:
+        session_id: The ID of the session
+        index: Position in call_stack, 0 being the outermost frame
+        
+    Returns:
+        Dictionary with the frame's locals or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    return session.get_frame_locals(index)
+
+def get_call_tree(session_id: str, call_id: Optional[int] = None, max_depth: int = 3) -> Dict:
+    """
+    Get the recursion/call tree recorded for a debugging session.
+    
+    Args:
+        session_id: The ID of the session
+        call_id: Root call of the subtree, None for the top-level calls
+        max_depth: Levels of callees to include below the root
+        
+    Returns:
+        Dictionary with the calls or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    return session.get_call_tree(call_id, max_depth)
+
+def get_repeated_calls(session_id: str, min_count: int = 2) -> Dict:
+    """
+    Get the calls a debugging session made several times with the same arguments.
+    
+    Args:
+        session_id: The ID of the session
+        min_count: Minimum number of identical calls to report
+        
+    Returns:
+        Dictionary with the repeated calls or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    return session.get_repeated_calls(min_count)
+
+def get_variables_at(session_id: str, step: int) -> Dict:
+    """
+    Get the variables of a debugging session as they were at a given step.
+    
+    Args:
+        session_id: The ID of the session
+        step: Index of the line event
+        
+    Returns:
+        Dictionary with the step and its variables or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    return session.get_variables_at(step)
+
+def export_trace(session_id: str, path: str) -> Dict:
+    """
+    Write the execution of a recorded session to a trace file, to share it
+    or replay it later with load_trace.
+    
+    Args:
+        session_id: The ID of the session
+        path: File to write
+        
+    Returns:
+        Dictionary with the path, number of steps and size of the file, or error
+    """
+    session = session_manager.get(session_id)
+    if not session:
+        return {"error": "Session not found"}
+    
+    return session.export_trace(path)
+
+def get_output(session_id: str, output_since: Optional[int] = None) -> Dict:
+    """
+    Get the output of a debugging session, also while its program runs.
+    
+    Args:
+        session_id: The ID of the session
+        output_since: Only return the output from this line on, the
+            output_cursor of a previous state. None for the last lines.
         
     Returns:
-        Dictionary with variables or error
+        Dictionary with output, output_start and output_cursor or error
     """
-    session = active_sessions.get(session_id)
+    session = session_manager.get(session_id)
     if not session:
         return {"error": "Session not found"}
     
-    return {"variables": session.variables}
+    return session.get_output(output_since)
 
-def get_execution_state(session_id: str) -> Dict:
+def get_execution_state(session_id: str, output_since: Optional[int] = None,
+                        since_version: Optional[int] = None) -> Dict:
     """
     Get the complete execution state of a debugging session.
     
     Args:
         session_id: The ID of the session
+        output_since: Only return the output from this line on, the
+            output_cursor of the previous state
+        since_version: Only return what changed since the state with this
+            version
         
     Returns:
         Dictionary with complete state or error
     """
-    session = active_sessions.get(session_id)
+    session = session_manager.get(session_id)
     if not session:
         return {"error": "Session not found"}
     
-    return session.get_state()
\ No newline at end of file
+    return _respond(session, session.get_state(), output_since, since_version)
\ No newline at end of file
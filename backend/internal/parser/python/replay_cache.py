@@ -0,0 +1,161 @@
+import ast
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Optional
+
+# Modules whose use makes two runs of the same program differ: randomness,
+# clocks, the environment, the file system, concurrency and the network
+NONDETERMINISTIC_MODULES = {
+    "random", "secrets", "uuid", "numpy.random", "time", "datetime", "os", "pathlib", "glob",
+    "shutil", "tempfile", "threading", "multiprocessing", "concurrent", "asyncio", "subprocess",
+    "signal", "socket", "ssl", "select", "urllib", "http", "gc", "resource", "tracemalloc",
+    "ctypes", "importlib"
+}
+# Builtins with the same effect: object addresses, salted string hashes,
+# files and code that could import anything
+NONDETERMINISTIC_BUILTINS = {"id", "hash", "open", "__import__", "eval", "exec", "compile", "globals", "vars"}
+
+# Suffix of the trace files in the cache directory
+TRACE_SUFFIX = ".trace"
+
+
+def is_cacheable(code: str) -> bool:
+    """
+    Whether every run of a program shows the same execution, so one
+    recording can be replayed for all of them.
+
+    Programs using the modules and builtins above are not, nor are programs
+    that don't compile.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+
+    def nondeterministic(module: str) -> bool:
+        parts = module.split(".")
+        return any(".".join(parts[:end]) in NONDETERMINISTIC_MODULES for end in range(1, len(parts) + 1))
+
+    # Local name -> module, e.g. np -> numpy, to catch np.random.rand()
+    modules = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if nondeterministic(alias.name):
+                    return False
+                if alias.asname:
+                    modules[alias.asname] = alias.name
+                else:
+                    top = alias.name.split(".")[0]
+                    modules[top] = top
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module or ""
+            for alias in node.names:
+                if nondeterministic(module) or nondeterministic(f"{module}.{alias.name}"):
+                    return False
+                modules[alias.asname or alias.name] = f"{module}.{alias.name}"
+        elif isinstance(node, ast.Name) and node.id in NONDETERMINISTIC_BUILTINS:
+            return False
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute):
+            attributes = [node.attr]
+            base = node.value
+            while isinstance(base, ast.Attribute):
+                attributes.append(base.attr)
+                base = base.value
+            if isinstance(base, ast.Name) and base.id in modules:
+                if nondeterministic(".".join([modules[base.id], *reversed(attributes)])):
+                    return False
+    return True
+
+
+class ReplayCache:
+    """
+    Directory of trace files of recorded sessions, named after a hash of
+    what the recording depends on: the code, the test case and the session's
+    breakpoints and watches.
+
+    Reading an entry marks it as recently used. Once the files take more
+    than max_bytes, the least recently used ones are deleted. Entries are
+    written to a temporary file first and renamed, so several processes can
+    share the directory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """Hash of the JSON-serializable parts of a recording."""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + TRACE_SUFFIX)
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of the trace file of a key, None if it isn't cached."""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key: str, write: Callable[[str], Any]) -> None:
+        """
+        Cache a trace file.
+
+        Args:
+            key: See key()
+            write: Writes the trace to the path it is given
+        """
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        os.close(fd)
+        try:
+            write(temp_path)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self.evict()
+
+    def discard(self, key: str) -> None:
+        """Delete an entry, e.g. one that can't be read."""
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        """Delete the least recently used entries while the cache is too big."""
+        with self._lock:
+            entries = []
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith(TRACE_SUFFIX):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            # Evicted by another process meanwhile
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            size = sum(entry_size for _, entry_size, _ in entries)
+            for _, entry_size, path in sorted(entries):
+                if size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= entry_size
@@ -0,0 +1,146 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Seconds a session can stay unused before it is evicted
+SESSION_TTL = 30 * 60
+# Estimated bytes all sessions together may hold before the least recently
+# used ones are evicted, 0 for no limit
+MAX_MEMORY = 512 * 1024 * 1024
+# Seconds between two runs of the reaper
+REAPER_INTERVAL = 60.0
+
+
+class SessionManager:
+    """
+    Lifecycle of the debug sessions stored in a session_id -> session dict.
+
+    Every access to a session through get() marks it as used. cleanup(),
+    also run periodically by the reaper thread, evicts the sessions unused
+    for longer than ttl, then the least recently used ones while the total
+    memory footprint of the sessions exceeds max_memory. Evicting a session
+    closes it, which stops its execution thread.
+
+    Sessions only need close() and memory_footprint() methods, so proxies to
+    sessions living in worker processes are managed the same way.
+    """
+
+    def __init__(self, sessions: Dict[str, Any], ttl: float = SESSION_TTL,
+                 max_memory: int = MAX_MEMORY):
+        self.sessions = sessions
+        self.ttl = ttl
+        self.max_memory = max_memory
+
+        # session_id -> time.monotonic() of the last access
+        self.last_access: Dict[str, float] = {}
+        # Number of sessions evicted since the manager was created
+        self.evicted_count = 0
+        self._lock = threading.RLock()
+        self._reaper: Optional[threading.Thread] = None
+        self._stop_reaper = threading.Event()
+
+    def add(self, session: Any) -> None:
+        """Store a new session, or replace one with the same id."""
+        with self._lock:
+            self.sessions[session.id] = session
+            self.last_access[session.id] = time.monotonic()
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """Get a session and mark it as used."""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.last_access[session_id] = time.monotonic()
+            return session
+
+    def remove(self, session_id: str) -> Optional[Any]:
+        """Forget a session without closing it."""
+        with self._lock:
+            self.last_access.pop(session_id, None)
+            return self.sessions.pop(session_id, None)
+
+    def evict(self, session_id: str) -> bool:
+        """
+        Close and forget a session.
+
+        Returns:
+            True if evicted, False if not found
+        """
+        session = self.remove(session_id)
+        if session is None:
+            return False
+
+        session.close()
+        with self._lock:
+            self.evicted_count += 1
+        return True
+
+    def _footprint(self, session: Any) -> int:
+        footprint = session.memory_footprint()
+        # Sessions whose worker exited answer with an error
+        return footprint if isinstance(footprint, int) else 0
+
+    def cleanup(self, ttl: Optional[float] = None) -> List[str]:
+        """
+        Evict idle sessions, then the least recently used ones while the
+        sessions use more than max_memory.
+
+        Args:
+            ttl: Seconds of inactivity before eviction, self.ttl by default
+
+        Returns:
+            Ids of the evicted sessions
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        with self._lock:
+            # Forget access times of sessions removed behind our back, and
+            # start the clock for sessions added without add()
+            for session_id in list(self.last_access):
+                if session_id not in self.sessions:
+                    del self.last_access[session_id]
+            by_age = sorted(self.sessions, key=lambda session_id: self.last_access.setdefault(session_id, now))
+
+        evicted = []
+        for session_id in by_age:
+            if now - self.last_access.get(session_id, now) > ttl and self.evict(session_id):
+                evicted.append(session_id)
+
+        if self.max_memory:
+            remaining = [session_id for session_id in by_age if session_id not in evicted]
+            footprints = {}
+            for session_id in remaining:
+                session = self.sessions.get(session_id)
+                if session is not None:
+                    footprints[session_id] = self._footprint(session)
+
+            total = sum(footprints.values())
+            for session_id in remaining:
+                if total <= self.max_memory:
+                    break
+                if session_id in footprints and self.evict(session_id):
+                    evicted.append(session_id)
+                    total -= footprints[session_id]
+
+        return evicted
+
+    def start(self, interval: float = REAPER_INTERVAL) -> None:
+        """Run cleanup() every interval seconds in a background thread."""
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._stop_reaper.clear()
+            self._reaper = threading.Thread(target=self._reap, args=(interval,), daemon=True)
+            self._reaper.start()
+
+    def stop(self) -> None:
+        """Stop the reaper thread."""
+        self._stop_reaper.set()
+
+    def _reap(self, interval: float) -> None:
+        while not self._stop_reaper.wait(interval):
+            try:
+                self.cleanup()
+            except Exception:
+                # Keep reaping, a session failing to close must not stop it
+                pass
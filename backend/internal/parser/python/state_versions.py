@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+# States kept per session to compute deltas against
+MAX_VERSIONS = 8
+
+# Keys of a state sent as a delta of their own, or not compared at all
+_DELTA_KEYS = ("id", "version", "variables", "call_stack", "output", "output_start", "output_cursor",
+               "snapshots")
+# Keys of a state that belong to the request rather than the program state
+_UNCOMPARED_KEYS = ("output", "snapshots")
+
+
+def _output_end(state: Dict) -> tuple:
+    """Where the output of a state ends: its cursor and incomplete last line."""
+    output, cursor = state["output"], state["output_cursor"]
+    partial = output[-1] if len(output) > cursor - state["output_start"] else ""
+    return cursor, partial
+
+
+class StateVersions:
+    """
+    Versions of the states returned for one debug session.
+
+    Every state gets a version number, which only increases when the state
+    differs from the previous one. The last few states are kept, so that a
+    client sending the version it has gets back only what changed since:
+    the changed variables, the frames popped from and pushed on the call
+    stack, the new output and the other keys whose value changed.
+
+    States are compared without their output lines, which depend on the
+    requested cursor, but with the position the output ends at. Snapshots
+    of batch steps are always sent along with a delta.
+    """
+
+    def __init__(self, max_versions: int = MAX_VERSIONS):
+        self.max_versions = max_versions
+        self.version = 0
+        # Version -> state without its output lines
+        self.states: 'OrderedDict[int, Dict]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def publish(self, state: Dict) -> Dict:
+        """Number a state, with a new version if it changed, and keep it."""
+        stored = {key: value for key, value in state.items() if key not in _UNCOMPARED_KEYS}
+        stored["output_end"] = _output_end(state)
+        with self._lock:
+            latest = self.states.get(self.version)
+            if latest != stored:
+                self.version += 1
+                self.states[self.version] = stored
+                if len(self.states) > self.max_versions:
+                    self.states.popitem(last=False)
+            state["version"] = self.version
+        return state
+
+    def delta(self, state: Dict, since_version: int, read_output: Callable[[int], Dict]) -> Dict:
+        """
+        Describe a published state as changes to an earlier one.
+
+        Args:
+            state: State returned by publish()
+            since_version: Version the client has
+            read_output: Reads the output from a line on, see DebugSession.get_output
+
+        Returns:
+            {"id", "version", "not_modified": True} if nothing changed, the
+            changes with "delta": True, or the full state if since_version is
+            too old or the output went back (a recorded session stepping
+            backward)
+        """
+        if since_version == state["version"]:
+            return {"id": state["id"], "version": state["version"], "not_modified": True}
+        with self._lock:
+            old = self.states.get(since_version)
+        if old is None or old["output_end"][0] > state["output_cursor"]:
+            return state
+
+        changes = {"id": state["id"], "version": state["version"], "since_version": since_version,
+                   "delta": True}
+        for key, value in state.items():
+            if key not in _DELTA_KEYS and old.get(key) != value:
+                changes[key] = value
+
+        # Entries are rebuilt only for variables that changed
+        old_variables = {entry["name"]: entry for entry in old["variables"]}
+        changes["variables"] = [
+            entry for entry in state["variables"]
+            if old_variables.get(entry["name"]) is not entry and old_variables.get(entry["name"]) != entry
+        ]
+        names = {entry["name"] for entry in state["variables"]}
+        changes["removed_variables"] = [name for name in old_variables if name not in names]
+
+        changes["call_stack"] = self._stack_delta(old["call_stack"], state["call_stack"])
+        if "snapshots" in state:
+            changes["snapshots"] = state["snapshots"]
+        changes.update(read_output(old["output_end"][0]))
+        return changes
+
+    @staticmethod
+    def _stack_delta(old: List[Dict], new: List[Dict]) -> Dict:
+        """Frames to pop from the end of the old call stack, and frames to push instead."""
+        common = 0
+        for old_frame, new_frame in zip(old, new):
+            if old_frame != new_frame:
+                break
+            common += 1
+        return {"popped": len(old) - common, "pushed": new[common:]}
@@ -1,9 +1,34 @@
 import unittest
 import os
+import json
+import sys
 import python_debugger
+from replay_cache import ReplayCache, is_cacheable
 import time
 import pytest 
+import tempfile
 import textwrap
+import functools
+
+
+def tracing_backends(test):
+    """Run a test once per available tracing backend, passed as its backend argument."""
+    @functools.wraps(test)
+    def run(self):
+        backends = ["bdb"]
+        if hasattr(sys, "monitoring"):
+            backends.append("monitoring")
+        
+        original_backend = python_debugger.TRACING_BACKEND
+        try:
+            for backend in backends:
+                python_debugger.TRACING_BACKEND = backend
+                with self.subTest(backend=backend):
+                    test(self, backend)
+        finally:
+            python_debugger.TRACING_BACKEND = original_backend
+    return run
+
 
 class TestPythonDebuggerService(unittest.TestCase):
     """Test cases for the IPDB service."""
@@ -52,8 +77,8 @@ for i in range(3):
         self.assertIsNone(result["error"])
         self.assertEqual(result["breakpoints"], [])
         
-        # Check that a temporary file was created
-        self.assertTrue(os.path.exists(python_debugger.active_sessions[result["id"]].temp_file_path))
+        # Nothing is compiled or written to disk before execution starts
+        self.assertIsNone(python_debugger.active_sessions[result["id"]].program)
     
     def test_get_session(self):
         """Test retrieving an existing session."""
@@ -78,9 +103,6 @@ for i in range(3):
         create_result = python_debugger.create_session(self.sample_code)
         session_id = create_result["id"]
         
-        # Get file path to check for removal
-        temp_file_path = python_debugger.active_sessions[session_id].temp_file_path
-        
         # Delete the session
         result = python_debugger.delete_session(session_id)
         
@@ -88,9 +110,6 @@ for i in range(3):
         self.assertTrue(result)
         self.assertNotIn(session_id, python_debugger.active_sessions)
         
-        # Check that temporary file was removed
-        self.assertFalse(os.path.exists(temp_file_path))
-        
         # Try deleting non-existent session
         result = python_debugger.delete_session("non-existent-id")
         self.assertFalse(result)
@@ -156,6 +175,941 @@ for i in range(3):
         if "Result: 3" not in output_text and result["is_finished"]:
             print(f"WARNING: Expected output 'Result: 3' not found. Got: {output_text}")
     
+    def test_step_latency(self):
+        """Test that stepping returns as soon as the next line is reached."""
+        code = "total = 0\nfor i in range(50):\n    total += i\nprint(total)"
+        result = python_debugger.create_session(code)
+        session_id = result["id"]
+        
+        result = python_debugger.start_execution(session_id)
+        self.assertEqual(result["current_line"], 1)
+        
+        # 20 steps used to take at least 2 seconds with the polling loop
+        start_time = time.time()
+        for _ in range(20):
+            result = python_debugger.step_forward(session_id)
+        elapsed_time = time.time() - start_time
+        
+        self.assertFalse(result["is_finished"])
+        self.assertIn(result["current_line"], (2, 3))
+        self.assertLess(elapsed_time, 1.0, "Stepping should not wait on a polling interval")
+    
+    def test_delete_session_stops_execution_thread(self):
+        """Test that deleting a paused session lets its execution thread exit."""
+        code = "x = 1\ny = 2\nz = 3"
+        result = python_debugger.create_session(code)
+        session_id = result["id"]
+        
+        python_debugger.start_execution(session_id)
+        thread = python_debugger.active_sessions[session_id].execution_thread
+        self.assertTrue(thread.is_alive())
+        
+        python_debugger.delete_session(session_id)
+        thread.join(timeout=1.0)
+        self.assertFalse(thread.is_alive(), "Execution thread should quit when the session is deleted")
+    
+    def test_record_mode_step_backward_and_jump(self):
+        """Test replaying a recorded session forwards, backwards and by index."""
+        code = "a = 1\nprint('first')\nb = a + 1\nprint('second')"
+        result = python_debugger.create_session(code, record=True)
+        session_id = result["id"]
+        
+        # Starting records the whole program and shows the first line
+        result = python_debugger.start_execution(session_id)
+        self.assertEqual(result["total_steps"], 4)
+        self.assertEqual(result["step"], 0)
+        self.assertEqual(result["current_line"], 1)
+        self.assertFalse(result["is_finished"])
+        self.assertNotIn("first", result["output"])
+        
+        result = python_debugger.step_forward(session_id)
+        result = python_debugger.step_forward(session_id)
+        self.assertEqual(result["current_line"], 3)
+        self.assertIn("first", result["output"])
+        self.assertNotIn("second", result["output"])
+        self.assertTrue(any(v["name"] == "a" and v["value"] == "1" for v in result["variables"]))
+        
+        result = python_debugger.step_backward(session_id)
+        self.assertEqual(result["current_line"], 2)
+        self.assertNotIn("first", result["output"])
+        
+        # Jumping past the end finishes the replay with the full output
+        result = python_debugger.jump_to(session_id, 100)
+        self.assertTrue(result["is_finished"])
+        self.assertIn("first", result["output"])
+        self.assertIn("second", result["output"])
+        
+        result = python_debugger.jump_to(session_id, 0)
+        self.assertFalse(result["is_finished"])
+        self.assertEqual(result["current_line"], 1)
+        
+        # Live sessions can't go backwards
+        live_id = python_debugger.create_session(code)["id"]
+        result = python_debugger.step_backward(live_id)
+        self.assertIn("error", result)
+    
+    def test_record_mode_error_shown_at_end(self):
+        """Test that a recorded error only shows once the replay reaches the end."""
+        code = "x = 10\ny = 0\nz = x / y"
+        session_id = python_debugger.create_session(code, record=True)["id"]
+        
+        result = python_debugger.start_execution(session_id)
+        self.assertIsNone(result["error"])
+        
+        result = python_debugger.jump_to(session_id, result["total_steps"])
+        self.assertTrue(result["is_finished"])
+        self.assertIn("ZeroDivisionError", result["error"])
+    
+    @tracing_backends
+    def test_tracing_backends(self, backend):
+        """Test that stepping behaves the same with every available tracing backend."""
+        code = "import json\ndef inc(n):\n    return n + 1\nx = inc(1)\ny = json.dumps([x])"
+        session_id = python_debugger.create_session(code)["id"]
+        result = python_debugger.start_execution(session_id)
+        
+        # Library code (json) is never stopped in
+        lines = [result["current_line"]]
+        while not result["is_finished"]:
+            result = python_debugger.step_forward(session_id)
+            lines.append(result["current_line"])
+        
+        self.assertEqual(lines[:5], [1, 2, 4, 3, 5], f"Unexpected lines with {backend}")
+        self.assertIsNone(result["error"])
+    
+    def test_process_backend(self):
+        """Test sessions hosted by worker processes, and killing a runaway one."""
+        original = python_debugger.EXECUTION_BACKEND, python_debugger.WORKER_PROCESSES
+        python_debugger.EXECUTION_BACKEND = "process"
+        python_debugger.WORKER_PROCESSES = 2
+        try:
+            session_id = python_debugger.create_session("x = 1\ny = x + 1\nprint(y)")["id"]
+            self.assertEqual(python_debugger.toggle_breakpoint(session_id, 2), {"breakpoints": [2]})
+            
+            result = python_debugger.start_execution(session_id)
+            self.assertEqual(result["current_line"], 2)
+            self.assertIn("x", [v["name"] for v in result["variables"]])
+            
+            result = python_debugger.run_to_completion(session_id)
+            self.assertTrue(result["is_finished"])
+            self.assertIn("2", result["output"])
+            
+            result = python_debugger.reset_session(session_id)
+            self.assertEqual(result["id"], session_id)
+            self.assertEqual(result["breakpoints"], [2])
+            self.assertIn("error", python_debugger.step_backward(session_id))
+            
+            # A program that never stops can be killed with its worker
+            runaway_id = python_debugger.create_session("while True:\n    pass")["id"]
+            python_debugger.start_execution(runaway_id)
+            worker = python_debugger.active_sessions[runaway_id].worker
+            self.assertTrue(python_debugger.terminate_session(runaway_id))
+            self.assertFalse(worker.process.is_alive())
+            self.assertNotIn(runaway_id, python_debugger.active_sessions)
+            
+            # The pool replaces the killed worker
+            session_id = python_debugger.create_session("a = 1")["id"]
+            self.assertEqual(python_debugger.start_execution(session_id)["current_line"], 1)
+        finally:
+            for session_id in list(python_debugger.active_sessions):
+                python_debugger.delete_session(session_id)
+            python_debugger.shutdown_workers()
+            python_debugger.EXECUTION_BACKEND, python_debugger.WORKER_PROCESSES = original
+    
+    def test_fork_server_backend(self):
+        """Test sessions forked from a warm pool, one process per session."""
+        original = python_debugger.EXECUTION_BACKEND, python_debugger.WARM_WORKERS, python_debugger.MEMORY_BUDGET
+        python_debugger.EXECUTION_BACKEND = "forkserver"
+        python_debugger.WARM_WORKERS = 2
+        python_debugger.MEMORY_BUDGET = 64 * 1024 * 1024
+        try:
+            python_debugger.start_workers()
+            pool = python_debugger._get_worker_pool()
+            deadline = time.time() + 10
+            while len(pool.idle) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            
+            start_time = time.time()
+            session_id = python_debugger.create_session("x = 1\ny = 2")["id"]
+            result = python_debugger.start_execution(session_id)
+            self.assertEqual(result["current_line"], 1)
+            self.assertLess(time.time() - start_time, 0.5, "Warm workers should start sessions quickly")
+            
+            # Killing a runaway session leaves the others running
+            runaway_id = python_debugger.create_session("while True:\n    pass")["id"]
+            python_debugger.start_execution(runaway_id)
+            self.assertTrue(python_debugger.terminate_session(runaway_id))
+            result = python_debugger.step_forward(session_id)
+            self.assertEqual(result["current_line"], 2)
+            self.assertIsNone(result["error"])
+            
+            # Each session process can only grow by the memory budget
+            if sys.platform.startswith("linux"):
+                hog_id = python_debugger.create_session("data = bytearray(256 * 1024 * 1024)\nok = 1")["id"]
+                result = python_debugger.run_to_completion(hog_id)
+                self.assertTrue(result["is_finished"])
+                self.assertEqual(result["error"], "Memory limit of 64 MB exceeded")
+        finally:
+            for session_id in list(python_debugger.active_sessions):
+                python_debugger.delete_session(session_id)
+            python_debugger.shutdown_workers()
+            (python_debugger.EXECUTION_BACKEND, python_debugger.WARM_WORKERS,
+             python_debugger.MEMORY_BUDGET) = original
+    
+    def test_judge(self):
+        """Test running the entry function on test cases in parallel processes."""
+        code = textwrap.dedent("""
+        import time
+
+        def average(nums, delay=0):
+            while delay < 0:
+                pass
+            time.sleep(delay)
+            print("nums:", nums)
+            return sum(nums) // len(nums)
+
+        if __name__ == "__main__":
+            print(average([1]))
+        """)
+        original = python_debugger.JUDGE_PROCESSES
+        python_debugger.JUDGE_PROCESSES = 4
+        try:
+            pool, _ = python_debugger._get_judge_pool()
+            deadline = time.time() + 10
+            while len(pool.idle) < 4 and time.time() < deadline:
+                time.sleep(0.01)
+            
+            # Cases run at the same time, not one after the other
+            test_cases = [{"input_data": json.dumps([[2, 4], 0.5]), "expected_output": "3"},
+                          {"input_data": [[2, 4], 0.5], "expected_output": 4},
+                          {"input_data": {"nums": [], "delay": 0.5}},
+                          [7, 7, 7]]
+            start_time = time.time()
+            result = python_debugger.judge(code, test_cases)
+            self.assertLess(time.time() - start_time, 1.5, "Test cases should run in parallel")
+            
+            self.assertEqual(result["entry_point"], "average")
+            self.assertEqual(result["passed"], 1)
+            first, second, third, fourth = result["results"]
+            self.assertEqual((first["result"], first["passed"], first["stdout"]), (3, True, "nums: [2, 4]\n"))
+            self.assertGreaterEqual(first["seconds"], 0.5)
+            self.assertIsInstance(first["peak_memory"], int)
+            self.assertEqual((second["result"], second["passed"]), (3, False))
+            self.assertEqual(third["error"], "ZeroDivisionError: integer division or modulo by zero")
+            self.assertIn("return sum(nums) // len(nums)", third["stderr"])
+            self.assertIsNone(third["passed"])
+            self.assertEqual((fourth["result"], fourth["error"]), (7, None))
+            
+            # A case that doesn't end is killed
+            result = python_debugger.judge(code, [[[1], -1]], max_seconds=0.5)
+            self.assertEqual(result["results"][0]["error"], "Time limit of 0.5 seconds exceeded")
+            
+            # Clients can't ask for more time than JUDGE_TIMEOUT
+            original_timeout = python_debugger.JUDGE_TIMEOUT
+            python_debugger.JUDGE_TIMEOUT = 0.5
+            try:
+                result = python_debugger.judge(code, [[[1], -1]], max_seconds=1000)
+            finally:
+                python_debugger.JUDGE_TIMEOUT = original_timeout
+            self.assertEqual(result["results"][0]["error"], "Time limit of 0.5 seconds exceeded")
+
+            # Exiting fails the case, not the worker
+            result = python_debugger.judge("import sys\ndef solve(x):\n    sys.exit(x)", [0, 3])
+            self.assertEqual([case["error"] for case in result["results"]], ["SystemExit: 0", "SystemExit: 3"])
+            self.assertIn("sys.exit(x)", result["results"][0]["stderr"])
+
+            self.assertIn("error", python_debugger.judge("x = (", [1]))
+            self.assertIn("error", python_debugger.judge("x = 1", [1]))
+        finally:
+            python_debugger.shutdown_workers()
+            python_debugger.JUDGE_PROCESSES = original
+    
+    def test_session_eviction(self):
+        """Test that idle sessions and, over the memory budget, the least recently used ones are evicted."""
+        manager = python_debugger.session_manager
+        idle_id = python_debugger.create_session("while True:\n    pass")["id"]
+        python_debugger.start_execution(idle_id)
+        thread = python_debugger.active_sessions[idle_id].execution_thread
+        old_id = python_debugger.create_session("a = 1")["id"]
+        new_id = python_debugger.create_session("b = 2")["id"]
+        
+        # Only the session unused for an hour is evicted, and its thread stops
+        manager.last_access[idle_id] -= 3600
+        self.assertEqual(python_debugger.cleanup_sessions(), [idle_id])
+        thread.join(timeout=1.0)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(python_debugger.get_session(idle_id))
+        
+        # Over the memory budget, the least recently used session goes first
+        python_debugger.get_session(new_id)
+        original_budget = manager.max_memory
+        manager.max_memory = python_debugger.active_sessions[new_id].memory_footprint() + 1
+        try:
+            self.assertEqual(python_debugger.cleanup_sessions(), [old_id])
+        finally:
+            manager.max_memory = original_budget
+        self.assertEqual(list(python_debugger.active_sessions), [new_id])
+    
+    @tracing_backends
+    def test_run_to_completion_budgets(self, backend):
+        """Test running to a breakpoint without stepping, and the step and time budgets."""
+        sort_code = textwrap.dedent("""
+        def bubble_sort(arr):
+            for i in range(len(arr)):
+                for j in range(len(arr) - i - 1):
+                    if arr[j] > arr[j + 1]:
+                        arr[j], arr[j + 1] = arr[j + 1], arr[j]
+
+        data = list(range(300, 0, -1))
+        bubble_sort(data)
+        done = data[:3]
+        """)
+        session_id = python_debugger.create_session(sort_code)["id"]
+        python_debugger.start_execution(session_id)
+        python_debugger.toggle_breakpoint(session_id, 10)
+        
+        result = python_debugger.run_to_completion(session_id)
+        self.assertEqual(result["current_line"], 10, f"Unexpected line with {backend}")
+        self.assertEqual(result["stop_reason"], "breakpoint")
+        self.assertIn("[1, 2, 3, 4, 5, 6, 7, 8, 9, 10, ...]", [v["value"] for v in result["variables"]])
+        
+        result = python_debugger.run_to_completion(session_id)
+        self.assertTrue(result["is_finished"])
+        self.assertIn("[1, 2, 3]", [v["value"] for v in result["variables"]])
+        
+        # Endless loops pause once a budget is spent
+        session_id = python_debugger.create_session("i = 0\nwhile True:\n    i += 1")["id"]
+        python_debugger.start_execution(session_id)
+        result = python_debugger.run_to_completion(session_id, max_steps=100)
+        self.assertEqual(result["stop_reason"], "step_limit")
+        self.assertIn("49", [v["value"] for v in result["variables"]])
+        
+        result = python_debugger.run_to_completion(session_id, max_seconds=0.1)
+        self.assertEqual(result["stop_reason"], "time_limit")
+        self.assertFalse(result["is_finished"])
+        self.assertIsNone(result["error"])
+        self.assertEqual(python_debugger.step_forward(session_id)["stop_reason"], "step")
+    
+    @tracing_backends
+    def test_run_to_completion_before_start(self, backend):
+        """Test that running a session that hasn't started stops at its first breakpoint."""
+        session_id = python_debugger.create_session("x = 1\ny = 2\nz = 3\nw = 4")["id"]
+        python_debugger.toggle_breakpoint(session_id, 3)
+        result = python_debugger.run_to_completion(session_id)
+        self.assertEqual((result["current_line"], result["stop_reason"]), (3, "breakpoint"))
+        self.assertFalse(result["is_finished"])
+        
+        result = python_debugger.run_to_completion(session_id)
+        self.assertTrue(result["is_finished"])
+        self.assertEqual([v["value"] for v in result["variables"] if v["name"] == "w"], ["4"])
+        
+        # Without breakpoints it runs to the end
+        session_id = python_debugger.create_session("x = 1\ny = 2")["id"]
+        self.assertTrue(python_debugger.run_to_completion(session_id)["is_finished"])
+    
+    @tracing_backends
+    def test_conditional_breakpoints(self, backend):
+        """Test conditions, hit counts and logpoints evaluated by the tracer."""
+        code = "total = 0\nfor i in range(100):\n    total += i\nprint(total)"
+        session_id = python_debugger.create_session(code)["id"]
+        python_debugger.set_breakpoint(session_id, 3, condition="i == 50")
+        python_debugger.set_breakpoint(session_id, 2, log_message="i={i} total={{{total}}}")
+        
+        result = python_debugger.start_execution(session_id)
+        self.assertEqual(result["current_line"], 3, f"Unexpected line with {backend}")
+        self.assertEqual(result["stop_reason"], "breakpoint")
+        self.assertIn({"name": "i", "value": "50", "type": "int", "line": 3},
+                      result["variables"])
+        self.assertEqual(len(result["logs"]), 51)
+        self.assertEqual(result["logs"][0], "i=<NameError: name 'i' is not defined> total={0}")
+        self.assertEqual(result["logs"][2], "i=1 total={1}")
+        
+        # Only every 20th iteration with a hit condition
+        python_debugger.set_breakpoint(session_id, 3, hit_condition="%20")
+        python_debugger.remove_breakpoint(session_id, 2)
+        result = python_debugger.run_to_completion(session_id)
+        self.assertIn("70", [v["value"] for v in result["variables"] if v["name"] == "i"])
+        details = python_debugger.get_breakpoints(session_id)["details"]
+        self.assertEqual(details[0]["hits"], 20)
+        
+        # Invalid breakpoints are rejected when they are set
+        self.assertIn("error", python_debugger.set_breakpoint(session_id, 3, condition="i =="))
+        self.assertIn("error", python_debugger.set_breakpoint(session_id, 3, hit_condition="sometimes"))
+
+        # Conditions and logged expressions that never end fail like errors
+        code = "def spin():\n    while True:\n        pass\nfor i in range(3):\n    x = i\ndone = True"
+        session_id = python_debugger.create_session(code)["id"]
+        python_debugger.set_breakpoint(session_id, 5, log_message="{i} {spin()} {i}")
+        python_debugger.set_breakpoint(session_id, 6, condition="spin()")
+        start_time = time.time()
+        result = python_debugger.start_execution(session_id)
+        self.assertLess(time.time() - start_time, 2.0, f"Condition budget not enforced with {backend}")
+        self.assertEqual((result["current_line"], result["stop_reason"]), (6, "breakpoint"))
+        self.assertEqual(result["logs"], [f"{i} <TimeoutError: Out of time> <TimeoutError: Out of time>"
+                                          for i in range(3)])
+        details = python_debugger.get_breakpoints(session_id)["details"]
+        self.assertEqual(details[1]["error"], "TimeoutError: Out of time")
+
+    def test_watch_expressions(self):
+        """Test watch expressions in live and recorded sessions."""
+        code = "stack = []\nfor i in range(3):\n    stack.append(i)\ndone = True"
+        
+        session_id = python_debugger.create_session(code)["id"]
+        python_debugger.start_execution(session_id)
+        python_debugger.step_forward(session_id)
+        result = python_debugger.add_watch(session_id, "len(stack)")
+        self.assertEqual(result["watches"], [
+            {"expression": "len(stack)", "value": "0", "type": "int", "error": None}
+        ])
+        self.assertIn("error", python_debugger.add_watch(session_id, "len(stack"))
+        
+        python_debugger.add_watch(session_id, "stack[-1] * 10")
+        python_debugger.step_forward(session_id)
+        result = python_debugger.step_forward(session_id)
+        self.assertEqual([w["value"] for w in result["watches"]], ["1", "0"])
+        
+        result = python_debugger.run_to_completion(session_id)
+        self.assertTrue(result["is_finished"])
+        self.assertEqual([w["value"] for w in result["watches"]], ["3", "20"])
+        
+        # Recorded sessions evaluate watches once per recorded step
+        session_id = python_debugger.create_session(code, record=True)["id"]
+        python_debugger.add_watch(session_id, "stack[-1]")
+        python_debugger.start_execution(session_id)
+        watches = python_debugger.jump_to(session_id, 3)["watches"]
+        self.assertEqual((watches[0]["value"], watches[0]["error"]), ("0", None))
+        watches = python_debugger.jump_to(session_id, 0)["watches"]
+        self.assertIn("NameError", watches[0]["error"])
+        
+        # Slow watches are disabled
+        session_id = python_debugger.create_session(code)["id"]
+        python_debugger.start_execution(session_id)
+        python_debugger.add_watch(session_id, "sum(range(10**7))")
+        python_debugger.add_watch(session_id, "1 + 1")
+        watches = python_debugger.step_forward(session_id)["watches"]
+        self.assertEqual(watches[1]["value"], "2")
+        watches = python_debugger.step_forward(session_id)["watches"]
+        self.assertIn("Disabled", watches[0]["error"])
+
+    @tracing_backends
+    def test_watch_budget(self, backend):
+        """Test that watches which never end are aborted instead of stalling the stop."""
+        code = "def spin(n):\n    while True:\n        n += 1\nx = 1\ny = 2"
+        session_id = python_debugger.create_session(code)["id"]
+        python_debugger.start_execution(session_id)
+        # Functions called by watches don't stop on breakpoints
+        python_debugger.toggle_breakpoint(session_id, 3)
+        start_time = time.time()
+        python_debugger.add_watch(session_id, "x")
+        python_debugger.add_watch(session_id, "spin(0)")
+        watches = python_debugger.add_watch(session_id, "[0 for _ in iter(int, 1)]")["watches"]
+        self.assertTrue(watches[2]["error"].startswith("TimeoutError"), watches[2]["error"])
+
+        result = python_debugger.step_forward(session_id)
+        self.assertEqual((result["current_line"], result["stop_reason"]), (4, "step"))
+        self.assertEqual([frame["function"] for frame in result["call_stack"]], ["<module>"])
+        self.assertTrue(result["watches"][1]["error"].startswith("TimeoutError"))
+
+        watches = python_debugger.step_forward(session_id)["watches"]
+        self.assertEqual(watches[0]["value"], "1")
+        self.assertEqual([watch["error"][:8] for watch in watches[1:]], ["Disabled"] * 2)
+        self.assertLess(time.time() - start_time, 2.0, f"Watch budget not enforced with {backend}")
+
+        result = python_debugger.run_to_completion(session_id)
+        self.assertTrue(result["is_finished"])
+        self.assertIsNone(result["error"])
+
+    def test_output_cursor(self):
+        """Test reading only the new output of a session."""
+        code = "print('Enter:')\nprint(5)\nfor i in range(5000):\n    print(i)\ndone = True"
+        
+        session_id = python_debugger.create_session(code)["id"]
+        python_debugger.set_breakpoint(session_id, 5)
+        result = python_debugger.start_execution(session_id)
+        self.assertEqual(result["current_line"], 5)
+        self.assertLessEqual(len(result["output"]), python_debugger.DebugSession.OUTPUT_PAGE)
+        self.assertEqual(result["output"][-1], "4999")
+        
+        output, cursor = [], 0
+        while True:
+            result = python_debugger.get_execution_state(session_id, output_since=cursor)
+            if not result["output"]:
+                break
+            self.assertEqual(result["output_start"], cursor)
+            output += result["output"]
+            cursor = result["output_cursor"]
+        self.assertEqual(output, ["Enter:", "5"] + [str(i) for i in range(5000)])
+        
+        # Recorded sessions only show the output printed by the replayed step
+        session_id = python_debugger.create_session(code, record=True)["id"]
+        python_debugger.start_execution(session_id)
+        result = python_debugger.jump_to(session_id, 6, output_since=0)
+        self.assertEqual(result["output"], ["Enter:", "5", "0", "1"])
+    
+    def test_concurrent_sessions_output(self):
+        """Test that sessions running at the same time keep their output apart."""
+        import threading
+        
+        codes = {name: f"for i in range(300):\n    print('{name}', i)\ndone = True" for name in "ab"}
+        session_ids = {name: python_debugger.create_session(code)["id"] for name, code in codes.items()}
+        for session_id in session_ids.values():
+            python_debugger.set_breakpoint(session_id, 3)
+        
+        threads = [threading.Thread(target=python_debugger.start_execution, args=(session_id,))
+                   for session_id in session_ids.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Prints of the server don't end up in the sessions' output
+        print("server output")
+        
+        for name, session_id in session_ids.items():
+            result = python_debugger.get_execution_state(session_id, output_since=0)
+            self.assertEqual(result["output"], [f"{name} {i}" for i in range(300)])
+    
+    def test_state_versions(self):
+        """Test getting only what changed since a version of the state."""
+        code = "def f(n):\n    x = n * 2\n    return x\nitems = []\nitems.append(f(1))\nprint('done')"
+        session_id = python_debugger.create_session(code)["id"]
+        state = python_debugger.start_execution(session_id)
+        version = state["version"]
+        
+        result = python_debugger.get_execution_state(session_id, since_version=version)
+        self.assertEqual(result, {"id": session_id, "version": version, "not_modified": True})
+        self.assertEqual(python_debugger.get_variables(session_id, since_version=version)["not_modified"], True)
+        
+        for _ in range(3):
+            state = python_debugger.step_forward(session_id)
+        self.assertEqual((state["current_line"], state["call_stack"][-1]["function"]), (2, "f"))
+        result = python_debugger.step_forward(session_id, since_version=state["version"])
+        self.assertTrue(result["delta"])
+        self.assertEqual(result["current_line"], 3)
+        self.assertEqual([entry["name"] for entry in result["variables"]], ["x"])
+        self.assertEqual(result["call_stack"]["popped"], 1)
+        self.assertEqual(result["call_stack"]["pushed"][0]["line"], 3)
+        self.assertNotIn("breakpoints", result)
+        
+        version = result["version"]
+        for _ in range(3):
+            python_debugger.step_forward(session_id)
+        result = python_debugger.get_execution_state(session_id, since_version=version)
+        self.assertEqual(result["output"], ["done"])
+        self.assertTrue(result["is_finished"])
+        self.assertEqual([entry["name"] for entry in result["variables"]], ["items"])
+        self.assertEqual(result["call_stack"]["popped"], 2)
+        
+        # Stepping backward removes variables
+        recorded_id = python_debugger.create_session("a = 1\nb = 2\nc = 3", record=True)["id"]
+        python_debugger.start_execution(recorded_id)
+        version = python_debugger.jump_to(recorded_id, 2)["version"]
+        result = python_debugger.step_backward(recorded_id, since_version=version)
+        self.assertEqual((result["variables"], result["removed_variables"]), ([], ["b"]))
+        
+        # Versions too old to diff against get the full state
+        result = python_debugger.get_execution_state(session_id, since_version=-1)
+        self.assertNotIn("delta", result)
+        self.assertIn("items", [entry["name"] for entry in result["variables"]])
+        
+        # Resetting keeps counting, so versions of the old session don't match
+        self.assertGreater(python_debugger.reset_session(session_id)["version"], result["version"])
+    
+    def test_step_batches(self):
+        """Test taking several steps in one call, live and recorded."""
+        code = "total = 0\nfor i in range(3):\n    total += i\n    print(total)\nprint('end')"
+        for record in (False, True):
+            session_id = python_debugger.create_session(code, record=record)["id"]
+            result = python_debugger.step_n(session_id, 3)
+            self.assertEqual([snapshot["line"] for snapshot in result["snapshots"]], [1, 2, 3])
+            self.assertEqual([[entry["name"] for entry in snapshot["variables"]]
+                              for snapshot in result["snapshots"]], [[], ["total"], ["i"]])
+            self.assertEqual(result["current_line"], 3)
+            
+            # Output appears at the step after the line printing it
+            result = python_debugger.run_until_line(session_id, 3, since_version=result["version"])
+            self.assertTrue(result["delta"])
+            self.assertEqual(result["stop_reason"], "line")
+            self.assertEqual([snapshot["line"] for snapshot in result["snapshots"]], [4, 2, 3])
+            self.assertEqual(result["snapshots"][1]["output"], ["0"])
+            self.assertEqual(result["snapshots"][2]["variables"][0]["value"], "1")
+            
+            result = python_debugger.run_until_line(session_id, 10, max_steps=2)
+            self.assertEqual((result["stop_reason"], len(result["snapshots"])), ("step_limit", 2))
+            
+            result = python_debugger.step_n(session_id, 100)
+            self.assertTrue(result["is_finished"])
+            self.assertEqual(result["output"], ["0", "1", "3", "end"])
+            python_debugger.delete_session(session_id)
+    
+    def test_shared_programs(self):
+        """Test compiling a program once for every session and reset running it."""
+        code = "def f(x):\n    return 10 / x\nf(2)\nf(0)"
+        first_id = python_debugger.create_session(code)["id"]
+        second_id = python_debugger.create_session(code)["id"]
+        python_debugger.start_execution(first_id)
+        python_debugger.start_execution(second_id)
+        first = python_debugger.active_sessions[first_id]
+        self.assertIs(first.program, python_debugger.active_sessions[second_id].program)
+        
+        # Breakpoints work on the in-memory source, and tracebacks show its lines
+        python_debugger.set_breakpoint(first_id, 2)
+        self.assertEqual(python_debugger.run_to_completion(first_id)["current_line"], 2)
+        state = python_debugger.run_to_completion(second_id)
+        self.assertEqual(state["error"], "ZeroDivisionError: division by zero")
+        stderr = "".join(python_debugger.active_sessions[second_id].stderr_capture.read_lines(0)[1])
+        self.assertIn("return 10 / x", stderr)
+        
+        python_debugger.reset_session(first_id)
+        python_debugger.start_execution(first_id)
+        self.assertIs(python_debugger.active_sessions[first_id].program, first.program)
+        
+        state = python_debugger.start_execution(python_debugger.create_session("x = (")["id"])
+        self.assertTrue(state["is_finished"])
+        self.assertTrue(state["error"].startswith("SyntaxError"))
+    
+    def test_trace_file(self):
+        """Test exporting a recorded session and replaying the trace file."""
+        code = "def f(n):\n    return [n] * n\nitems = f(2)\nprint('done', len(items))"
+        session_id = python_debugger.create_session(code, record=True)["id"]
+        python_debugger.add_watch(session_id, "len(items) if 'items' in dir() else 0")
+        self.assertIn("error", python_debugger.export_trace(session_id, "unused"))
+        python_debugger.start_execution(session_id)
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "session.trace")
+            result = python_debugger.export_trace(session_id, path)
+            self.assertEqual(result["bytes"], os.path.getsize(path))
+            
+            loaded = python_debugger.load_trace(path)
+            self.assertEqual((loaded["step"], loaded["total_steps"]), (0, result["steps"]))
+            for step in range(result["steps"] + 1):
+                expected = python_debugger.jump_to(session_id, step)
+                state = python_debugger.jump_to(loaded["id"], step)
+                for key in ("current_line", "variables", "call_stack", "output", "watches", "is_finished"):
+                    self.assertEqual(state[key], expected[key], f"{key} differs at step {step}")
+            self.assertEqual(state["output"], ["done 2"])
+            python_debugger.delete_session(loaded["id"])
+            
+            with open(path, "r+b") as f:
+                f.write(b"NOTATRACE")
+            self.assertIn("error", python_debugger.load_trace(path))
+    
+    def test_replay_cache(self):
+        """Test replaying recordings of the same program from the cache."""
+        import threading
+        from unittest import mock
+        
+        code = "def f(n):\n    return n * 2\nprint(f(3))"
+        previous = python_debugger.replay_cache
+        with tempfile.TemporaryDirectory() as directory:
+            python_debugger.replay_cache = ReplayCache(directory, 1024 * 1024)
+            try:
+                first_id = python_debugger.create_session(code, record=True)["id"]
+                first = python_debugger.start_execution(first_id)
+                # Written in the background
+                for _ in range(100):
+                    if any(name.endswith(".trace") for name in os.listdir(directory)):
+                        break
+                    time.sleep(0.02)
+                
+                hits = python_debugger.REPLAY_CACHE_HITS.value
+                second_id = python_debugger.create_session(code, record=True)["id"]
+                second = python_debugger.start_execution(second_id)
+                self.assertEqual(python_debugger.REPLAY_CACHE_HITS.value, hits + 1)
+                self.assertEqual(second["total_steps"], first["total_steps"])
+                state = python_debugger.run_to_completion(second_id)
+                self.assertEqual(state["output"], ["6"])
+                self.assertEqual(python_debugger.get_call_tree(second_id)["total_calls"], 1)
+                
+                # Breakpoints are part of the key, randomness isn't cached
+                third_id = python_debugger.create_session(code, record=True)["id"]
+                python_debugger.set_breakpoint(third_id, 2, condition="n > 1")
+                python_debugger.start_execution(third_id)
+                random_id = python_debugger.create_session("import random\nx = random.random()", record=True)["id"]
+                python_debugger.start_execution(random_id)
+                self.assertEqual(python_debugger.REPLAY_CACHE_HITS.value, hits + 1)
+                
+                # Sessions closed before their recording is written are skipped
+                session = python_debugger.active_sessions[third_id]
+                session.stdout_capture.close()
+                errors = []
+                with mock.patch.object(threading, "excepthook", errors.append):
+                    before = set(threading.enumerate())
+                    session._cache_recording("closed")
+                    for thread in set(threading.enumerate()) - before:
+                        thread.join(5.0)
+                self.assertEqual(errors, [])
+                self.assertIsNone(python_debugger.replay_cache.get("closed"))
+                self.assertFalse([name for name in os.listdir(directory) if name.endswith(".tmp")])
+            finally:
+                python_debugger.replay_cache = previous
+        
+        self.assertFalse(is_cacheable("import numpy as np\nx = np.random.rand(3)"))
+        self.assertFalse(is_cacheable("print(id([]))"))
+        self.assertTrue(is_cacheable("from collections import deque\nq = deque([1])"))
+    
+    def test_replay_cache_eviction(self):
+        """Test deleting the least recently used recordings past the size limit."""
+        with tempfile.TemporaryDirectory() as directory:
+            def write(path):
+                with open(path, "wb") as f:
+                    f.write(b"x" * 100)
+            
+            cache = ReplayCache(directory, 250)
+            for index, key in enumerate(["a", "b"]):
+                cache.put(key, write)
+                os.utime(cache.get(key), (index, index))
+            self.assertIsNotNone(cache.get("a"))
+            cache.put("c", write)
+            self.assertIsNone(cache.get("b"))
+            self.assertIsNotNone(cache.get("a"))
+            self.assertIsNotNone(cache.get("c"))
+    
+    def test_debug_connection(self):
+        """Test driving a session with the messages of the debug WebSocket."""
+        import debug_connection
+        from debug_connection import DebugConnection
+        from unittest import mock
+        
+        connection = DebugConnection()
+        self.assertEqual(connection.handle({"command": "step"})["event"], "error")
+        
+        code = "for i in range(3):\n    print(i)\ndone = True"
+        answer = connection.handle({"command": "create", "code": code, "request_id": 1})
+        self.assertEqual((answer["event"], answer["request_id"]), ("state", 1))
+        session_id = answer["id"]
+        self.assertEqual(connection.handle({"command": "start"})["current_line"], 1)
+        
+        # Output printed while a command runs is pushed on its own
+        python_debugger.step_forward(session_id)
+        python_debugger.step_forward(session_id)
+        self.assertEqual(connection.output_event(),
+                         {"event": "output", "output": ["0"], "output_start": 0, "output_cursor": 1})
+        self.assertIsNone(connection.output_event())
+        
+        answer = connection.handle({"command": "set_breakpoint", "line_number": 3})
+        self.assertEqual((answer["event"], answer["command"], answer["breakpoints"]),
+                         ("result", "set_breakpoint", [3]))
+        answer = connection.handle({"command": "continue"})
+        # States after the first one are deltas
+        self.assertEqual((answer["event"], answer["delta"]), ("state", True))
+        self.assertEqual((answer["current_line"], answer["output"]), (3, ["0", "1", "2"]))
+        
+        self.assertEqual(connection.handle({"command": "state"})["not_modified"], True)
+        self.assertEqual(connection.handle({"command": "jump"})["event"], "error")
+        self.assertEqual(connection.handle({"command": "explode"})["event"], "error")
+
+        # Arguments of the wrong type and failing commands are answered with errors
+        answer = connection.handle({"command": "add_watch", "expression": 5, "request_id": 2})
+        self.assertEqual((answer["event"], answer["message"], answer["request_id"]),
+                         ("error", "Invalid expression: 5", 2))
+        self.assertEqual(connection.handle({"command": "get_variable", "path": ["i"]})["event"], "error")
+        self.assertEqual(connection.handle({"command": "step_n", "n": True})["event"], "error")
+        self.assertEqual(connection.handle({"command": "attach", "session_id": []})["event"], "error")
+
+        def explode(session_id):
+            raise ValueError("boom")
+
+        with mock.patch.dict(debug_connection.COMMANDS, {"get_repeated_calls": (explode, (), False)}):
+            answer = connection.handle({"command": "get_repeated_calls"})
+        self.assertEqual((answer["event"], answer["message"]), ("error", "ValueError: boom"))
+        self.assertEqual(connection.handle({"command": "get_frame_locals", "index": 0})["event"], "result")
+
+        connection.handle({"command": "close"})
+        self.assertNotIn(session_id, python_debugger.active_sessions)
+    
+    def test_metrics(self):
+        """Test the metrics of traced lines and request latencies."""
+        def metric(name):
+            for line in python_debugger.get_metrics().splitlines():
+                if line.startswith(name + " "):
+                    return float(line.split()[1])
+        
+        lines_seen = metric("debugger_lines_seen_total")
+        steps = metric("debugger_step_seconds_count")
+        session_id = python_debugger.create_session("total = 0\nfor i in range(100):\n    total += i")["id"]
+        python_debugger.start_execution(session_id)
+        result = python_debugger.step_forward(session_id)
+        # Nothing but the program's own output
+        self.assertEqual(result["output"], [])
+        # Lines run under a step budget are counted
+        python_debugger.run_to_completion(session_id, max_steps=50)
+        
+        self.assertGreaterEqual(metric("debugger_lines_seen_total") - lines_seen, 52)
+        self.assertEqual(metric("debugger_step_seconds_count") - steps, 1)
+        self.assertGreaterEqual(metric("debugger_sessions"), 1)
+        self.assertIn('debugger_tracer_seconds_bucket{le="+Inf"}', python_debugger.get_metrics())
+    
+    def test_output_buffer(self):
+        """Test output lines, incomplete ones and old lines leaving memory."""
+        from output_buffer import OutputBuffer
+        
+        buffer = OutputBuffer()
+        buffer.write("Enter:")
+        # An incomplete line is returned again until it ends
+        self.assertEqual(buffer.read_lines(0), (0, ["Enter:"], 0))
+        buffer.write(" 5\nnext")
+        self.assertEqual(buffer.read_lines(0), (0, ["Enter: 5", "next"], 1))
+        self.assertEqual(buffer.read_lines(0, end=(0, 3)), (0, ["Ent"], 0))
+        
+        buffer = OutputBuffer(max_lines=10, max_spill_bytes=60)
+        for i in range(100):
+            buffer.write(f"line {i}\n")
+        self.assertLessEqual(len(buffer.lines), 10)
+        self.assertEqual(buffer.position(), (100, 0))
+        
+        start, lines, cursor = buffer.read_lines(0)
+        self.assertEqual((start, lines), (0, [f"line {i}" for i in range(cursor)]))
+        self.assertGreater(cursor, 0)
+        # Lines dropped once the disk budget was spent are skipped
+        start, lines, cursor = buffer.read_lines(cursor)
+        self.assertEqual(start, buffer.first)
+        self.assertEqual((lines[-1], cursor), ("line 99", 100))
+        buffer.close()
+    
+    def test_variable_history_only_stores_changes(self):
+        """Test that variables are recorded once per change and can be rebuilt per step."""
+        code = "total = 0\nlimit = 3\nfor i in range(200):\n    total = min(total + i, limit)"
+        session_id = python_debugger.create_session(code, record=True)["id"]
+        
+        result = python_debugger.start_execution(session_id)
+        session = python_debugger.active_sessions[session_id]
+        self.assertGreater(result["total_steps"], 400)
+        
+        # One change per new value of total and i, not one entry per line
+        self.assertLess(len(session.history), 220)
+        
+        # Step 2 is the first loop header: total and limit are set, i isn't yet
+        view = {v["name"]: v["value"] for v in python_debugger.get_variables_at(session_id, 2)["variables"]}
+        self.assertEqual(view, {"total": "0", "limit": "3"})
+        
+        view = {v["name"]: v["value"] for v in python_debugger.get_variables_at(session_id, 7)["variables"]}
+        self.assertEqual(view, {"total": "1", "limit": "3", "i": "2"})
+        
+        # The live view only has one entry per variable
+        result = python_debugger.jump_to(session_id, result["total_steps"])
+        names = [v["name"] for v in result["variables"]]
+        self.assertEqual(sorted(names), ["i", "limit", "total"])
+        self.assertEqual({v["name"]: v["value"] for v in result["variables"]}["total"], "3")
+    
+    def test_get_variable_pages_large_containers(self):
+        """Test expanding containers and objects one page at a time."""
+        code = textwrap.dedent("""
+        class Node:
+            def __init__(self, value):
+                self.value = value
+                self.children = [value * 2]
+
+        big = list(range(100000))
+        table = {'a': [1, 2], 'b': Node(3)}
+        done = True
+        """)
+        session_id = python_debugger.create_session(code)["id"]
+        python_debugger.toggle_breakpoint(session_id, 9)
+        result = python_debugger.start_execution(session_id)
+        self.assertEqual(result["current_line"], 9)
+        
+        # The snapshot only holds a handle to the big list
+        big = next(v for v in result["variables"] if v["name"] == "big")
+        self.assertEqual(big["value"], "[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, ...]")
+        self.assertTrue(big["expandable"])
+        self.assertEqual(big["length"], 100000)
+        
+        page = python_debugger.get_variable(session_id, "big", offset=5000, limit=3)
+        self.assertEqual(page["length"], 100000)
+        self.assertEqual([item["value"] for item in page["items"]], ["5000", "5001", "5002"])
+        self.assertEqual(page["items"][0]["path"], "big[5000]")
+        
+        # Nested containers and object attributes
+        page = python_debugger.get_variable(session_id, "table")
+        self.assertEqual([item["key"] for item in page["items"]], ["'a'", "'b'"])
+        self.assertEqual(page["items"][1]["path"], "table['b']")
+        self.assertTrue(page["items"][1]["expandable"])
+        
+        page = python_debugger.get_variable(session_id, "table['b'].children")
+        self.assertEqual(page["items"][0]["value"], "6")
+        
+        page = python_debugger.get_variable(session_id, "table['b']")
+        self.assertEqual([item["key"] for item in page["items"]], ["value", "children"])
+        
+        # Invalid paths are rejected without evaluating anything
+        self.assertIn("error", python_debugger.get_variable(session_id, "missing"))
+        self.assertIn("error", python_debugger.get_variable(session_id, "big[len(big) - 1]"))
+        self.assertIn("error", python_debugger.get_variable(session_id, "done"))
+    
+    @tracing_backends
+    def test_incremental_call_stack(self, backend):
+        """Test the call stack kept from call and return events, including exception unwinding."""
+        code = textwrap.dedent("""
+        def down(n):
+            if n == 0:
+                raise ValueError("bottom")
+            return down(n - 1)
+
+        try:
+            down(3)
+        except ValueError:
+            caught = True
+        done = 1
+        """)
+        session_id = python_debugger.create_session(code)["id"]
+        python_debugger.toggle_breakpoint(session_id, 4)
+        python_debugger.toggle_breakpoint(session_id, 11)
+        
+        result = python_debugger.start_execution(session_id)
+        self.assertEqual(result["current_line"], 4)
+        stack = result["call_stack"]
+        self.assertEqual([frame["function"] for frame in stack], ["<module>"] + ["down"] * 4)
+        self.assertEqual([frame["line"] for frame in stack], [8, 5, 5, 5, 4])
+        self.assertEqual([frame["recursion_depth"] for frame in stack], [1, 1, 2, 3, 4])
+        self.assertEqual(result["recursive_functions"], ["down"])
+        
+        # Only the top frame is formatted eagerly
+        self.assertEqual(stack[-1]["locals"], {"n": "0"})
+        self.assertIsNone(stack[1]["locals"])
+        self.assertEqual(python_debugger.get_frame_locals(session_id, 1)["locals"], {"n": "3"})
+        
+        # Frames unwound by the exception are gone
+        result = python_debugger.run_to_completion(session_id)
+        self.assertEqual(result["current_line"], 11, f"Unexpected line with {backend}")
+        self.assertEqual([frame["function"] for frame in result["call_stack"]], ["<module>"])
+        self.assertEqual(result["recursive_functions"], [])
+    
+    def test_call_tree(self):
+        """Test the recursion tree recorded from a naive Fibonacci."""
+        code = textwrap.dedent("""
+        def fib(n):
+            if n < 2:
+                return n
+            return fib(n - 1) + fib(n - 2)
+
+        result = fib(6)
+        """)
+        session_id = python_debugger.create_session(code, record=True)["id"]
+        python_debugger.start_execution(session_id)
+        
+        tree = python_debugger.get_call_tree(session_id, max_depth=2)
+        self.assertEqual(tree["total_calls"], 25)
+        self.assertFalse(tree["truncated"])
+        
+        root = tree["calls"][0]
+        self.assertEqual(root["function"], "fib")
+        self.assertEqual(root["args"], "n=6")
+        self.assertEqual(root["return_value"], "8")
+        self.assertEqual(root["descendants"], 24)
+        self.assertEqual([child["args"] for child in root["children"]], ["n=5", "n=4"])
+        # Deeper levels are cut off until requested
+        self.assertIsNone(root["children"][0]["children"])
+        
+        subtree = python_debugger.get_call_tree(session_id, call_id=root["children"][1]["id"], max_depth=1)
+        self.assertEqual(subtree["calls"][0]["return_value"], "3")
+        self.assertEqual([child["args"] for child in subtree["calls"][0]["children"]], ["n=3", "n=2"])
+        
+        repeated = python_debugger.get_repeated_calls(session_id)["repeated_calls"]
+        counts = {call["args"]: call["count"] for call in repeated}
+        self.assertEqual(counts["n=1"], 8)
+        self.assertEqual(counts["n=2"], 5)
+        self.assertNotIn("n=6", counts)
+    
     def test_runtime_error_handling(self):
         """Test handling of runtime errors during execution."""
         # Code that will raise a runtime error
@@ -188,6 +1142,57 @@ print("This won't execute")
                       f"Expected division by zero error, got: {result['error']}")
         self.assertTrue(result["is_finished"], "Session should be marked as finished after error")
     
+    @tracing_backends
+    def test_execution_budgets(self, backend):
+        """Test that programs spending their line or CPU budget are aborted."""
+        endless_code = "i = 0\nwhile True:\n    i += 1"
+        session_id = python_debugger.create_session(endless_code, record=True)["id"]
+        python_debugger.active_sessions[session_id].MAX_LINES = 1000
+        self.assertEqual(python_debugger.start_execution(session_id)["total_steps"], 1000)
+        result = python_debugger.jump_to(session_id, 1000)
+        self.assertTrue(result["is_finished"])
+        self.assertEqual(result["error"], "Line limit of 1000 lines exceeded")
+        
+        # Lines run while continuing count too
+        session_id = python_debugger.create_session(endless_code)["id"]
+        python_debugger.active_sessions[session_id].MAX_LINES = 5000
+        python_debugger.start_execution(session_id)
+        result = python_debugger.run_to_completion(session_id, max_steps=10000)
+        self.assertTrue(result["is_finished"])
+        self.assertEqual(result["error"], "Line limit of 5000 lines exceeded")
+        
+        # The CPU budget spans runs, and the program's thread exits
+        session = python_debugger.active_sessions[python_debugger.create_session(endless_code)["id"]]
+        session.MAX_CPU_SECONDS = 0.3
+        python_debugger.start_execution(session.id)
+        result = python_debugger.run_to_completion(session.id, max_seconds=0.2)
+        self.assertEqual(result["stop_reason"], "time_limit")
+        result = python_debugger.run_to_completion(session.id, max_seconds=0.2)
+        self.assertTrue(result["is_finished"])
+        self.assertEqual(result["error"], "CPU time limit of 0.3 seconds exceeded")
+        session.execution_thread.join(1.0)
+        self.assertFalse(session.execution_thread.is_alive())
+        
+        # Loops running untraced are aborted on time too, whatever
+        # the wall time the client allows
+        session = python_debugger.active_sessions[python_debugger.create_session(endless_code)["id"]]
+        session.MAX_CPU_SECONDS = 0.5
+        python_debugger.start_execution(session.id)
+        start_time = time.time()
+        result = python_debugger.run_to_completion(session.id, max_seconds=8)
+        self.assertLess(time.time() - start_time, 2.0, f"CPU budget not enforced with {backend}")
+        self.assertEqual(result["error"], "CPU time limit of 0.5 seconds exceeded")
+        
+        # The wall time of a run is capped at RUN_TIMEOUT
+        session = python_debugger.active_sessions[python_debugger.create_session(endless_code)["id"]]
+        session.RUN_TIMEOUT = 0.3
+        python_debugger.start_execution(session.id)
+        start_time = time.time()
+        result = python_debugger.run_to_completion(session.id, max_seconds=1000)
+        self.assertLess(time.time() - start_time, 2.0)
+        self.assertEqual(result["stop_reason"], "time_limit")
+        python_debugger.delete_session(session.id)
+    
     def test_timeout_for_long_execution(self):
         """Test timeout mechanism for long-running or infinite loops."""
         # Code with a potentially infinite loop
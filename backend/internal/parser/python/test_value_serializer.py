@@ -0,0 +1,98 @@
+import collections
+import time
+import unittest
+from value_serializer import ValueSerializer
+
+class TestValueSerializer(unittest.TestCase):
+    """Test cases for the budgeted value serializer."""
+
+    def setUp(self):
+        """Set up test cases."""
+        self.serializer = ValueSerializer()
+
+    def test_scalars(self):
+        """Test that simple values keep their usual representation."""
+        self.assertEqual(self.serializer.serialize(42), "42")
+        self.assertEqual(self.serializer.serialize("test"), "'test'")
+        self.assertEqual(self.serializer.serialize(None), "None")
+        self.assertEqual(self.serializer.serialize([1, 2, 3]), "[1, 2, 3]")
+        self.assertEqual(self.serializer.serialize({'a': 1}), "{'a': 1}")
+
+    def test_budgets(self):
+        """Test that large and deeply nested values are truncated."""
+        self.assertEqual(
+            self.serializer.serialize(list(range(100000))),
+            "[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, ...]"
+        )
+        self.assertLessEqual(len(self.serializer.serialize("x" * 10**7)), 200)
+        self.assertEqual(self.serializer.serialize([[[[[1]]]]]), "[[[[...]]]]")
+        self.assertEqual(self.serializer.serialize(10**5000), "int with 16610 bits")
+
+        # Dicts keep their insertion order
+        self.assertEqual(
+            self.serializer.serialize({key: 0 for key in "zyxwvu"}),
+            "{'z': 0, 'y': 0, 'x': 0, 'w': 0, 'v': 0, ...}"
+        )
+
+        small = ValueSerializer(max_length=20)
+        self.assertEqual(len(small.serialize(list(range(10)))), 20)
+
+    def test_cycles_and_objects(self):
+        """Test cycle detection and rendering of custom class instances."""
+        class Node:
+            def __init__(self, value):
+                self.value = value
+                self.next = self
+
+        class Point:
+            def __repr__(self):
+                return "Point!"
+
+        items = [1, 2]
+        items.append(items)
+
+        self.assertEqual(self.serializer.serialize(items), "[1, 2, ...]")
+        self.assertEqual(self.serializer.serialize(Node(3)), "Node(value=3, next=...)")
+        self.assertEqual(self.serializer.serialize(Point()), "Point!")
+        self.assertEqual(self.serializer.serialize(object()), "object object")
+
+    def test_container_subclasses(self):
+        """Test that subclasses of built-in containers stay within the budgets."""
+        class Stack(list):
+            pass
+
+        size = 10**6
+        values = {
+            "defaultdict": collections.defaultdict(int, {i: i for i in range(size)}),
+            "Counter": collections.Counter(range(size)),
+            "OrderedDict": collections.OrderedDict((i, i) for i in range(size)),
+            "deque": collections.deque(range(size)),
+            "Stack": Stack(range(size)),
+        }
+        for name, value in values.items():
+            start_time = time.perf_counter()
+            text = self.serializer.serialize(value)
+            self.assertLess(time.perf_counter() - start_time, 0.05, f"{name} rendered every item")
+            self.assertTrue(text.startswith(f"{name}("), text)
+            self.assertLessEqual(len(text), 200)
+
+        self.assertEqual(self.serializer.serialize(Stack([1, 2])), "Stack([1, 2])")
+        self.assertEqual(self.serializer.serialize(collections.Counter("aab")), "Counter({'a': 2, 'b': 1})")
+        Point = collections.namedtuple("Point", "x y")
+        self.assertEqual(self.serializer.serialize(Point(1, [2] * 20)),
+                         "Point(x=1, y=[2, 2, 2, 2, 2, 2, 2, 2, 2, 2, ...])")
+
+    def test_memoized_within_step(self):
+        """Test that an object is only serialized once per step."""
+        values = [1, 2]
+        self.assertEqual(self.serializer.serialize(values), "[1, 2]")
+
+        values.append(3)
+        self.assertEqual(self.serializer.serialize(values), "[1, 2]")
+
+        self.serializer.new_step()
+        self.assertEqual(self.serializer.serialize(values), "[1, 2, 3]")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,569 @@
+import bisect
+import json
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import Any, Dict, List, Optional, Tuple
+
+from call_tree import INTERNED_SIZE, CallTreeRecorder
+from output_buffer import PAGE_LINES
+
+# File signature and version of the format written by write_trace
+MAGIC = b"PYDTRACE"
+FORMAT_VERSION = 2
+
+# Magic, format version, number of sections
+_HEADER = struct.Struct("<8sII")
+# Section name, offset and length in bytes
+_SECTION = struct.Struct("<8sQQ")
+# Length prefix of a blob
+_BLOB_LENGTH = struct.Struct("<I")
+
+# Section name -> array typecode. Sections are fixed-width little-endian
+# columns, except the string data and the blobs.
+_COLUMNS = {
+    # Intern table: names, types, functions, files and source lines
+    "str_offs": "Q", "str_data": "B",
+    # Source of the program, as string ids of its lines
+    "source": "I",
+    # One entry per step
+    "line": "i",
+    "stack": "I",          # Frame id + 1, 0 outside of any frame
+    "out_line": "I",       # Output position at the step
+    "out_char": "I",
+    "bp_hit": "B",
+    "watches": "Q",        # Blob offsets of the JSON watch values
+    "recursed": "Q",       # and recursive functions
+    # One entry per distinct stack frame
+    "f_func": "I", "f_file": "I", "f_depth": "I", "f_caller": "i",
+    "f_parent": "I",       # Frame id + 1, 0 for the outermost frames
+    # One entry per variable change, in step order
+    "c_step": "I", "c_name": "I", "c_type": "I", "c_line": "i",
+    "c_value": "Q",        # Blob offset of the value
+    "c_length": "q",       # -1 for scalars, -2 for objects of unknown length
+    # Changes grouped by variable: variable names, where each one's changes
+    # start, the change ids and their steps
+    "v_name": "I", "v_start": "I", "v_change": "I", "v_step": "I",
+    # Blob offsets of the output lines, the last one possibly incomplete
+    "out_offs": "Q",
+    # Columns of the CallTreeRecorder, its signatures (function string id,
+    # blob offset of the arguments, first call) and blob offsets of its
+    # return values
+    "ct_par": "i", "ct_sig": "i", "ct_ret": "i", "ct_start": "i", "ct_end": "i", "ct_subtr": "i",
+    "sg_func": "I", "sg_args": "Q", "sg_first": "I",
+    "cv_value": "Q",
+    # Length-prefixed values, output lines and JSON
+    "blobs": "B",
+}
+_SCALAR = -1
+_UNKNOWN_LENGTH = -2
+
+
+def _to_bytes(column: array) -> bytes:
+    if sys.byteorder != "little":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+class _Interner:
+    """Ids of distinct hashable items, in order of first appearance."""
+
+    def __init__(self):
+        self.ids: Dict[Any, int] = {}
+        self.items: List[Any] = []
+
+    def add(self, item: Any) -> int:
+        index = self.ids.get(item)
+        if index is None:
+            index = self.ids[item] = len(self.items)
+            self.items.append(item)
+        return index
+
+
+class _Blobs:
+    """Length-prefixed blobs, identical ones stored once."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets: Dict[str, int] = {}
+
+    def add(self, text: str) -> int:
+        offset = self.offsets.get(text)
+        if offset is None:
+            encoded = text.encode("utf-8", "surrogatepass")
+            offset = self.offsets[text] = len(self.data)
+            self.data += _BLOB_LENGTH.pack(len(encoded))
+            self.data += encoded
+        return offset
+
+
+def write_trace(path: str, session, call_tree: Optional[CallTreeRecorder] = None) -> int:
+    """
+    Write the recorded execution of a session to a trace file.
+
+    Names, types, functions, files and source lines are stored once in an
+    intern table, every step and variable change is a row of fixed-width
+    columns, and values are length-prefixed blobs, stored once each.
+
+    Args:
+        path: File to write
+        session: DebugSession whose recording ran
+        call_tree: Calls made by the recorded program
+
+    Returns:
+        Size of the file in bytes
+    """
+    strings = _Interner()
+    blobs = _Blobs()
+    columns = {name: array(typecode) for name, typecode in _COLUMNS.items()}
+
+    columns["source"].extend(strings.add(line) for line in session.code.splitlines(keepends=True))
+
+    # Frames and JSON values shared by consecutive steps are written once
+    frame_ids: Dict[int, int] = {}
+    json_offsets: Dict[int, int] = {}
+
+    def add_frame(entry) -> int:
+        if entry is None:
+            return 0
+        frame_id = frame_ids.get(id(entry))
+        if frame_id is None:
+            parent = add_frame(entry.parent)
+            frame_id = frame_ids[id(entry)] = len(columns["f_func"]) + 1
+            columns["f_func"].append(strings.add(entry.function))
+            columns["f_file"].append(strings.add(entry.file))
+            columns["f_depth"].append(entry.depth)
+            columns["f_caller"].append(entry.caller_line)
+            columns["f_parent"].append(parent)
+        return frame_id
+
+    def add_json(value: Any) -> int:
+        offset = json_offsets.get(id(value))
+        if offset is None:
+            offset = json_offsets[id(value)] = blobs.add(json.dumps(value))
+        return offset
+
+    for snapshot in session.trace:
+        columns["line"].append(snapshot["line"])
+        columns["stack"].append(add_frame(snapshot["stack_top"]))
+        out_line, out_char = snapshot["output_position"]
+        columns["out_line"].append(out_line)
+        columns["out_char"].append(out_char)
+        columns["bp_hit"].append(snapshot["breakpoint_hit"])
+        columns["watches"].append(add_json(snapshot["watch_values"]))
+        columns["recursed"].append(add_json(snapshot["recursive_functions"]))
+
+    history = session.history
+    variables = _Interner()
+    # Position of the next entry of each variable in its change list
+    seen: Dict[str, int] = {}
+    by_variable: List[List[int]] = []
+    for change_id, (step, name) in enumerate(history.changes):
+        entry = history.change_entries[name][seen.get(name, 0)]
+        seen[name] = seen.get(name, 0) + 1
+        length = entry.get("length", _UNKNOWN_LENGTH) if entry.get("expandable") else _SCALAR
+        columns["c_step"].append(step)
+        columns["c_name"].append(strings.add(name))
+        columns["c_type"].append(strings.add(entry["type"]))
+        columns["c_line"].append(entry["line"])
+        columns["c_value"].append(blobs.add(entry["value"]))
+        columns["c_length"].append(_UNKNOWN_LENGTH if length is None else length)
+
+        variable = variables.add(name)
+        if variable == len(by_variable):
+            by_variable.append([])
+        by_variable[variable].append(change_id)
+
+    for name, change_ids in zip(variables.items, by_variable):
+        columns["v_name"].append(strings.add(name))
+        columns["v_start"].append(len(columns["v_change"]))
+        columns["v_change"].extend(change_ids)
+        columns["v_step"].extend(columns["c_step"][change_id] for change_id in change_ids)
+    columns["v_start"].append(len(columns["v_change"]))
+
+    # The output lines kept by the session, with the range of dropped ones
+    output = session.stdout_capture
+    end = output.position()
+    dropped = None
+    since = 0
+    while True:
+        start, lines, since = output.read_lines(since, end)
+        if start > len(columns["out_offs"]) and dropped is None:
+            dropped = (len(columns["out_offs"]), start)
+        columns["out_offs"].extend(blobs.add(line) for line in lines)
+        if since >= end[0]:
+            break
+
+    if call_tree is not None:
+        for name, column in (("ct_par", call_tree.parent), ("ct_sig", call_tree.signature),
+                             ("ct_ret", call_tree.return_value), ("ct_start", call_tree.start_step),
+                             ("ct_end", call_tree.end_step), ("ct_subtr", call_tree.subtree_end)):
+            columns[name] = column
+        for (function, args), first_call in zip(call_tree.signatures, call_tree.first_calls):
+            columns["sg_func"].append(strings.add(function))
+            columns["sg_args"].append(blobs.add(args))
+            columns["sg_first"].append(first_call)
+        columns["cv_value"].extend(blobs.add(value) for value in call_tree.values)
+
+    offset = 0
+    for text in strings.items:
+        columns["str_offs"].append(offset)
+        encoded = text.encode("utf-8", "surrogatepass")
+        columns["str_data"].frombytes(encoded)
+        offset += len(encoded)
+    columns["str_offs"].append(offset)
+    columns["blobs"] = blobs.data
+
+    meta = json.dumps({
+        "test_case": session.test_case,
+        "error": session.recorded_error,
+        "final_watch_values": session.final_watch_values,
+        "watches": list(session.watches.expressions),
+        "breakpoints": [breakpoint.to_dict() for breakpoint in session.breakpoints.values()],
+        "logs": session.logs,
+        "output_end": end,
+        "output_dropped": dropped,
+        "calls_truncated": call_tree is not None and call_tree.truncated
+    }).encode("utf-8")
+
+    sections = [(name, _to_bytes(column) if isinstance(column, array) else bytes(column))
+                for name, column in columns.items()]
+    sections.append(("meta", meta))
+
+    with open(path, "wb") as f:
+        offset = _HEADER.size + _SECTION.size * len(sections)
+        table = []
+        for name, data in sections:
+            # Keep every column aligned to its item size
+            offset += -offset % 8
+            table.append((name, offset, data))
+            offset += len(data)
+
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+        for name, offset, data in table:
+            f.write(_SECTION.pack(name.encode("ascii"), offset, len(data)))
+        for name, offset, data in table:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(data)
+        return f.tell()
+
+
+class TraceFrame:
+    """Frame of a loaded trace, standing in for a StackEntry."""
+
+    __slots__ = ("function", "file", "depth", "caller_line", "parent", "frame", "in_call_tree")
+
+    def __init__(self, function: str, file: str, depth: int, caller_line: int,
+                 parent: Optional['TraceFrame']):
+        self.function = function
+        self.file = file
+        self.depth = depth
+        self.caller_line = caller_line
+        self.parent = parent
+        self.frame = None
+        self.in_call_tree = False
+
+
+class TraceReader:
+    """
+    Memory-mapped trace file written by write_trace.
+
+    Opening a trace only reads its header and intern table. Steps, variable
+    changes and output lines are read from the mapped columns when asked
+    for, so seeking to any step of a long trace costs a few lookups and the
+    operating system keeps only the pages in use in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"{path} is not a trace file")
+        self._buffer = memoryview(self._mmap)
+        try:
+            self._load(path)
+        except Exception:
+            self.close()
+            raise
+
+        self.steps = TraceSteps(self)
+        self.history = TraceHistory(self)
+        self.output = TraceOutput(self)
+
+    def _load(self, path: str) -> None:
+        if len(self._buffer) < _HEADER.size:
+            raise ValueError(f"{path} is not a trace file")
+        magic, version, count = _HEADER.unpack_from(self._buffer)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported trace format version {version}")
+
+        self._views: List[memoryview] = []
+        sections = {}
+        for index in range(count):
+            name, offset, length = _SECTION.unpack_from(self._buffer, _HEADER.size + index * _SECTION.size)
+            if offset + length > len(self._buffer):
+                raise ValueError(f"{path} is truncated")
+            sections[name.rstrip(b"\0").decode("ascii")] = (offset, length)
+
+        if any(name not in sections for name in (*_COLUMNS, "meta")):
+            raise ValueError(f"{path} is missing sections")
+
+        self.columns: Dict[str, Sequence] = {}
+        for name, typecode in _COLUMNS.items():
+            offset, length = sections[name]
+            view = self._buffer[offset:offset + length]
+            self._views.append(view)
+            if typecode == "B":
+                self.columns[name] = view
+            elif sys.byteorder == "little":
+                column = view.cast(typecode)
+                self._views.append(column)
+                self.columns[name] = column
+            else:
+                column = array(typecode, view.tobytes())
+                column.byteswap()
+                self.columns[name] = column
+
+        offset, length = sections["meta"]
+        meta = json.loads(bytes(self._buffer[offset:offset + length]))
+        self.test_case: Optional[str] = meta["test_case"]
+        self.error: Optional[str] = meta["error"]
+        self.final_watch_values: List[Dict] = meta["final_watch_values"]
+        self.watches: List[str] = meta["watches"]
+        self.breakpoints: List[Dict] = meta["breakpoints"]
+        self.logs: List[Tuple[int, str]] = [tuple(log) for log in meta["logs"]]
+        self.output_end: Tuple[int, int] = tuple(meta["output_end"])
+        self.output_dropped: Optional[Tuple[int, int]] = meta["output_dropped"] and tuple(meta["output_dropped"])
+        self.calls_truncated: bool = meta["calls_truncated"]
+
+        self._strings: Dict[int, str] = {}
+        self._frames: Dict[int, TraceFrame] = {}
+        self.code = "".join(self.string(string_id) for string_id in self.columns["source"])
+
+    def __len__(self) -> int:
+        return len(self.columns["line"])
+
+    def string(self, string_id: int) -> str:
+        """Entry of the intern table."""
+        text = self._strings.get(string_id)
+        if text is None:
+            offsets = self.columns["str_offs"]
+            data = self.columns["str_data"][offsets[string_id]:offsets[string_id + 1]]
+            text = self._strings[string_id] = bytes(data).decode("utf-8", "surrogatepass")
+        return text
+
+    def blob(self, offset: int) -> str:
+        """Length-prefixed blob at an offset of the blob section."""
+        blobs = self.columns["blobs"]
+        length = _BLOB_LENGTH.unpack_from(blobs, offset)[0]
+        start = offset + _BLOB_LENGTH.size
+        return bytes(blobs[start:start + length]).decode("utf-8", "surrogatepass")
+
+    def frame(self, frame_id: int) -> Optional[TraceFrame]:
+        """Frame by id + 1, built once along with its callers."""
+        if frame_id == 0:
+            return None
+        frame = self._frames.get(frame_id)
+        if frame is None:
+            index = frame_id - 1
+            columns = self.columns
+            frame = self._frames[frame_id] = TraceFrame(
+                self.string(columns["f_func"][index]), self.string(columns["f_file"][index]),
+                columns["f_depth"][index], columns["f_caller"][index],
+                self.frame(columns["f_parent"][index])
+            )
+        return frame
+
+    def call_tree(self) -> CallTreeRecorder:
+        """
+        Rebuild the call tree of the recorded program.
+
+        Unlike the steps, it is loaded in memory at once, taking about as
+        much as it did while recording.
+        """
+        columns = self.columns
+        call_tree = CallTreeRecorder()
+        for name, column in (("ct_par", call_tree.parent), ("ct_sig", call_tree.signature),
+                             ("ct_ret", call_tree.return_value), ("ct_start", call_tree.start_step),
+                             ("ct_end", call_tree.end_step), ("ct_subtr", call_tree.subtree_end)):
+            column.extend(columns[name])
+        for function, args, first_call in zip(columns["sg_func"], columns["sg_args"], columns["sg_first"]):
+            signature = (self.string(function), self.blob(args))
+            call_tree.signature_ids[signature] = len(call_tree.signatures)
+            call_tree.signatures.append(signature)
+            call_tree.first_calls.append(first_call)
+            call_tree.interned_size += INTERNED_SIZE + len(signature[0]) + len(signature[1])
+        for offset in columns["cv_value"]:
+            value = self.blob(offset)
+            call_tree.value_ids[value] = len(call_tree.values)
+            call_tree.values.append(value)
+            call_tree.interned_size += INTERNED_SIZE + len(value)
+        call_tree.truncated = self.calls_truncated
+        return call_tree
+
+    def close(self) -> None:
+        """Unmap the file. Views on it must be released first."""
+        for view in reversed(getattr(self, "_views", [])):
+            view.release()
+        self._views = []
+        self.columns = {}
+        self._buffer.release()
+        self._mmap.close()
+
+
+class TraceSteps(Sequence):
+    """The steps of a trace, as the snapshots a recording session keeps."""
+
+    def __init__(self, reader: TraceReader):
+        self.reader = reader
+        # Blob offset -> decoded JSON, shared between the steps using it
+        self._json: Dict[int, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.reader)
+
+    def _load_json(self, offset: int) -> Any:
+        value = self._json.get(offset)
+        if value is None:
+            value = self._json[offset] = json.loads(self.reader.blob(offset))
+        return value
+
+    def __getitem__(self, step: int) -> Dict:
+        if isinstance(step, slice):
+            return [self[index] for index in range(*step.indices(len(self)))]
+        if step < 0:
+            step += len(self)
+        if not 0 <= step < len(self):
+            raise IndexError("step out of range")
+        columns = self.reader.columns
+        return {
+            "line": columns["line"][step],
+            "stack_top": self.reader.frame(columns["stack"][step]),
+            "recursive_functions": self._load_json(columns["recursed"][step]),
+            "output_position": (columns["out_line"][step], columns["out_char"][step]),
+            "breakpoint_hit": bool(columns["bp_hit"][step]),
+            "watch_values": self._load_json(columns["watches"][step])
+        }
+
+    def memory_footprint(self) -> int:
+        """Approximate bytes held in memory, the columns stay on disk."""
+        return len(self.reader._frames) * 200 + len(self._json) * 200
+
+
+class TraceHistory:
+    """The variable changes of a trace, read like a VariableHistory."""
+
+    def __init__(self, reader: TraceReader):
+        self.reader = reader
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.reader.columns["c_step"])
+
+    def memory_footprint(self) -> int:
+        return 0
+
+    def _entry(self, change_id: int) -> Dict:
+        reader, columns = self.reader, self.reader.columns
+        name = reader.string(columns["c_name"][change_id])
+        entry = {
+            "name": name,
+            "value": reader.blob(columns["c_value"][change_id]),
+            "type": reader.string(columns["c_type"][change_id]),
+            "line": columns["c_line"][change_id]
+        }
+        length = columns["c_length"][change_id]
+        if length != _SCALAR:
+            entry.update(expandable=True, length=None if length == _UNKNOWN_LENGTH else length, path=name)
+        return entry
+
+    def _last_change(self, variable: int, step: Optional[int]) -> Optional[int]:
+        """Id of the last change of a variable up to a step, None if it had none."""
+        columns = self.reader.columns
+        start, stop = columns["v_start"][variable], columns["v_start"][variable + 1]
+        if step is not None:
+            stop = bisect.bisect_right(columns["v_step"], step, start, stop)
+        return columns["v_change"][stop - 1] if stop > start else None
+
+    def _view(self, step: Optional[int]) -> List[Dict]:
+        view = []
+        for variable in range(len(self.reader.columns["v_name"])):
+            change_id = self._last_change(variable, step)
+            if change_id is not None:
+                view.append(self._entry(change_id))
+        return view
+
+    def view(self) -> List[Dict]:
+        """Return the last entry of every variable."""
+        return self._view(None)
+
+    def view_at(self, step: int) -> List[Dict]:
+        """Return the entry of every variable as it was at the given step."""
+        return self._view(step)
+
+    def changes_between(self, first: int, last: int) -> Dict[int, List[Dict]]:
+        """Return the entries of the variables that changed at each step from first to last."""
+        steps = self.reader.columns["c_step"]
+        names = self.reader.columns["c_name"]
+        changes: Dict[int, Dict[int, int]] = {}
+        for change_id in range(bisect.bisect_left(steps, first), bisect.bisect_right(steps, last)):
+            # A later change of the same variable at the same step wins
+            changes.setdefault(steps[change_id], {})[names[change_id]] = change_id
+        return {step: [self._entry(change_id) for change_id in change_ids.values()]
+                for step, change_ids in changes.items()}
+
+
+class TraceOutput:
+    """The program output of a trace, read like an OutputBuffer."""
+
+    def __init__(self, reader: TraceReader):
+        self.reader = reader
+
+    def position(self) -> Tuple[int, int]:
+        """Number of complete lines and length of the incomplete last line."""
+        return self.reader.output_end
+
+    def _line(self, number: int) -> Optional[str]:
+        """A line, None if it was dropped before the trace was written."""
+        dropped = self.reader.output_dropped
+        if dropped is not None and number >= dropped[0]:
+            if number < dropped[1]:
+                return None
+            number -= dropped[1] - dropped[0]
+        offsets = self.reader.columns["out_offs"]
+        return self.reader.blob(offsets[number]) if number < len(offsets) else ""
+
+    def read_lines(self, since: Optional[int] = None, end: Optional[Tuple[int, int]] = None,
+                   limit: int = PAGE_LINES) -> Tuple[int, List[str], int]:
+        """Read lines of output, see OutputBuffer.read_lines."""
+        end_lines, end_chars = end or self.reader.output_end
+        if since is None:
+            since = end_lines - limit
+        start = min(max(since, 0), end_lines)
+        dropped = self.reader.output_dropped
+        if dropped is not None and dropped[0] <= start < dropped[1]:
+            start = min(dropped[1], end_lines)
+        stop = min(end_lines, start + limit)
+        if dropped is not None and start < dropped[0]:
+            # Dropped lines end the read, the next one skips them
+            stop = min(stop, dropped[0])
+
+        lines = [self._line(number) for number in range(start, stop)]
+        if stop == end_lines and end_chars:
+            partial = self._line(end_lines)
+            if partial is not None:
+                lines.append(partial[:end_chars])
+        return start, lines, stop
+
+    def memory_footprint(self) -> int:
+        return 0
+
+    def close(self) -> None:
+        self.reader.close()
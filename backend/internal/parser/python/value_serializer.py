@@ -0,0 +1,185 @@
+import builtins
+import collections
+import reprlib
+from typing import Any, Dict, Tuple
+
+# Default budgets for a single serialized value
+MAX_LENGTH = 200      # Characters in the whole representation
+MAX_DEPTH = 3         # Nesting levels rendered before falling back to "..."
+MAX_ITEMS = 10        # Items shown per list, tuple, set or deque
+MAX_DICT_ITEMS = 5    # Items shown per dict
+MAX_ATTRIBUTES = 6    # Attributes shown per custom class instance
+MAX_STRING = 80       # Characters shown per string
+
+# Built-in containers whose subclasses (defaultdict, Counter, OrderedDict,
+# class Stack(list), ...) are rendered within the budgets under their own
+# class name, instead of by their __repr__ which renders every item
+_CONTAINER_REPRS = (
+    (dict, "repr_dict"), (list, "repr_list"), (tuple, "repr_tuple"),
+    (set, "repr_set"), (frozenset, "repr_frozenset"), (collections.deque, "_repr_deque_items")
+)
+
+
+class ValueSerializer(reprlib.Repr):
+    """
+    Budgeted representation of the user's values.
+
+    Every variable capture path of the debugger goes through serialize():
+    large containers and strings are truncated reprlib-style, nesting is
+    cut off after MAX_DEPTH levels, cycles render as "...", and instances of
+    classes without their own __repr__ are shown with their attributes.
+
+    Results are memoized by object id until new_step() is called, so an
+    object reachable from several frames is only serialized once per step.
+    """
+
+    def __init__(self, max_length: int = MAX_LENGTH, max_depth: int = MAX_DEPTH,
+                 max_items: int = MAX_ITEMS, max_dict_items: int = MAX_DICT_ITEMS,
+                 max_attributes: int = MAX_ATTRIBUTES, max_string: int = MAX_STRING):
+        super().__init__()
+        self.max_length = max_length
+        self.max_attributes = max_attributes
+        self.maxlevel = max_depth
+        self.maxtuple = self.maxlist = self.maxarray = max_items
+        self.maxset = self.maxfrozenset = self.maxdeque = max_items
+        self.maxdict = max_dict_items
+        self.maxstring = max_string
+        self.maxlong = max_string
+        self.maxother = max_length
+
+        # id -> (object, representation) for the current step. The object is
+        # kept so that its id can't be reused by another object meanwhile.
+        self._memo: Dict[int, Tuple[Any, str]] = {}
+        # ids of the containers being rendered, for cycle detection
+        self._rendering = set()
+
+    def new_step(self) -> None:
+        """Forget memoized representations, values may have changed since."""
+        self._memo.clear()
+
+    def serialize(self, value: Any) -> str:
+        """
+        Get the budgeted representation of a value.
+
+        Args:
+            value: Any object from the user's program
+
+        Returns:
+            A representation of at most max_length characters
+        """
+        cached = self._memo.get(id(value))
+        if cached is not None and cached[0] is value:
+            return cached[1]
+
+        try:
+            text = self.repr(value)
+        except Exception:
+            text = "Error getting value"
+        finally:
+            self._rendering.clear()
+
+        if len(text) > self.max_length:
+            text = text[:self.max_length - 3] + "..."
+
+        self._memo[id(value)] = (value, text)
+        return text
+
+    def repr1(self, x, level):
+        if id(x) in self._rendering:
+            # Cycle: the object is already being rendered further up
+            return "..."
+
+        self._rendering.add(id(x))
+        try:
+            return super().repr1(x, level)
+        finally:
+            self._rendering.discard(id(x))
+
+    # reprlib sorts dicts and sets first, which costs O(n log n) on large
+    # containers. Show them in iteration order instead.
+
+    def repr_dict(self, x, level):
+        n = len(x)
+        if n == 0:
+            return '{}'
+        if level <= 0:
+            return '{...}'
+        pieces = []
+        for index, (key, value) in enumerate(x.items()):
+            if index >= self.maxdict:
+                pieces.append('...')
+                break
+            pieces.append(f"{self.repr1(key, level - 1)}: {self.repr1(value, level - 1)}")
+        return '{%s}' % ', '.join(pieces)
+
+    def repr_set(self, x, level):
+        if not x:
+            return 'set()'
+        return self._repr_iterable(x, level, '{', '}', self.maxset)
+
+    def repr_frozenset(self, x, level):
+        if not x:
+            return 'frozenset()'
+        return self._repr_iterable(x, level, 'frozenset({', '})', self.maxfrozenset)
+
+    def repr_int(self, x, level):
+        if x.bit_length() > 1024:
+            # Converting huge ints to decimal is quadratic (and limited by
+            # sys.set_int_max_str_digits), only show their size
+            return f"int with {x.bit_length()} bits"
+        return super().repr_int(x, level)
+
+    def repr_bytes(self, x, level):
+        text = builtins.repr(x[:self.maxstring])
+        if len(x) > self.maxstring:
+            text = text[:-1] + "..." + text[-1]
+        return text
+
+    def _repr_deque_items(self, x, level):
+        return self._repr_iterable(x, level, '[', ']', self.maxdeque)
+
+    def _repr_namedtuple(self, x, level):
+        if level <= 0:
+            return f"{type(x).__name__}(...)"
+        pieces = []
+        for index, (name, value) in enumerate(zip(x._fields, x)):
+            if index >= self.max_attributes:
+                pieces.append('...')
+                break
+            pieces.append(f"{name}={self.repr1(value, level - 1)}")
+        return f"{type(x).__name__}({', '.join(pieces)})"
+
+    def repr_instance(self, x, level):
+        cls = type(x)
+        if isinstance(x, tuple) and hasattr(cls, '_fields'):
+            return self._repr_namedtuple(x, level)
+        for base, method in _CONTAINER_REPRS:
+            if isinstance(x, base):
+                return f"{cls.__name__}({getattr(self, method)(x, level)})"
+
+        if cls.__repr__ is not object.__repr__:
+            # The class knows how to show itself
+            try:
+                text = builtins.repr(x)
+            except Exception:
+                return f"{cls.__name__} object"
+            if len(text) > self.maxother:
+                text = text[:self.maxother - 3] + "..."
+            return text
+
+        attributes = dict(getattr(x, '__dict__', None) or {})
+        for slot in getattr(cls, '__slots__', ()):
+            if isinstance(slot, str) and hasattr(x, slot):
+                attributes[slot] = getattr(x, slot)
+        if not attributes:
+            return f"{cls.__name__} object"
+        if level <= 0:
+            return f"{cls.__name__}(...)"
+
+        pieces = []
+        for index, (name, value) in enumerate(attributes.items()):
+            if index >= self.max_attributes:
+                pieces.append('...')
+                break
+            pieces.append(f"{name}={self.repr1(value, level - 1)}")
+        return f"{cls.__name__}({', '.join(pieces)})"
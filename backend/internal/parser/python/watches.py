@@ -0,0 +1,97 @@
+import time
+from types import CodeType
+from typing import Any, Callable, Dict, List
+
+from expressions import bounded_eval
+
+# Seconds all the watches of a session may take at one stop
+WATCH_BUDGET = 0.05
+
+
+class WatchList:
+    """
+    Watch expressions of a debug session, e.g. "arr[i] > arr[j]" or "len(stack)".
+
+    Expressions are compiled once, when they are added, and evaluated against
+    the paused frame at every stop, with bounded_eval. Once the time budget
+    of a stop is spent the watch being evaluated is aborted and the
+    remaining ones are skipped, and a watch that runs out of time with most
+    of the budget to itself is disabled, so watches can't slow stepping down
+    much.
+    """
+
+    def __init__(self, budget: float = WATCH_BUDGET):
+        self.budget = budget
+        self.expressions: List[str] = []
+        self.codes: Dict[str, CodeType] = {}
+        # Expression -> why it is no longer evaluated
+        self.disabled: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.expressions)
+
+    def add(self, expression: str) -> None:
+        """
+        Add a watch expression, if it isn't watched yet.
+
+        Raises:
+            SyntaxError: If the expression is invalid
+        """
+        expression = expression.strip()
+        if expression in self.codes:
+            return
+        self.codes[expression] = compile(expression, "<watch>", "eval")
+        self.expressions.append(expression)
+
+    def remove(self, expression: str) -> bool:
+        """
+        Stop watching an expression.
+
+        Returns:
+            True if removed, False if it wasn't watched
+        """
+        expression = expression.strip()
+        if expression not in self.codes:
+            return False
+        del self.codes[expression]
+        self.disabled.pop(expression, None)
+        self.expressions.remove(expression)
+        return True
+
+    def evaluate(self, frame_globals: Dict, frame_locals: Dict,
+                 format_value: Callable[[Any], str]) -> List[Dict]:
+        """
+        Evaluate every watch in a frame.
+
+        Args:
+            format_value: Turns a value into the string shown to the user
+
+        Returns:
+            One {"expression", "value", "type", "error"} entry per watch
+        """
+        results = []
+        deadline = time.perf_counter() + self.budget
+        for expression in self.expressions:
+            result = {"expression": expression, "value": None, "type": None, "error": None}
+            results.append(result)
+
+            if expression in self.disabled:
+                result["error"] = self.disabled[expression]
+                continue
+            start = time.perf_counter()
+            if start > deadline:
+                result["error"] = "Skipped, the watches ran out of time"
+                continue
+
+            try:
+                value = bounded_eval(self.codes[expression], frame_globals, frame_locals, deadline)
+                result["value"] = format_value(value)
+                result["type"] = type(value).__name__
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+
+            end = time.perf_counter()
+            # Ran out of time with most of the budget to itself
+            if end - start > self.budget or (end > deadline and deadline - start > self.budget / 2):
+                self.disabled[expression] = f"Disabled, took longer than {self.budget * 1000:.0f} ms"
+        return results
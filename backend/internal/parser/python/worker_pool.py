@@ -0,0 +1,415 @@
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional
+
+from state_versions import StateVersions
+
+# Seconds to wait for a worker to answer, above the sessions' own timeouts
+REQUEST_TIMEOUT = 30.0
+
+# Threads serving requests inside each worker, i.e. requests to the sessions
+# of one worker that can be in progress at the same time
+WORKER_THREADS = 32
+
+# Modules the fork server imports once, before forking session workers
+PRELOAD_MODULES = [
+    "python_debugger", "bisect", "collections", "functools", "heapq",
+    "itertools", "json", "math", "random", "re", "string"
+]
+
+
+# Bytes this process may grow by, set in workers with a memory budget
+_memory_limit = 0
+
+
+class WorkerError(Exception):
+    """Raised when a worker process exited or didn't answer a request."""
+
+
+def memory_limit() -> int:
+    """Bytes the current process may grow by, 0 if it has no memory budget."""
+    return _memory_limit
+
+
+def _limit_memory(max_bytes: int) -> None:
+    """
+    Let the data segment of the current process grow by at most max_bytes,
+    so that allocations past it raise MemoryError. Only done on Linux,
+    where RLIMIT_DATA covers memory mapped by malloc too.
+    """
+    global _memory_limit
+    try:
+        import resource
+        with open("/proc/self/status") as status:
+            used = next(int(line.split()[1]) * 1024 for line in status if line.startswith("VmData:"))
+    except (ImportError, OSError, StopIteration):
+        return
+
+    soft = used + max_bytes
+    _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_DATA, (soft, hard))
+    _memory_limit = max_bytes
+
+
+def _worker_main(connection, max_memory: int = 0) -> None:
+    """
+    Serve the requests of the parent process until the pipe is closed.
+
+    Requests are (request_id, session_id, method, args, kwargs) tuples
+    calling a public method of a DebugSession living in this process, or
+    "create" to make a new one, "metrics" to get the metrics of the
+    process or "judge" to run a test case, see judge.run_case. Every
+    request gets a (request_id, ok, result) response, where result is the
+    error message when ok is False. With max_memory, the process can only
+    grow by that many bytes.
+    """
+    # Imported here so that python_debugger can import this module
+    from python_debugger import DebugSession, metrics
+    from judge import run_case
+
+    if max_memory:
+        _limit_memory(max_memory)
+
+    sessions: Dict[str, DebugSession] = {}
+    send_lock = threading.Lock()
+
+    def handle(request_id: int, session_id: str, method: str, args: tuple, kwargs: dict) -> None:
+        try:
+            if method == "create":
+                session = DebugSession(*args, **kwargs)
+                session.id = session_id
+                sessions[session_id] = session
+                result = session.get_state()
+            elif method == "metrics":
+                result = metrics.snapshot()
+            elif method == "judge":
+                result = run_case(*args, **kwargs)
+            elif method.startswith("_"):
+                raise AttributeError(f"Can't call {method} on a session")
+            else:
+                session = sessions.get(session_id)
+                if session is None:
+                    raise KeyError("Session not found")
+                result = getattr(session, method)(*args, **kwargs)
+                if method == "reset":
+                    # The session was replaced by a fresh one
+                    sessions[session_id] = result
+                    result = None
+                elif method in ("close", "terminate"):
+                    sessions.pop(session_id, None)
+            response = (request_id, True, result)
+        except Exception as e:
+            response = (request_id, False, f"{type(e).__name__}: {e}")
+
+        with send_lock:
+            connection.send(response)
+
+    # Sessions block while waiting for their program to stop, so requests are
+    # served concurrently
+    executor = ThreadPoolExecutor(max_workers=WORKER_THREADS)
+    while True:
+        try:
+            request = connection.recv()
+        except (EOFError, OSError):
+            break
+        executor.submit(handle, *request)
+
+
+class Worker:
+    """
+    Parent side of a worker process hosting debug sessions.
+
+    Requests are sent over a pipe and matched with their responses by id,
+    so several threads of the server can talk to the same worker at once.
+    """
+
+    def __init__(self, context, max_memory: int = 0):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_connection, max_memory),
+                                       daemon=True)
+        self.process.start()
+        child_connection.close()
+
+        # Ids of the sessions hosted by the worker
+        self.sessions = set()
+        self.alive = True
+        self._request_ids = itertools.count()
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+
+        self._reader = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader.start()
+
+    def request(self, session_id: str, method: str, args: tuple = (), kwargs: Optional[dict] = None,
+                timeout: float = REQUEST_TIMEOUT) -> Any:
+        """
+        Call a method of a session hosted by the worker.
+
+        Raises:
+            WorkerError: If the worker exited, didn't answer in time or the
+                call raised an exception
+        """
+        future = Future()
+        with self._lock:
+            if not self.alive:
+                raise WorkerError("Session worker exited")
+            request_id = next(self._request_ids)
+            self._pending[request_id] = future
+            try:
+                self.connection.send((request_id, session_id, method, args, kwargs or {}))
+            except (OSError, ValueError):
+                del self._pending[request_id]
+                raise WorkerError("Session worker exited")
+
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise WorkerError("Timeout waiting for session worker")
+
+    def _read_responses(self) -> None:
+        while True:
+            try:
+                request_id, ok, result = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(WorkerError(result))
+
+        # The worker exited: fail whoever is still waiting for it
+        with self._lock:
+            self.alive = False
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(WorkerError("Session worker exited"))
+
+    def kill(self) -> None:
+        """Kill the worker process and every session it hosts."""
+        with self._lock:
+            self.alive = False
+        self.process.kill()
+        self.process.join()
+        # The reader sees the end of the pipe now. Closing the pipe while it
+        # may still be reading would let it read from whatever pipe of a
+        # new worker reuses the file descriptor.
+        self._reader.join(REQUEST_TIMEOUT)
+        if not self._reader.is_alive():
+            self.connection.close()
+
+
+class RemoteSession:
+    """
+    Stand-in for a DebugSession hosted by a worker process.
+
+    Any public method of DebugSession can be called on it and is run in the
+    worker. Failures of the worker are returned as {"error": ...} like the
+    other errors of the session functions.
+    """
+
+    def __init__(self, session_id: str, worker: Worker, pool: 'WorkerPool'):
+        self.id = session_id
+        self.worker = worker
+        self.pool = pool
+        # Kept here, deltas are computed in the server process
+        self.versions = StateVersions()
+
+    def _call(self, method: str, *args, **kwargs) -> Any:
+        try:
+            return self.worker.request(self.id, method, args, kwargs)
+        except WorkerError as e:
+            return {"error": str(e)}
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+
+    def reset(self) -> 'RemoteSession':
+        self._call("reset")
+        return self
+
+    def close(self) -> None:
+        self._call("close")
+        self.pool.release(self)
+
+    def terminate(self) -> None:
+        """Kill the worker running the session."""
+        self.pool.kill_worker(self.worker)
+
+
+class WorkerPool:
+    """
+    Fixed number of worker processes sharing the debug sessions.
+
+    Each session lives in one worker for its whole life, new sessions go to
+    the worker hosting the fewest. Workers that exited are replaced when the
+    next session is created.
+    """
+
+    def __init__(self, processes: int, start_method: str = "spawn"):
+        self.processes = processes
+        self.context = multiprocessing.get_context(start_method)
+        self.workers: List[Worker] = []
+        self._lock = threading.Lock()
+
+    def _pick_worker(self) -> Worker:
+        with self._lock:
+            self.workers = [worker for worker in self.workers if worker.alive]
+            if len(self.workers) < self.processes:
+                worker = Worker(self.context)
+                self.workers.append(worker)
+            else:
+                worker = min(self.workers, key=lambda worker: len(worker.sessions))
+            return worker
+
+    def create_session(self, session_id: str, *args, **kwargs) -> RemoteSession:
+        """
+        Create a session in a worker.
+
+        Args:
+            session_id: Id the session is known by in the server
+            *args, **kwargs: Arguments of DebugSession
+
+        Returns:
+            Proxy to the new session
+        """
+        worker = self._pick_worker()
+        worker.request(session_id, "create", args, kwargs)
+        worker.sessions.add(session_id)
+        return RemoteSession(session_id, worker, self)
+
+    def release(self, session: RemoteSession) -> None:
+        """Forget a closed session."""
+        session.worker.sessions.discard(session.id)
+
+    def metrics_snapshots(self) -> List[Dict]:
+        """Snapshots of the metrics of the workers still running."""
+        with self._lock:
+            workers = [worker for worker in self.workers if worker.alive]
+        snapshots = []
+        for worker in workers:
+            try:
+                snapshots.append(worker.request("", "metrics"))
+            except WorkerError:
+                # Exited meanwhile, its metrics are lost anyway
+                pass
+        return snapshots
+
+    def kill_worker(self, worker: Worker) -> None:
+        """Kill a worker, ending all its sessions."""
+        with self._lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+        worker.kill()
+
+    def shutdown(self) -> None:
+        """Kill every worker."""
+        with self._lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.kill()
+
+
+class ForkServerPool(WorkerPool):
+    """
+    One worker per session, forked from a server process that has already
+    imported the debugger and common modules.
+
+    Forking skips interpreter startup and imports, and a few idle workers
+    are kept forked ahead of time, so a new session only waits for a pipe
+    round trip. Closing or terminating a session kills just its worker.
+
+    As a worker only hosts one session, max_memory (bytes, 0 for no limit)
+    caps what the session's program can allocate.
+    """
+
+    def __init__(self, warm_workers: int, max_memory: int = 0):
+        start_method = "forkserver"
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = "spawn"
+        super().__init__(processes=0, start_method=start_method)
+        if start_method == "forkserver":
+            self.context.set_forkserver_preload(PRELOAD_MODULES)
+
+        self.warm_workers = warm_workers
+        self.max_memory = max_memory
+        # Forked workers waiting for a session
+        self.idle: List[Worker] = []
+        self._refilling = False
+        self._refill()
+
+    def _refill(self) -> None:
+        """Fork workers in the background until enough of them are idle."""
+        with self._lock:
+            if self._refilling or len(self.idle) >= self.warm_workers:
+                return
+            self._refilling = True
+
+        def fork_idle_workers():
+            while True:
+                with self._lock:
+                    self.idle = [worker for worker in self.idle if worker.alive]
+                    if len(self.idle) >= self.warm_workers:
+                        self._refilling = False
+                        return
+                worker = Worker(self.context, self.max_memory)
+                with self._lock:
+                    self.idle.append(worker)
+
+        threading.Thread(target=fork_idle_workers, daemon=True).start()
+
+    def _pick_worker(self) -> Worker:
+        worker = None
+        with self._lock:
+            while self.idle and worker is None:
+                candidate = self.idle.pop()
+                if candidate.alive:
+                    worker = candidate
+        if worker is None:
+            # Burst of sessions: don't wait for the background forks
+            worker = Worker(self.context, self.max_memory)
+        with self._lock:
+            self.workers.append(worker)
+        self._refill()
+        return worker
+
+    def release(self, session: RemoteSession) -> None:
+        """The session was closed, its worker has nothing else to do."""
+        self.kill_worker(session.worker)
+
+    def run_once(self, method: str, args: tuple = (), timeout: float = REQUEST_TIMEOUT) -> Any:
+        """
+        Run a request that isn't about a session in a worker of its own,
+        killed afterwards, e.g. one test case of the judge.
+
+        Raises:
+            WorkerError: If the worker exited, didn't answer in time or the
+                call raised an exception
+        """
+        worker = self._pick_worker()
+        try:
+            return worker.request("", method, args, timeout=timeout)
+        finally:
+            self.kill_worker(worker)
+
+    def shutdown(self) -> None:
+        """Kill every worker, idle or not."""
+        with self._lock:
+            # Stop refilling
+            self.warm_workers = 0
+            idle, self.idle = self.idle, []
+        for worker in idle:
+            worker.kill()
+        super().shutdown()